@@ -1,15 +1,28 @@
 # File having all the functions for database calls
+from collections import defaultdict
+from dataclasses import fields
 from datetime import datetime
 import hashlib
+import logging
 import os
 import random
+import threading
 
-from sqlalchemy import text, select, or_, func, and_
+from flask import current_app
+from sqlalchemy import text, select, func, and_, update, insert, bindparam, union
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 
 import constants
-from aspiration_index_calculator import calculate_aspiration_index
+from aspiration_index_calculator import calculate_aspiration_indices, calculate_followup_aspiration_index, \
+    calculate_aspiration_history, simulate_aspiration_weights, invalidate_weight_model, latest_aspiration_followup_ids
 from models import *
 from configurations import *
+from cache import TTLCache
+from search_index import SurvivorSearchIndex
+from survivor_import import map_row, length_errors, CONTACT_HEADER, RELATION_HEADER
+
+logger = logging.getLogger(__name__)
 
 
 def allowed_file(filename):
@@ -21,10 +34,257 @@ def get_filename(sid, ext):
     return 'survivor_' + str(sid) + '.' + str(ext)
 
 
+# single-row sections of the survivor profile in response order, with the column telling whether the row exists
+PROFILE_SECTIONS = [
+    ('SID', PersonalInformation),
+    ('HOSPITALID', HospitalInfo),
+    ('DETAIL_ID', FamilyDetails),
+    ('COMMUNICATION_ID', CommunicationDetails),
+    ('STATUS_ID', SJFLStatus),
+    ('NEXT_FOLLOW_UP_ID', NextFollowUp),
+    ('STATUS_UPDATE_ID', StatusUpdate),
+]
+
+
+def version_tag(version, sharedVersion):
+    '''
+    Combines the persisted version of a survivor with the one shared by all survivors, missing rows count as 0
+    '''
+    return "{}.{}".format(version or 0, sharedVersion or 0)
+
+
+def budget_line_totals(model):
+    '''
+    Subquery of SUM(UNIT * PERIOD * UNIT_COST) per BUDGET_TBL_ID over a budget line table
+    '''
+    return select(model.BUDGET_TBL_ID,
+                  func.sum(model.UNIT * model.PERIOD * model.UNIT_COST).label('TOTAL')) \
+        .group_by(model.BUDGET_TBL_ID) \
+        .subquery()
+
+
+def normalize_phone(number, country_code=None):
+    '''
+    E.164-style key of a phone number: '+', country code and subscriber number, digits only.
+    Numbers without a country code get constants.default_phone_country_code, a leading trunk 0 is dropped.
+    :return: the key or None when the value does not look like a phone number
+    '''
+    if number is None:
+        return None
+    country_code = country_code or constants.default_phone_country_code
+    # spreadsheet cells holding numbers come as 9876543210.0
+    if isinstance(number, float) and number.is_integer():
+        number = int(number)
+    number = str(number).strip()
+    if number.endswith('.0'):
+        number = number[:-2]
+    digits = ''.join(char for char in number if char.isdigit())
+    if number.startswith('+'):
+        key = digits
+    elif digits.startswith('00'):
+        key = digits[2:]
+    elif digits.startswith('0'):
+        key = country_code + digits[1:]
+    elif len(digits) == 10:
+        key = country_code + digits
+    elif len(digits) == 10 + len(country_code) and digits.startswith(country_code):
+        key = digits
+    else:
+        return None
+    if not 8 <= len(key) <= 15:
+        return None
+    return '+' + key
+
+
+def survivor_records(record, contacts, statusId):
+    '''
+    Model objects adding one survivor, for save_survivor_data and the spreadsheet import alike
+    :param record: {column: value} of the survivor, see survivor_import.map_row
+    :param contacts: [(phone number, relation)]
+    :param statusId: STATUS_ID the survivor starts with, see DBHelper.get_status_id
+    '''
+    sid = record['SID']
+    return [
+        PersonalInformation(SID=sid, FIRST_NAME=record['FIRST_NAME'], LAST_NAME=record.get('LAST_NAME'),
+                            DATE_OF_BIRTH=record.get('DATE_OF_BIRTH'), GENDER=record['GENDER'],
+                            NATIONALITY=record.get('NATIONALITY'), BLOOD_GROUP=record.get('BLOOD_GROUP'),
+                            PHOTO_URL=record.get('PHOTO_URL', ''), STATUS_ID=statusId,
+                            LOCATION=record.get('LOCATION'), CENTRE=record.get('CENTRE'),
+                            ADMISSION_DATE=record.get('ADMISSION_DATE')),
+        HospitalInfo(HOSPITAL_NAME=record['HOSPITAL_NAME'], HOSPITAL_REGNO=record['HOSPITAL_REGNO'],
+                     HOSPITAL_REGDATE=record.get('HOSPITAL_REGDATE'), CANCER_TYPE=record['CANCER_TYPE'],
+                     CANCER_STAGE=record.get('CANCER_STAGE', ''), DOCTOR_NAME=record.get('DOCTOR_NAME'), SID=sid),
+        FamilyDetails(FATHER_NAME=record.get('FATHER_NAME'), FATHER_DOB=record.get('FATHER_DOB'),
+                      FATHER_QUALIFICATION=record.get('FATHER_QUALIFICATION'),
+                      FATHER_OCCUPATION=record.get('FATHER_OCCUPATION'),
+                      FATHER_INCOME_MONTHLY=record.get('FATHER_INCOME_MONTHLY'),
+                      MOTHER_NAME=record.get('MOTHER_NAME'), MOTHER_DOB=record.get('MOTHER_DOB'),
+                      MOTHER_QUALIFICATION=record.get('MOTHER_QUALIFICATION'),
+                      MOTHER_OCCUPATION=record.get('MOTHER_OCCUPATION'),
+                      MOTHER_INCOME_MONTHLY=record.get('MOTHER_INCOME_MONTHLY'),
+                      SIBLING_DETAILS=record.get('SIBLING_DETAILS', ''), REMARKS=record.get('REMARKS'), SID=sid),
+        CommunicationDetails(ADDRESS=record['ADDRESS'], DISTRICT=record.get('DISTRICT'), STATE=record.get('STATE'),
+                             COUNTRY=record.get('COUNTRY'), PINCODE=record.get('PINCODE'), EMAIL=record.get('EMAIL'),
+                             SID=sid),
+        StatusUpdate(SID=sid, REMARKS='To be Onboarded', STATUS_ID=statusId),
+    ] + [Contacts(SID=sid, PHONE_NUMBER=number, PHONE_KEY=normalize_phone(number), CONTACT_RELATION=relation,
+                  LAST_UPDATED=datetime.today()) for number, relation in contacts]
+
+
+def profile_columns(model):
+    # label every column with its table so sections sharing column names (SID, STATUS_ID) stay apart
+    return [getattr(model, field.name).label(model.__tablename__ + '_' + field.name) for field in fields(model)]
+
+
+def profile_section(row, model, key):
+    # builds the jsonify-able section straight from the row, {} when the outer joined row does not exist
+    values = row._mapping
+    if values[model.__tablename__ + '_' + key] is None:
+        return {}
+    return {field.name: values[model.__tablename__ + '_' + field.name] for field in fields(model)}
+
+
 class DBHelper(object):
 
     def __init__(self):
-        pass
+        # assembled survivor profiles by SID, only served while the survivor's version is the one they were read at
+        self.profile_cache = TTLCache(maxsize=constants.profile_cache_size, ttl=constants.profile_cache_ttl)
+        # budget totals by ('survivor', SID) and by grouping of the cross-survivor views
+        self.budget_rollup_cache = TTLCache(maxsize=constants.budget_rollup_cache_size,
+                                            ttl=constants.budget_rollup_cache_ttl)
+        # survivor listing totals by filter, approximate by design
+        self.survivor_count_cache = TTLCache(maxsize=256, ttl=constants.survivor_count_ttl)
+        # survivor names and SIDs for the search box, kept current by the methods writing them
+        self.search_index = SurvivorSearchIndex(refresh_interval=constants.search_index_refresh_interval)
+        # STATUS_ID by STATUS, the statuses are reference data
+        self.status_ids = {}
+
+    def get_status_id(self, status):
+        '''
+        Returns the STATUS_ID of a status looked up by name as update_status does, cached once found
+        :param status: STATUS in TBL_SJFL_STATUS
+        '''
+        if status not in self.status_ids:
+            result = db.session.query(SJFLStatus).filter(SJFLStatus.STATUS == status).all()
+            if len(result) <= 0:
+                raise ValueError("Status %s not configured in database" % status)
+            self.status_ids[status] = result[0].STATUS_ID
+        return self.status_ids[status]
+
+    def invalidate_survivor(self, sid):
+        '''
+        Drops everything cached for a survivor and bumps its version, to be called by every method writing survivor
+        data once its change is committed
+        :param sid: survivors id, nothing is versioned when it is not known
+        '''
+        self.profile_cache.invalidate(str(sid))
+        try:
+            self.bump_survivor_version(int(sid))
+        except (TypeError, ValueError):
+            pass
+
+    def invalidate_all_survivors(self):
+        '''
+        Drops every cached profile and bumps the version shared by all survivors, to be called once a change to data
+        every survivor's profile or followups include (questions, aspiration weights) is committed
+        '''
+        self.profile_cache.clear()
+        self.bump_survivor_version(ALL_SURVIVORS)
+
+    def bump_survivor_version(self, sid, commit=True):
+        '''
+        Increments the persisted data version of a survivor in its own transaction. It runs after the write has
+        committed, so a version can be older than the data it is read with but never newer, whichever worker
+        process serves the next read.
+        :param sid: survivors id, ALL_SURVIVORS for the data shared by all of them
+        :param commit: False to bump it in the caller's transaction instead, committed together with the change
+        '''
+        bump = update(SurvivorVersion).where(SurvivorVersion.SID == sid).values(VERSION=SurvivorVersion.VERSION + 1)
+        if not commit:
+            if db.session.execute(bump).rowcount == 0:
+                db.session.add(SurvivorVersion(SID=sid, VERSION=1))
+            return
+        try:
+            if db.session.execute(bump).rowcount == 0:
+                db.session.add(SurvivorVersion(SID=sid, VERSION=1))
+            db.session.commit()
+        except IntegrityError:
+            # the row was created by a concurrent first write
+            db.session.rollback()
+            db.session.execute(bump)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Version of survivor %s not bumped", sid)
+
+    def invalidate_budget_rollups(self, sid=None):
+        '''
+        Drops the cached budget totals of a survivor and the cross-survivor totals that include them
+        :param sid: survivors id, every cached total is dropped when not known
+        '''
+        if sid is None:
+            self.budget_rollup_cache.clear()
+            return
+        self.budget_rollup_cache.invalidate(('survivor', str(sid)))
+        self.budget_rollup_cache.invalidate(('centre',))
+        self.budget_rollup_cache.invalidate(('survivors',))
+
+    def build_search_index(self, wait=True):
+        '''
+        (Re)loads the survivor search index from TBL_PERSONAL_INFORMATION
+        :param wait: when another build is running, wait for it to finish instead of returning at once
+        '''
+        def load():
+            rows = db.session.query(PersonalInformation.SID, PersonalInformation.FIRST_NAME,
+                                    PersonalInformation.LAST_NAME, HospitalInfo.HOSPITAL_REGNO,
+                                    CommunicationDetails.DISTRICT, CommunicationDetails.PINCODE) \
+                .outerjoin(HospitalInfo, HospitalInfo.SID == PersonalInformation.SID) \
+                .outerjoin(CommunicationDetails, CommunicationDetails.SID == PersonalInformation.SID) \
+                .all()
+            phones = defaultdict(list)
+            for sid, phone in db.session.query(Contacts.SID, Contacts.PHONE_NUMBER).all():
+                phones[sid].append(phone)
+            return (dict(row._asdict(), PHONE_NUMBER=phones.get(row.SID, [])) for row in rows)
+
+        try:
+            self.search_index.build(load, wait)
+            return "SUCCESS", len(self.search_index)
+        except Exception as e:
+            db.session.rollback()
+            return "ERROR", str(e)
+
+    def refresh_search_index(self):
+        '''
+        Makes sure the search index can answer: built in the request when it never was, rebuilt in a background
+        thread while the current content keeps answering when it is stale. One build runs at a time.
+        :return: "SUCCESS", number of survivors indexed / "ERROR", message when the index could not be built at all
+        '''
+        if self.search_index.built_at is None:
+            return self.build_search_index()
+        if self.search_index.is_stale() and not self.search_index.is_building():
+            threading.Thread(target=self._rebuild_search_index, args=(current_app._get_current_object(),),
+                             name='search-index-build', daemon=True).start()
+        return "SUCCESS", len(self.search_index)
+
+    def _rebuild_search_index(self, app):
+        with app.app_context():
+            status, error = self.build_search_index(wait=False)
+            if status != "SUCCESS":
+                logger.warning("Survivor search index not rebuilt, the previous content is still used: %s", error)
+
+    def get_survivor_version(self, sid):
+        '''
+        Returns the persisted data version of a survivor combined with the one shared by all survivors,
+        "0.0" until their first write
+        :param sid: survivors id
+        '''
+        try:
+            sid = int(sid)
+        except ValueError:
+            return "0.0"
+        versions = dict(db.session.query(SurvivorVersion.SID, SurvivorVersion.VERSION)
+                        .filter(SurvivorVersion.SID.in_([sid, ALL_SURVIVORS])).all())
+        return version_tag(versions.get(sid), versions.get(ALL_SURVIVORS))
 
     def test_connection(self):
         sql = text("select 'connection successful' ")
@@ -87,7 +347,23 @@ class DBHelper(object):
                 db.session.rollback()
                 db.session.flush()
                 return str(e)
-        db.session.commit()
+        try:
+            # active flags of aspiration questions are part of the compiled weight model and the stored indices
+            if futype.upper() == 'ASPIRATION':
+                self.refresh_aspiration_indices()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            db.session.flush()
+            invalidate_weight_model()
+            return str(e)
+        if futype.upper() == 'ASPIRATION':
+            invalidate_weight_model()
+            # the shared version was bumped with the change
+            self.profile_cache.clear()
+        else:
+            # the questions are part of every survivor's followups
+            self.invalidate_all_survivors()
         return "Successfully updated followup question"
 
     def update_aspiration_waightage(self, data):
@@ -118,10 +394,32 @@ class DBHelper(object):
                 db.session.rollback()
                 db.session.flush()
                 return str(e)
-        # commit changes
-        db.session.commit()
+        try:
+            self.refresh_aspiration_indices()
+            # commit changes
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            db.session.flush()
+            invalidate_weight_model()
+            return str(e)
+        invalidate_weight_model()
+        # the shared version was bumped with the change
+        self.profile_cache.clear()
         return "Successfully updated aspiration question weightages"
 
+    def simulate_aspiration_waightage(self, data, top=20):
+        '''
+        Recomputes the aspiration index of every survivor with candidate weights, nothing is persisted
+        :param data: list of weightage details, same as update_aspiration_waightage
+        :param top: number of largest movers to return
+        :return: distributions before/after, their shift and the largest movers
+        '''
+        try:
+            return "SUCCESS", simulate_aspiration_weights(data, top)
+        except Exception as e:
+            return "ERROR", str(e)
+
     def add_followup_questions(self, data):
         # loop into question details received, and form a list of FollowupQuestions objects to add
         questions_to_add = []
@@ -144,6 +442,7 @@ class DBHelper(object):
         try:
             db.session.add_all(questions_to_add)
             db.session.commit()
+            self.invalidate_all_survivors()
             return "Successfully added followup questions"
         except Exception as e:
             db.session.rollback()
@@ -182,11 +481,16 @@ class DBHelper(object):
 
             # make entries in the database
             db.session.add(aspiration_weight_details)
+            self.refresh_aspiration_indices()
             db.session.commit()
+            invalidate_weight_model()
+            # the shared version was bumped with the change
+            self.profile_cache.clear()
             return "Successfully added aspiration index question"
         except Exception as e:
             db.session.rollback()
             db.session.flush()
+            invalidate_weight_model()
             return str(e)
 
     def get_followup_questions_with_answers_for_survivor(self, sid, futype):
@@ -246,128 +550,210 @@ class DBHelper(object):
             return "ERROR", str(e)
 
     def save_survivor_data(self, survivors):
-        personalInformationData = []
-        familyInfoData = []
-        communicationInfoData = []
-        contactInfoData = []
-        hospitalInfoData = []
-        sjfl_status_updates = []
+        '''
+        Adds the survivors of an onboarding sheet sent as rows, in one transaction. The rows are built by
+        survivor_records, as for a spreadsheet import.
+        :param survivors: list of {sheet header: value}, the last entry is left out
+        '''
+        added = []
         try:
-            for i, d in enumerate(survivors[:-1]):
-                if len(d) == 0:
-                    continue
-                data = {}
-                req_data = {}
-                contact_details = []
+            statusId = self.get_status_id(constants.to_be_enrolled_status)
+            for d in survivors[:-1]:
+                record = {}
+                contacts = []
                 for k, v in d.items():
-                    mapKey = EXCEL_TO_COLUMN_MAP.get(k)
-                    if "Contact No" not in k and "Relation" not in k:
-                        req_data[mapKey] = v
-                    elif "Contact No" in k:
-                        contact_info = {}
-                        contact_number = k[-1]
-                        relationKey = "Relation to Patient-" + contact_number
-                        contact_info[v] = d.get(relationKey)
-                        contact_details.append(contact_info)
-                req_data['STATUS'] = constants.TO_BE_ENROLLED_ID
-                data['details'] = req_data
-                data['contact_info'] = contact_details
-                survivor_data = data.get('details')
-                sid = survivor_data.get('SID')
-                if sid is None:
+                    match = CONTACT_HEADER.match(k)
+                    if match:
+                        contacts.append((v, d.get(RELATION_HEADER + match.group(1))))
+                    elif EXCEL_TO_COLUMN_MAP.get(k) not in (None, 'CONTACT_RELATION'):
+                        record[EXCEL_TO_COLUMN_MAP[k]] = v
+                if record.get('SID') is None:
                     continue
+                added.append((record, contacts, survivor_records(record, contacts, statusId)))
 
-                personalInformation = PersonalInformation(
-                    SID=sid,
-                    FIRST_NAME=survivor_data.get('FIRST_NAME'),
-                    LAST_NAME=survivor_data.get('LAST_NAME'),
-                    DATE_OF_BIRTH=survivor_data.get('DATE_OF_BIRTH'),
-                    GENDER=survivor_data.get('GENDER'),
-                    NATIONALITY=survivor_data.get('NATIONALITY'),
-                    BLOOD_GROUP=survivor_data.get('BLOOD_GROUP'),
-                    PHOTO_URL=survivor_data['PHOTO_URL'],
-                    STATUS_ID=survivor_data['STATUS'],
-                    LOCATION=survivor_data['LOCATION'],
-                    CENTRE=survivor_data['CENTRE'],
-                    ADMISSION_DATE=survivor_data['ADMISSION_DATE']
-                )
-                personalInformationData.append(personalInformation)
-
-                hospitalInformation = HospitalInfo(
-                    HOSPITAL_NAME=survivor_data.get('HOSPITAL_NAME'),
-                    HOSPITAL_REGNO=survivor_data.get('HOSPITAL_REGNO'),
-                    HOSPITAL_REGDATE=survivor_data.get('HOSPITAL_REGDATE'),
-                    CANCER_TYPE=survivor_data['CANCER_TYPE'],
-                    DOCTOR_NAME=survivor_data['DOCTOR_NAME'],
-                    SID=sid
-                )
-                hospitalInfoData.append(hospitalInformation)
-
-                # db.session.add(hospitalInformation)
-                familyInfo = FamilyDetails(
-                    FATHER_NAME=survivor_data['FATHER_NAME'],
-                    FATHER_DOB=survivor_data['FATHER_DOB'],
-                    FATHER_QUALIFICATION=survivor_data['FATHER_QUALIFICATION'],
-                    FATHER_OCCUPATION=survivor_data['FATHER_OCCUPATION'],
-                    FATHER_INCOME_MONTHLY=survivor_data['FATHER_INCOME_MONTHLY'],
-                    MOTHER_NAME=survivor_data['MOTHER_NAME'],
-                    MOTHER_DOB=survivor_data['MOTHER_DOB'],
-                    MOTHER_QUALIFICATION=survivor_data['MOTHER_QUALIFICATION'],
-                    MOTHER_OCCUPATION=survivor_data['MOTHER_OCCUPATION'],
-                    MOTHER_INCOME_MONTHLY=survivor_data['MOTHER_INCOME_MONTHLY'],
-                    SIBLING_DETAILS=str(survivor_data.get('SIBLING_DETAILS')),
-                    REMARKS=survivor_data['REMARKS'],
-                    SID=sid
-                )
-                familyInfoData.append(familyInfo)
-
-                # db.session.add(familyInfo)
-                communicationInfo = CommunicationDetails(
-                    ADDRESS=survivor_data['ADDRESS'],
-                    DISTRICT=survivor_data['DISTRICT'],
-                    STATE=survivor_data['STATE'],
-                    COUNTRY=survivor_data['COUNTRY'],
-                    PINCODE=survivor_data['PINCODE'],
-                    EMAIL=survivor_data['EMAIL'],
-                    SID=sid
-                )
-                communicationInfoData.append(communicationInfo)
-                # db.session.add(communicationInfo)
-                contact_details = data['contact_info']
-                contact_full_data = []
-                for item in contact_details:
-                    for k, v in item.items():
-                        contactInfo = Contacts(
-                            SID=sid,
-                            PHONE_NUMBER=k,
-                            CONTACT_RELATION=v,
-                            LAST_UPDATED=datetime.today()
-                        )
-                        contact_full_data.append(contactInfo)
-                        # db.session.add(contactInfo)
-                contactInfoData.append(contact_full_data)
-                sjfl_status_update = StatusUpdate(SID=sid, REMARKS='To be Onboarded',STATUS_ID=constants.TO_BE_ENROLLED_ID)
-                sjfl_status_updates.append(sjfl_status_update)
-
-            db.session.bulk_save_objects(personalInformationData)
-            db.session.bulk_save_objects(hospitalInfoData, )
-            db.session.bulk_save_objects(familyInfoData, )
-            db.session.bulk_save_objects(communicationInfoData, )
-            for contact_d in contactInfoData:
-                db.session.bulk_save_objects(contact_d, )
-            db.session.bulk_save_objects(sjfl_status_updates, )
+            self.add_survivor_records([row for _, _, records in added for row in records])
             db.session.commit()
+            for record, contacts, _ in added:
+                self.index_survivor(record, contacts)
             return "Successfully added survivor details"
         except Exception as e:
             db.session.rollback()
             db.session.flush()
             return str(e)
 
-    def get_all_survivors(filter=None):
-        # TODO: where is this being used??
-        stmt = select(PersonalInformation)
-        result = db.session.execute(stmt)
-        return result
+    def add_survivor_records(self, records):
+        '''
+        Bulk inserts the rows of survivor_records, does not commit
+        '''
+        # bulk_save_objects only batches consecutive objects of a model, survivors go first for the foreign keys
+        db.session.bulk_save_objects(sorted(records, key=lambda record: (not isinstance(record, PersonalInformation),
+                                                                         type(record).__name__)))
+
+    def index_survivor(self, record, contacts):
+        '''
+        Adds a survivor built by survivor_records to the search index
+        '''
+        self.search_index.update(record['SID'],
+                                 FIRST_NAME=record.get('FIRST_NAME'),
+                                 LAST_NAME=record.get('LAST_NAME'),
+                                 HOSPITAL_REGNO=record.get('HOSPITAL_REGNO'),
+                                 DISTRICT=record.get('DISTRICT'),
+                                 PINCODE=record.get('PINCODE'),
+                                 PHONE_NUMBER=[number for number, relation in contacts])
+
+    def import_survivors(self, rows, chunkSize=None):
+        '''
+        Adds the survivors of an onboarding spreadsheet, committing them chunkSize at a time so that memory use
+        does not grow with the file and a bad row only costs itself: rows failing validation are skipped, and a
+        chunk the database rejects is retried row by row to find the culprits
+        :param rows: iterable of (row number, {header: value}), see survivor_import.read_rows
+        :param chunkSize: survivors per commit, constants.import_chunk_size when not given
+        :return: "SUCCESS", SurvivorImportReport / "ERROR", message (the chunks committed until then are kept)
+        '''
+        chunkSize = chunkSize or constants.import_chunk_size
+        report = SurvivorImportReport(ROWS=0, IMPORTED=0, FAILED=0, CHUNKS=0, ERRORS=[], ERRORS_TRUNCATED=False)
+        chunk = {}
+        try:
+            statusId = self.get_status_id(constants.to_be_enrolled_status)
+            for rowNumber, row in rows:
+                report.ROWS += 1
+                record, contacts, errors = map_row(row)
+                sid = record.get('SID')
+                if not errors:
+                    records = survivor_records(record, contacts, statusId)
+                    errors = length_errors(records)
+                if not errors and sid in chunk:
+                    errors = ['Patient ID %s is repeated on row %d' % (sid, chunk[sid][0])]
+                if errors:
+                    self._import_failed(report, rowNumber, sid, errors)
+                    continue
+                chunk[sid] = (rowNumber, record, contacts, records)
+                if len(chunk) >= chunkSize:
+                    self._import_chunk(chunk, report)
+                    chunk = {}
+            if chunk:
+                self._import_chunk(chunk, report)
+            return "SUCCESS", report
+        except Exception as e:
+            db.session.rollback()
+            return "ERROR", "%s (%d survivors imported before the error)" % (str(e), report.IMPORTED)
+
+    def _import_failed(self, report, rowNumber, sid, errors):
+        report.FAILED += 1
+        if len(report.ERRORS) < constants.import_error_report_limit:
+            report.ERRORS.append(SurvivorImportError(ROW=rowNumber, SID=sid, ERRORS=errors))
+        else:
+            report.ERRORS_TRUNCATED = True
+
+    def _import_chunk(self, chunk, report):
+        # SIDs taken by earlier chunks or earlier imports, one query for the chunk
+        existing = {row.SID for row in db.session.query(PersonalInformation.SID)
+                    .filter(PersonalInformation.SID.in_(list(chunk))).all()}
+        for sid in existing:
+            rowNumber = chunk.pop(sid)[0]
+            self._import_failed(report, rowNumber, sid, ['Patient ID %s already exists' % sid])
+        if not chunk:
+            return
+        try:
+            self.add_survivor_records([record for item in chunk.values() for record in item[3]])
+            db.session.commit()
+            imported = list(chunk.values())
+        except Exception:
+            db.session.rollback()
+            imported = []
+            for item in chunk.values():
+                try:
+                    db.session.bulk_save_objects(item[3])
+                    db.session.commit()
+                    imported.append(item)
+                except Exception as e:
+                    db.session.rollback()
+                    self._import_failed(report, item[0], item[1]['SID'], [str(getattr(e, 'orig', e))])
+        report.IMPORTED += len(imported)
+        report.CHUNKS += 1
+        for rowNumber, record, contacts, records in imported:
+            self.index_survivor(record, contacts)
+
+    def get_all_survivors(self, filters=None, after=None, limit=50, columns=None):
+        '''
+        One keyset page of survivors ordered by SID, seeking past the last SID of the previous page
+        instead of counting an OFFSET, so every page costs the same however deep it is
+        :param filters: dict with any of STATUS_ID (list), CENTRE, LOCATION, ADMITTED_FROM, ADMITTED_TO (dates)
+        :param after: last SID of the previous page, None for the first page
+        :param limit: survivors per page
+        :param columns: PersonalInformation fields to return, all when None. SID is always returned.
+        :return: "SUCCESS", {"survivors", "next", "limit", "total", "total_is_approximate"} / "INVALID", message
+                 / "ERROR", message
+        '''
+        filters = filters or {}
+        known = [field.name for field in fields(PersonalInformation)]
+        columns = columns or known
+        unknown = [column for column in columns if column not in known]
+        if unknown:
+            return "INVALID", "Unknown fields: " + ", ".join(unknown)
+        columns = ['SID'] + [column for column in columns if column != 'SID']
+
+        conditions = []
+        if filters.get('STATUS_ID'):
+            conditions.append(PersonalInformation.STATUS_ID.in_(filters['STATUS_ID']))
+        if filters.get('CENTRE'):
+            conditions.append(PersonalInformation.CENTRE == filters['CENTRE'])
+        if filters.get('LOCATION'):
+            conditions.append(PersonalInformation.LOCATION == filters['LOCATION'])
+        if filters.get('ADMITTED_FROM'):
+            conditions.append(PersonalInformation.ADMISSION_DATE >= filters['ADMITTED_FROM'])
+        if filters.get('ADMITTED_TO'):
+            conditions.append(PersonalInformation.ADMISSION_DATE <= filters['ADMITTED_TO'])
+
+        try:
+            query = db.session.query(*[getattr(PersonalInformation, column) for column in columns]).filter(*conditions)
+            if after is not None:
+                query = query.filter(PersonalInformation.SID > after)
+            # one extra row tells whether there is a next page
+            rows = query.order_by(PersonalInformation.SID).limit(limit + 1).all()
+            hasMore = len(rows) > limit
+            rows = rows[:limit]
+
+            results = {
+                "survivors": [row._asdict() for row in rows],
+                "next": rows[-1].SID if hasMore else None,
+                "limit": limit
+            }
+            # the total is only worked out for the first page, following pages do not pay for it again
+            if after is None:
+                results["total"] = self.count_survivors(filters, conditions)
+                results["total_is_approximate"] = True
+            return "SUCCESS", results
+        except Exception as e:
+            return "ERROR", str(e)
+
+    def count_survivors(self, filters, conditions):
+        '''
+        Approximate number of survivors matching the filters. Without filters SQL Server's row count metadata is read
+        instead of scanning the table, filtered counts are reused for constants.survivor_count_ttl seconds.
+        '''
+        key = tuple(sorted((name, str(value)) for name, value in filters.items() if value))
+        total = self.survivor_count_cache.get(key)
+        if total is not None:
+            return total
+        total = None
+        if not conditions and db.engine.dialect.name == 'mssql':
+            # sys.partitions only needs the metadata visibility the app has on its own tables,
+            # unlike sys.dm_db_partition_stats which requires VIEW DATABASE STATE
+            try:
+                total = db.session.execute(text(
+                    "SELECT SUM(rows) FROM sys.partitions "
+                    "WHERE object_id = OBJECT_ID(:table) AND index_id IN (0, 1)"),
+                    {"table": PersonalInformation.__tablename__}).scalar()
+            except Exception:
+                db.session.rollback()
+                logger.warning("Row count metadata of %s not readable, counting instead",
+                               PersonalInformation.__tablename__, exc_info=True)
+        if total is None:
+            total = db.session.query(func.count(PersonalInformation.SID)).filter(*conditions).scalar()
+        total = int(total or 0)
+        self.survivor_count_cache.put(key, total)
+        return total
 
     def add_user(self, ngo_user):
         try:
@@ -420,8 +806,15 @@ class DBHelper(object):
                 )
             db.session.add_all(answers_to_be_added)
 
-            # commit only after both operations have completed
+            # keep the stored aspiration index in step with the latest ASPIRATION followup
+            futype = db.session.query(FollowUpTypes.FOLLOWUPTYPE).filter(FollowUpTypes.FOLLOWUPTYPEID == futypeid).scalar()
+            if futype == 'ASPIRATION':
+                db.session.flush()
+                self.store_aspiration_index(master_entry)
+
+            # commit only after all operations have completed
             db.session.commit()
+            self.invalidate_survivor(sid)
             return "Successfully added new FollowUp"
         except Exception as e:
             db.session.rollback()
@@ -454,133 +847,178 @@ class DBHelper(object):
         except Exception as e:
             return "ERROR", str(e)
 
-    def get_survivor_info(self, sid):
+    def get_survivor_info(self, sid, version=None):
+        '''
+        Returns the survivor profile, from the profile cache while the survivor's version is unchanged
+        :param sid: survivors id
+        :param version: version of the survivor already read by the caller (e.g. for its ETag), read when not given
+        '''
         # index: 0 => personal info
         # index: 1 => hospital info
         # index: 2 => family info
         # index: 3 => residence/communication info
         # index: 4 => contact info
         # index: 5 => SJFL status info
-        # index: 6 => aspiration index info
+        # index: 6 => next followup info
+        # index: 7 => SJFL status update info
+        # index: 8 => aspiration index info
 
-        results = []
         try:
-            # get survivor details from personal information table
-            result_personalInfo = db.session.query(PersonalInformation).filter(PersonalInformation.SID == sid).all()
-            converted_result_personalInfo = PersonalInformation(
-                SID=result_personalInfo[0].SID,
-                FIRST_NAME=result_personalInfo[0].FIRST_NAME,
-                LAST_NAME=result_personalInfo[0].LAST_NAME,
-                GENDER=result_personalInfo[0].GENDER,
-                NATIONALITY=result_personalInfo[0].NATIONALITY,
-                BLOOD_GROUP=result_personalInfo[0].BLOOD_GROUP,
-                PHOTO_URL=result_personalInfo[0].PHOTO_URL,
-                DATE_OF_BIRTH=result_personalInfo[0].DATE_OF_BIRTH,
-                STATUS_ID=result_personalInfo[0].STATUS_ID,
-                WELCOME_KIT_DISPATCH_DATE=result_personalInfo[0].WELCOME_KIT_DISPATCH_DATE,
-                ADMISSION_DATE=result_personalInfo[0].ADMISSION_DATE,
-                LOCATION=result_personalInfo[0].LOCATION,
-                CENTRE=result_personalInfo[0].CENTRE
-            )
-            results.append(converted_result_personalInfo)
-
-            result_hospitalInfo = db.session.query(HospitalInfo).filter(HospitalInfo.SID == sid).all()
-            converted_result_hospitalInfo = HospitalInfo(
-                HOSPITALID=result_hospitalInfo[0].HOSPITALID,
-                HOSPITAL_NAME=result_hospitalInfo[0].HOSPITAL_NAME,
-                HOSPITAL_REGNO=result_hospitalInfo[0].HOSPITAL_REGNO,
-                HOSPITAL_REGDATE=result_hospitalInfo[0].HOSPITAL_REGDATE,
-                CANCER_TYPE=result_hospitalInfo[0].CANCER_TYPE,
-                DOCTOR_NAME=result_hospitalInfo[0].DOCTOR_NAME,
-                CANCER_STAGE=result_hospitalInfo[0].CANCER_STAGE,
-                SID=result_hospitalInfo[0].SID
-            )
-            results.append(converted_result_hospitalInfo)
-
-            result_familyInfo = db.session.query(FamilyDetails).filter(FamilyDetails.SID == sid).all()
-            converted_result_familyInfo = FamilyDetails(
-                DETAIL_ID=result_familyInfo[0].DETAIL_ID,
-                FATHER_NAME=result_familyInfo[0].FATHER_NAME,
-                FATHER_DOB=result_familyInfo[0].FATHER_DOB,
-                FATHER_QUALIFICATION=result_familyInfo[0].FATHER_QUALIFICATION,
-                FATHER_OCCUPATION=result_familyInfo[0].FATHER_OCCUPATION,
-                FATHER_INCOME_MONTHLY=result_familyInfo[0].FATHER_INCOME_MONTHLY,
-                MOTHER_NAME=result_familyInfo[0].MOTHER_NAME,
-                MOTHER_DOB=result_familyInfo[0].MOTHER_DOB,
-                MOTHER_QUALIFICATION=result_familyInfo[0].MOTHER_QUALIFICATION,
-                MOTHER_OCCUPATION=result_familyInfo[0].MOTHER_OCCUPATION,
-                MOTHER_INCOME_MONTHLY=result_familyInfo[0].MOTHER_INCOME_MONTHLY,
-                SIBLING_DETAILS=result_familyInfo[0].SIBLING_DETAILS,
-                REMARKS=result_familyInfo[0].REMARKS,
-                SID=result_familyInfo[0].SID
-            )
-            results.append(converted_result_familyInfo)
-
-            result_communicationInfo = db.session.query(CommunicationDetails).filter(CommunicationDetails.SID == sid).all()
-            converted_result_communicationInfo = CommunicationDetails(
-                COMMUNICATION_ID=result_communicationInfo[0].COMMUNICATION_ID,
-                ADDRESS=result_communicationInfo[0].ADDRESS,
-                DISTRICT=result_communicationInfo[0].DISTRICT,
-                STATE=result_communicationInfo[0].STATE,
-                COUNTRY=result_communicationInfo[0].COUNTRY,
-                PINCODE=result_communicationInfo[0].PINCODE,
-                EMAIL=result_communicationInfo[0].EMAIL,
-                SID=result_communicationInfo[0].SID
-            )
-            results.append(converted_result_communicationInfo)
+            # entries are stamped with the version they were read at, the version is persisted so writes made
+            # through another worker process make the entry unusable
+            if version is None:
+                version = self.get_survivor_version(sid)
+            cached = self.profile_cache.get(str(sid), version)
+            if cached is not None:
+                return "SUCCESS", cached
+
+            # every single-row section is outer joined on the personal information, so one query loads them all,
+            # together with the versions the profile is read at
+            columns = [column for _, model in PROFILE_SECTIONS for column in profile_columns(model)]
+            survivorVersion = aliased(SurvivorVersion)
+            sharedVersion = aliased(SurvivorVersion)
+            profile = db.session.query(*columns, AspirationIndex.ASPIRATION_INDEX,
+                                       survivorVersion.VERSION.label('VERSION'),
+                                       sharedVersion.VERSION.label('SHARED_VERSION')) \
+                .select_from(PersonalInformation) \
+                .join(HospitalInfo, HospitalInfo.SID == PersonalInformation.SID, isouter=True) \
+                .join(FamilyDetails, FamilyDetails.SID == PersonalInformation.SID, isouter=True) \
+                .join(CommunicationDetails, CommunicationDetails.SID == PersonalInformation.SID, isouter=True) \
+                .join(SJFLStatus, SJFLStatus.STATUS_ID == PersonalInformation.STATUS_ID, isouter=True) \
+                .join(NextFollowUp, and_(NextFollowUp.SID == PersonalInformation.SID,
+                                         NextFollowUp.FOLLOWUPTYPEID == 2), isouter=True) \
+                .join(StatusUpdate, and_(StatusUpdate.SID == PersonalInformation.SID,
+                                         StatusUpdate.STATUS_ID == PersonalInformation.STATUS_ID), isouter=True) \
+                .join(AspirationIndex, AspirationIndex.SID == PersonalInformation.SID, isouter=True) \
+                .join(survivorVersion, survivorVersion.SID == PersonalInformation.SID, isouter=True) \
+                .join(sharedVersion, sharedVersion.SID == ALL_SURVIVORS, isouter=True) \
+                .filter(PersonalInformation.SID == sid) \
+                .first()
+            if profile is None:
+                return "ERROR", "No survivor found with SID " + str(sid)
+
+            results = [profile_section(profile, model, key) for key, model in PROFILE_SECTIONS]
+
+            contacts = db.session.query(*profile_columns(Contacts)).filter(Contacts.SID == sid).limit(5).all()
+            results.insert(4, [profile_section(contact, Contacts, 'CONTACT_ID') for contact in contacts])
+
+            results.append(profile.ASPIRATION_INDEX if profile.ASPIRATION_INDEX is not None else 0)
+            # versions are bumped after the write commits, so the data is never older than the version read with it
+            self.profile_cache.put(str(sid), results, version_tag(profile.VERSION, profile.SHARED_VERSION))
+            return "SUCCESS", results
+        except Exception as e:
+            return "ERROR", str(e)
 
-            contact_list = []
-            result_contactInfo = db.session.query(Contacts).filter(Contacts.SID == sid).limit(5).all()
-            for result in result_contactInfo:
-                converted_result_contactInfo = Contacts(
-                    CONTACT_ID=result.CONTACT_ID,
-                    SID=result.SID,
-                    PHONE_NUMBER=result.PHONE_NUMBER,
-                    LAST_UPDATED=result.LAST_UPDATED,
-                    CONTACT_RELATION=result.CONTACT_RELATION
-                )
-                contact_list.append(converted_result_contactInfo)
+    def store_aspiration_index(self, followup):
+        '''
+        Computes the aspiration index of a followup and stores it as the survivor's current index.
+        Does not commit, the caller's transaction covers both the answers and the index.
+        :param followup: FollowupMaster entry of an ASPIRATION followup with its answers flushed
+        '''
+        db.session.merge(AspirationIndex(SID=followup.SID,
+                                         ASPIRATION_INDEX=calculate_followup_aspiration_index(followup.FOLLOWUPID),
+                                         FOLLOWUPID=followup.FOLLOWUPID,
+                                         FOLLOWUPDATE=followup.FOLLOWUPDATE))
 
-            results.append(contact_list)
+    def check_aspiration_index(self, repair=False):
+        '''
+        Recomputes every survivor's aspiration index from the raw answers and compares it with the stored one
+        :param repair: overwrite drifted or missing stored values with the recomputed ones
+        :return: list of dicts, one per survivor whose stored value drifted
+        '''
+        computed = calculate_aspiration_indices()
+        drift = self._aspiration_index_drift(computed)
 
-            result_statusInfo = db.session.query(SJFLStatus).filter(
-                SJFLStatus.STATUS_ID == result_personalInfo[0].STATUS_ID).all()
-            converted_result_statusInfo = SJFLStatus(
-                STATUS_ID=result_statusInfo[0].STATUS_ID,
-                STATUS=result_statusInfo[0].STATUS
-            )
-            results.append(converted_result_statusInfo)
-
-            result_nextFollowUpInfo = db.session.query(NextFollowUp).filter(NextFollowUp.FOLLOWUPTYPEID == 2,
-                                                                            NextFollowUp.SID == sid).all()
-            if len(result_nextFollowUpInfo) > 0:
-                converted_result_nextFollowUpInfo = NextFollowUp(
-                    NEXT_FOLLOW_UP_ID=result_nextFollowUpInfo[0].NEXT_FOLLOW_UP_ID,
-                    FOLLOWUPTYPEID=result_nextFollowUpInfo[0].FOLLOWUPTYPEID,
-                    NEXTFOLLOWUPDATE=result_nextFollowUpInfo[0].NEXTFOLLOWUPDATE,
-                    LASTMODIFIEDBY=result_nextFollowUpInfo[0].LASTMODIFIEDBY,
-                    LASTMODIFIEDDATE=result_nextFollowUpInfo[0].LASTMODIFIEDDATE,
-                    SID=result_nextFollowUpInfo[0].SID
-                )
-                results.append(converted_result_nextFollowUpInfo)
-            else:
-                results.append({})
-
-            result_statusUpdateInfo = db.session.query(StatusUpdate).filter(
-                StatusUpdate.STATUS_ID == result_personalInfo[0].STATUS_ID,
-                StatusUpdate.SID == result_personalInfo[0].SID).all()
-            converted_result_statusUpdateInfo = StatusUpdate(
-                SID=result_statusUpdateInfo[0].SID,
-                STATUS_ID=result_statusUpdateInfo[0].STATUS_ID,
-                REMARKS=result_statusUpdateInfo[0].REMARKS
-            )
-            results.append(converted_result_statusUpdateInfo)
+        if repair and drift:
+            try:
+                self._store_aspiration_indices(drift, computed)
+                db.session.commit()
+                self.invalidate_all_survivors()
+            except Exception:
+                db.session.rollback()
+                db.session.flush()
+                raise
+        return drift
 
-            # index: calculate and get the aspiration index value
-            aspiration_index = calculate_aspiration_index(sid)
-            results.append(aspiration_index)
+    def refresh_aspiration_indices(self):
+        '''
+        Recomputes every stored aspiration index with the current aspiration questions and weights, to be called by
+        the methods changing them. Does not commit, the caller's transaction covers the change, the indices and the
+        bump of the shared version that makes every worker process rebuild its compiled weights.
+        :return: list of the SIDs whose stored index changed
+        '''
+        # the compiled weights are rebuilt from the flushed, not yet committed, questions and weights
+        db.session.flush()
+        self.bump_survivor_version(ALL_SURVIVORS, commit=False)
+        invalidate_weight_model()
+        computed = calculate_aspiration_indices()
+        drift = self._aspiration_index_drift(computed)
+        self._store_aspiration_indices(drift, computed)
+        return [item['SID'] for item in drift]
+
+    def _aspiration_index_drift(self, computed):
+        stored = {row.SID: row.ASPIRATION_INDEX for row in db.session.query(AspirationIndex).all()}
+        drift = []
+        for sid in set(computed) | set(stored):
+            expected = computed.get(sid, 0)
+            actual = stored.get(sid)
+            if actual is None or abs(actual - expected) > 0.005:
+                drift.append({'SID': sid, 'STORED': actual, 'COMPUTED': expected})
+        return drift
+
+    def _store_aspiration_indices(self, drift, computed):
+        # survivors left without an ASPIRATION followup lose their row, the others are written in two batches
+        removed = [item['SID'] for item in drift if item['SID'] not in computed]
+        if removed:
+            db.session.query(AspirationIndex).filter(AspirationIndex.SID.in_(removed)) \
+                .delete(synchronize_session=False)
+        latest = latest_aspiration_followup_ids()
+        followups = {row.SID: row for row in
+                     db.session.query(FollowupMaster.SID, FollowupMaster.FOLLOWUPID, FollowupMaster.FOLLOWUPDATE)
+                     .join(latest, latest.c.FOLLOWUPID == FollowupMaster.FOLLOWUPID).all()}
+        updated = []
+        inserted = []
+        for item in drift:
+            followup = followups.get(item['SID'])
+            if item['SID'] in removed or followup is None:
+                continue
+            values = {"sid": item['SID'], "aspiration_index": item['COMPUTED'],
+                      "followupid": followup.FOLLOWUPID, "followupdate": followup.FOLLOWUPDATE}
+            (inserted if item['STORED'] is None else updated).append(values)
+        if updated:
+            db.session.execute(update(AspirationIndex)
+                               .where(AspirationIndex.SID == bindparam('sid'))
+                               .values(ASPIRATION_INDEX=bindparam('aspiration_index'),
+                                       FOLLOWUPID=bindparam('followupid'),
+                                       FOLLOWUPDATE=bindparam('followupdate')),
+                               updated)
+        if inserted:
+            db.session.execute(insert(AspirationIndex)
+                               .values(SID=bindparam('sid'),
+                                       ASPIRATION_INDEX=bindparam('aspiration_index'),
+                                       FOLLOWUPID=bindparam('followupid'),
+                                       FOLLOWUPDATE=bindparam('followupdate')),
+                               inserted)
+
+    def get_aspiration_indices(self, sids=None):
+        '''
+        Returns the latest aspiration index of many survivors computed in one query
+        :param sids: list of survivor ids, None for all survivors
+        :return: dict of sid => aspiration index
+        '''
+        try:
+            return "SUCCESS", calculate_aspiration_indices(sids)
+        except Exception as e:
+            return "ERROR", str(e)
 
-            return "SUCCESS", results
+    def get_aspiration_history(self, sid):
+        '''
+        Returns the aspiration index of every ASPIRATION followup of a survivor, oldest first
+        :param sid: survivors id
+        :return: list of AspirationIndexHistory
+        '''
+        try:
+            return "SUCCESS", calculate_aspiration_history(sid)
         except Exception as e:
             return "ERROR", str(e)
 
@@ -588,104 +1026,218 @@ class DBHelper(object):
         results = {}
         budgets = {}
         items = {}
-        
-        result_budget = db.session.query(Budget).filter(Budget.SID == sid).all()
+
+        # every ITEM of the survivor's budget tables, whether it has an actual line, a projected line or both,
+        # each branch scoped to them so that the lines of other survivors are not read
+        survivorBudgets = select(Budget.BUDGET_TBL_ID).where(Budget.SID == sid)
+        lines = union(select(BudgetActualSpent.BUDGET_TBL_ID, BudgetActualSpent.ITEM)
+                      .where(BudgetActualSpent.BUDGET_TBL_ID.in_(survivorBudgets)),
+                      select(BudgetProjected.BUDGET_TBL_ID, BudgetProjected.ITEM)
+                      .where(BudgetProjected.BUDGET_TBL_ID.in_(survivorBudgets))).subquery()
+        result_budget = db.session.query(Budget, BudgetActualSpent, BudgetProjected) \
+            .join(lines, lines.c.BUDGET_TBL_ID == Budget.BUDGET_TBL_ID, isouter=True) \
+            .join(BudgetActualSpent, and_(BudgetActualSpent.BUDGET_TBL_ID == lines.c.BUDGET_TBL_ID,
+                                          BudgetActualSpent.ITEM == lines.c.ITEM), isouter=True) \
+            .join(BudgetProjected, and_(BudgetProjected.BUDGET_TBL_ID == lines.c.BUDGET_TBL_ID,
+                                        BudgetProjected.ITEM == lines.c.ITEM), isouter=True) \
+            .filter(Budget.SID == sid) \
+            .order_by(Budget.BUDGET_TBL_ID, lines.c.ITEM) \
+            .all()
         if result_budget==[]:
             return None
-        for result in result_budget:
-            id = result.BUDGET_TBL_ID
-            tempBudget = Budget(
-                BUDGET_TBL_ID = result.BUDGET_TBL_ID,
-                SID = result.SID,
-                BUDGET_NAME = result.BUDGET_NAME
-            ) 
-            budgets[result.BUDGET_TBL_ID] = tempBudget
-
-            actual = db.session.query(BudgetActualSpent).filter(BudgetActualSpent.BUDGET_TBL_ID == id).order_by(BudgetActualSpent.ITEM).all()
-            projected = db.session.query(BudgetProjected).filter(BudgetProjected.BUDGET_TBL_ID == id).order_by(BudgetProjected.ITEM).all()
-            table = {}
-            for i in range(0,len(actual)):
-                tempActual = BudgetActualSpent(
-                    ACTUAL_ID = actual[i].ACTUAL_ID,
-                    BUDGET_TBL_ID = actual[i].BUDGET_TBL_ID,	
-                    ITEM = actual[i].ITEM,
-                    UNIT = actual[i].UNIT,
-                    PERIOD = actual[i].PERIOD,
-                    UNIT_COST = actual[i].UNIT_COST
-                )
-                tempProjected = BudgetProjected(
-                    PROJECTED_ID = projected[i].PROJECTED_ID,
-                    BUDGET_TBL_ID = projected[i].BUDGET_TBL_ID,	
-                    ITEM = projected[i].ITEM,
-                    UNIT = projected[i].UNIT,
-                    PERIOD = projected[i].PERIOD,
-                    UNIT_COST = projected[i].UNIT_COST
-                )
-                table[projected[i].ITEM] = {"actual":tempActual, "projected":tempProjected}
-            items[result.BUDGET_TBL_ID] = table
+
+        for budget, actual, projected in result_budget:
+            if budget.BUDGET_TBL_ID not in budgets:
+                budgets[budget.BUDGET_TBL_ID] = budget
+                items[budget.BUDGET_TBL_ID] = {}
+            # a line missing on one side is returned as None instead of being paired with another item
+            line = actual or projected
+            if line is not None:
+                items[budget.BUDGET_TBL_ID][line.ITEM] = {"actual": actual, "projected": projected}
 
         results["budget"] = budgets
         results["items"] = items
 
         return results
 
+    def get_budget_rollup(self, sid):
+        '''
+        Totals of UNIT * PERIOD * UNIT_COST for the actual and projected lines of each budget table of a survivor,
+        and of the survivor overall. VARIANCE is ACTUAL - PROJECTED, positive when spending is over the projection.
+        :param sid: survivors id
+        :return: "SUCCESS", {"tables": [BudgetTableRollup], "survivor": SurvivorBudgetRollup} / "ERROR", message
+        '''
+        cached = self.budget_rollup_cache.get(('survivor', str(sid)))
+        if cached is not None:
+            return "SUCCESS", cached
+        try:
+            actual = budget_line_totals(BudgetActualSpent)
+            projected = budget_line_totals(BudgetProjected)
+            actual_total = func.coalesce(actual.c.TOTAL, 0)
+            projected_total = func.coalesce(projected.c.TOTAL, 0)
+            rows = db.session.query(Budget.BUDGET_TBL_ID, Budget.BUDGET_NAME, Budget.SID,
+                                    actual_total.label('ACTUAL'), projected_total.label('PROJECTED'),
+                                    (actual_total - projected_total).label('VARIANCE')) \
+                .outerjoin(actual, actual.c.BUDGET_TBL_ID == Budget.BUDGET_TBL_ID) \
+                .outerjoin(projected, projected.c.BUDGET_TBL_ID == Budget.BUDGET_TBL_ID) \
+                .filter(Budget.SID == sid) \
+                .order_by(Budget.BUDGET_TBL_ID) \
+                .all()
+            centre = db.session.query(PersonalInformation.CENTRE).filter(PersonalInformation.SID == sid).scalar()
+
+            tables = [BudgetTableRollup(BUDGET_TBL_ID=row.BUDGET_TBL_ID, BUDGET_NAME=row.BUDGET_NAME, SID=row.SID,
+                                        ACTUAL=round(row.ACTUAL, 2), PROJECTED=round(row.PROJECTED, 2),
+                                        VARIANCE=round(row.VARIANCE, 2)) for row in rows]
+            total_actual = sum(row.ACTUAL for row in rows)
+            total_projected = sum(row.PROJECTED for row in rows)
+            survivor = SurvivorBudgetRollup(SID=int(sid), CENTRE=centre, BUDGET_TABLES=len(rows),
+                                            ACTUAL=round(total_actual, 2), PROJECTED=round(total_projected, 2),
+                                            VARIANCE=round(total_actual - total_projected, 2))
+            results = {"tables": tables, "survivor": survivor}
+            self.budget_rollup_cache.put(('survivor', str(sid)), results)
+            return "SUCCESS", results
+        except Exception as e:
+            return "ERROR", str(e)
+
+    def get_budget_rollups(self, group='centre', centre=None):
+        '''
+        Budget totals across survivors, grouped in SQL by centre or by survivor
+        :param group: 'centre' or 'survivor'
+        :param centre: only the survivors of this centre, used with group 'survivor'
+        :return: "SUCCESS", [CentreBudgetRollup] or [SurvivorBudgetRollup] / "ERROR", message
+        '''
+        if group not in ('centre', 'survivor'):
+            return "ERROR", "group must be centre or survivor"
+        key = ('centre',) if group == 'centre' else ('survivors',)
+        results = self.budget_rollup_cache.get(key)
+        try:
+            if results is None:
+                actual = budget_line_totals(BudgetActualSpent)
+                projected = budget_line_totals(BudgetProjected)
+                actual_total = func.sum(func.coalesce(actual.c.TOTAL, 0))
+                projected_total = func.sum(func.coalesce(projected.c.TOTAL, 0))
+                if group == 'centre':
+                    columns = [PersonalInformation.CENTRE, func.count(func.distinct(Budget.SID)).label('SURVIVORS')]
+                    grouping = [PersonalInformation.CENTRE]
+                else:
+                    columns = [Budget.SID, PersonalInformation.CENTRE]
+                    grouping = [Budget.SID, PersonalInformation.CENTRE]
+                rows = db.session.query(*columns,
+                                        func.count(Budget.BUDGET_TBL_ID).label('BUDGET_TABLES'),
+                                        actual_total.label('ACTUAL'), projected_total.label('PROJECTED'),
+                                        (actual_total - projected_total).label('VARIANCE')) \
+                    .select_from(Budget) \
+                    .join(PersonalInformation, PersonalInformation.SID == Budget.SID) \
+                    .outerjoin(actual, actual.c.BUDGET_TBL_ID == Budget.BUDGET_TBL_ID) \
+                    .outerjoin(projected, projected.c.BUDGET_TBL_ID == Budget.BUDGET_TBL_ID) \
+                    .group_by(*grouping) \
+                    .order_by(*grouping) \
+                    .all()
+                if group == 'centre':
+                    results = [CentreBudgetRollup(CENTRE=row.CENTRE, SURVIVORS=row.SURVIVORS,
+                                                  BUDGET_TABLES=row.BUDGET_TABLES, ACTUAL=round(row.ACTUAL, 2),
+                                                  PROJECTED=round(row.PROJECTED, 2), VARIANCE=round(row.VARIANCE, 2))
+                               for row in rows]
+                else:
+                    results = [SurvivorBudgetRollup(SID=row.SID, CENTRE=row.CENTRE, BUDGET_TABLES=row.BUDGET_TABLES,
+                                                    ACTUAL=round(row.ACTUAL, 2), PROJECTED=round(row.PROJECTED, 2),
+                                                    VARIANCE=round(row.VARIANCE, 2))
+                               for row in rows]
+                self.budget_rollup_cache.put(key, results)
+            if centre is not None:
+                results = [result for result in results if result.CENTRE == centre]
+            return "SUCCESS", results
+        except Exception as e:
+            return "ERROR", str(e)
+
     def get_plan(self, sid):
         results = {}
         resultCol = {}
         resultRow = {}
         resultData = {}
 
-        result_plan = db.session.query(Plan).filter(Plan.SID == sid).all()
-        if result_plan==[]:
+        # the survivor's plan with every row header x column header pair and its cell, in one query
+        grid = db.session.query(Plan.PLAN_TBL_ID,
+                                Plan.VERSION,
+                                PlanColY.PLAN_COL_Y_ID,
+                                PlanColY.COL_HEADER.label('ROW_HEADER'),
+                                PlanColX.PLAN_COL_X_ID,
+                                PlanColX.COL_HEADER,
+                                PlanData.PLAN_DATA) \
+            .select_from(Plan) \
+            .join(PlanColY, PlanColY.PLAN_TBL_ID == Plan.PLAN_TBL_ID, isouter=True) \
+            .join(PlanColX, PlanColX.PLAN_TBL_ID == Plan.PLAN_TBL_ID, isouter=True) \
+            .join(PlanData, and_(PlanData.PLAN_COL_Y_ID == PlanColY.PLAN_COL_Y_ID,
+                                 PlanData.PLAN_COL_X_ID == PlanColX.PLAN_COL_X_ID), isouter=True) \
+            .filter(Plan.SID == sid) \
+            .order_by(Plan.PLAN_TBL_ID, PlanColY.PLAN_COL_Y_ID, PlanColX.PLAN_COL_X_ID) \
+            .all()
+        if grid == []:
             return None
 
-        planID = result_plan[0].PLAN_TBL_ID
-        result_X = db.session.query(PlanColX).filter(PlanColX.PLAN_TBL_ID == planID).all()
-        result_Y = db.session.query(PlanColY).filter(PlanColY.PLAN_TBL_ID == planID).all()
-
-        for row in result_Y:
-            resultRow[row.PLAN_COL_Y_ID] = row.COL_HEADER
-
-        for col in result_X:
-            resultCol[col.PLAN_COL_X_ID] = col.COL_HEADER
-
-        for row in result_Y:
-            for col in result_X:
-                data = db.session.query(PlanData).filter(PlanData.PLAN_COL_Y_ID == row.PLAN_COL_Y_ID, PlanData.PLAN_COL_X_ID == col.PLAN_COL_X_ID).all()
-                key = str(row.PLAN_COL_Y_ID) +"-"+ str(col.PLAN_COL_X_ID)
-                value = data[0].PLAN_DATA
-                resultData[key] = value
+        # pivot the rows in memory, only the survivor's first plan is returned
+        planID = grid[0].PLAN_TBL_ID
+        for cell in grid:
+            if cell.PLAN_TBL_ID != planID:
+                break
+            if cell.PLAN_COL_Y_ID is not None:
+                resultRow[cell.PLAN_COL_Y_ID] = cell.ROW_HEADER
+            if cell.PLAN_COL_X_ID is not None:
+                resultCol[cell.PLAN_COL_X_ID] = cell.COL_HEADER
+            if cell.PLAN_COL_Y_ID is not None and cell.PLAN_COL_X_ID is not None:
+                key = str(cell.PLAN_COL_Y_ID) + "-" + str(cell.PLAN_COL_X_ID)
+                # a cell that was never stored is returned empty
+                resultData[key] = cell.PLAN_DATA if cell.PLAN_DATA is not None else ""
 
         results["Rows"] = resultRow
         results["Cols"] = resultCol
         results["Data"] = resultData
+        results["Version"] = grid[0].VERSION
         return results
 
-    def update_budget(self, items):
-        failed = False
+    def update_budget(self, items, sid=None):
+        '''
+        Writes the UNIT, PERIOD and UNIT_COST of budget lines as one executemany for the actual lines and one for
+        the projected lines, in a single transaction
+        :param items: {BUDGET_TBL_ID: {ITEM: {"actual": {...}, "projected": {...}}}} as returned by get_budget
+        :param sid: survivors id owning the budgets, its cached budget totals are dropped
+        :return: "SUCCESS", number of lines submitted / "ERROR", message. Drivers do not all count the rows an
+                 executemany changed, so the lines actually matched are not known.
+        '''
+        actual = []
+        projected = []
         try:
-            for k_items, v_items in items.items():
-                result_budget = db.session.query(Budget).filter(Budget.BUDGET_TBL_ID == k_items).all()[0]
+            for k_items, v_items in (items or {}).items():
                 for k, v in v_items.items():
-                    a = v["actual"]
-                    db.session.query(BudgetActualSpent).filter(BudgetActualSpent.ACTUAL_ID == a["ACTUAL_ID"]).update(
-                    {BudgetActualSpent.UNIT: a["UNIT"],
-                    BudgetActualSpent.PERIOD: a["PERIOD"],
-                    BudgetActualSpent.UNIT_COST: a["UNIT_COST"]})
-
-                    p = v["projected"]
-                    db.session.query(BudgetProjected).filter(BudgetProjected.PROJECTED_ID ==p["PROJECTED_ID"]).update(
-                    {BudgetProjected.UNIT: p["UNIT"],
-                    BudgetProjected.PERIOD: p["PERIOD"],
-                    BudgetProjected.UNIT_COST: p["UNIT_COST"]})
-            
+                    # get_budget returns None for the side of a line that only exists as actual or as projected
+                    a = v.get("actual")
+                    if a is not None:
+                        actual.append({"line_id": a["ACTUAL_ID"], "budget_id": k_items, "unit": a["UNIT"],
+                                       "period": a["PERIOD"], "unit_cost": a["UNIT_COST"]})
+                    p = v.get("projected")
+                    if p is not None:
+                        projected.append({"line_id": p["PROJECTED_ID"], "budget_id": k_items, "unit": p["UNIT"],
+                                          "period": p["PERIOD"], "unit_cost": p["UNIT_COST"]})
+
+            for model, key, batch in ((BudgetActualSpent, BudgetActualSpent.ACTUAL_ID, actual),
+                                      (BudgetProjected, BudgetProjected.PROJECTED_ID, projected)):
+                if not batch:
+                    continue
+                db.session.execute(update(model)
+                                   .where(key == bindparam('line_id'),
+                                          model.BUDGET_TBL_ID == bindparam('budget_id'))
+                                   .values(UNIT=bindparam('unit'), PERIOD=bindparam('period'),
+                                           UNIT_COST=bindparam('unit_cost')),
+                                   batch)
+
             db.session.commit()
+            self.invalidate_budget_rollups(sid)
+            self.invalidate_survivor(sid)
+            return "SUCCESS", len(actual) + len(projected)
         except Exception as e:
-            print(e)
+            logger.exception("Budget update failed")
             db.session.rollback()
-            db.session.flush()
-            failed = True
-        return failed
+            return "ERROR", str(e)
 
     def add_plan(self, sid):
         failed = False
@@ -694,6 +1246,7 @@ class DBHelper(object):
             db.session.add(plan)            
             
             db.session.commit()
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
@@ -727,56 +1280,195 @@ class DBHelper(object):
                 db.session.add(actual)            
 
             db.session.commit()
+            self.invalidate_budget_rollups(sid)
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
             failed = True
         return failed
 
+    def lock_plan(self, sid):
+        '''
+        Returns the survivor's first plan locked for update with its version bumped, the bump is kept only on commit
+        '''
+        plan = db.session.query(Plan).filter(Plan.SID == sid).order_by(Plan.PLAN_TBL_ID).with_for_update().first()
+        plan.VERSION = (plan.VERSION or 0) + 1
+        return plan
+
+    def load_plan_grid(self, planID):
+        '''
+        Reads the headers and cells of a plan with the version each was last written in
+        :return: rows and cols as id: (header, version), cells as (y, x): (data, version) or None when never stored
+        '''
+        grid = db.session.query(PlanColY.PLAN_COL_Y_ID, PlanColY.COL_HEADER.label('ROW_HEADER'),
+                                PlanColY.VERSION.label('ROW_VERSION'),
+                                PlanColX.PLAN_COL_X_ID, PlanColX.COL_HEADER, PlanColX.VERSION.label('COL_VERSION'),
+                                PlanData.PLAN_DATA_ID, PlanData.PLAN_DATA, PlanData.VERSION) \
+            .select_from(Plan) \
+            .join(PlanColY, PlanColY.PLAN_TBL_ID == Plan.PLAN_TBL_ID, isouter=True) \
+            .join(PlanColX, PlanColX.PLAN_TBL_ID == Plan.PLAN_TBL_ID, isouter=True) \
+            .join(PlanData, and_(PlanData.PLAN_COL_Y_ID == PlanColY.PLAN_COL_Y_ID,
+                                 PlanData.PLAN_COL_X_ID == PlanColX.PLAN_COL_X_ID), isouter=True) \
+            .filter(Plan.PLAN_TBL_ID == planID) \
+            .all()
+        rows = {}
+        cols = {}
+        cells = {}
+        for cell in grid:
+            if cell.PLAN_COL_Y_ID is not None:
+                rows[cell.PLAN_COL_Y_ID] = (cell.ROW_HEADER, cell.ROW_VERSION)
+            if cell.PLAN_COL_X_ID is not None:
+                cols[cell.PLAN_COL_X_ID] = (cell.COL_HEADER, cell.COL_VERSION)
+            if cell.PLAN_COL_Y_ID is not None and cell.PLAN_COL_X_ID is not None:
+                key = (cell.PLAN_COL_Y_ID, cell.PLAN_COL_X_ID)
+                cells[key] = (cell.PLAN_DATA, cell.VERSION) if cell.PLAN_DATA_ID is not None else None
+        return rows, cols, cells
+
+    def save_plan_headers(self, planID, rows, cols, version):
+        '''
+        Writes row and column headers of a plan in one executemany each. Does not commit.
+        :param rows: dict of PLAN_COL_Y_ID to the header text
+        :param cols: dict of PLAN_COL_X_ID to the header text
+        :param version: plan version the headers are written in
+        '''
+        if rows:
+            db.session.execute(update(PlanColY)
+                               .where(PlanColY.PLAN_TBL_ID == planID, PlanColY.PLAN_COL_Y_ID == bindparam('y_id'))
+                               .values(COL_HEADER=bindparam('header'), VERSION=version),
+                               [{"y_id": int(row), "header": rows[row]} for row in rows])
+        if cols:
+            db.session.execute(update(PlanColX)
+                               .where(PlanColX.PLAN_TBL_ID == planID, PlanColX.PLAN_COL_X_ID == bindparam('x_id'))
+                               .values(COL_HEADER=bindparam('header'), VERSION=version),
+                               [{"x_id": int(col), "header": cols[col]} for col in cols])
+
     def update_plan(self, sid, rows, cols, data):
         failed = False
         try:
-            result_plan = db.session.query(Plan).filter(Plan.SID == sid).all()
-            planID = result_plan[0].PLAN_TBL_ID
-
-            for row in rows:
-                y_id = int(row)
-                db.session.query(PlanColY).filter(PlanColY.PLAN_TBL_ID == planID, PlanColY.PLAN_COL_Y_ID == y_id).update(
-                {PlanColY.COL_HEADER: rows[row]})
-            
-            for col in cols:
-                x_id = int(col)
-                db.session.query(PlanColX).filter(PlanColX.PLAN_TBL_ID == planID, PlanColX.PLAN_COL_X_ID == x_id).update(
-                {PlanColX.COL_HEADER: cols[col]})
+            plan = self.lock_plan(sid)
+            planID = plan.PLAN_TBL_ID
 
-            for d in data:
-                y,x = d.split("-")
-                y_id = int(y)
-                x_id = int(x)
-                db.session.query(PlanData).filter(PlanData.PLAN_COL_Y_ID == y_id, PlanData.PLAN_COL_X_ID == x_id).update(
-                {PlanData.PLAN_DATA: data[d]})
+            # one executemany per table, keyed by the header ids and scoped to the survivor's plan
+            self.save_plan_headers(planID, rows, cols, plan.VERSION)
+            if data:
+                self.save_plan_cells(planID, data, plan.VERSION)
 
             db.session.commit()
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
             failed = True
         return failed
 
+    def save_plan_cells(self, planID, data, version, cells=None):
+        '''
+        Writes "y-x" keyed cells of a plan in bulk, cells of the plan that were never stored are inserted.
+        Does not commit.
+        :param planID: PLAN_TBL_ID the cells belong to
+        :param data: dict of "PLAN_COL_Y_ID-PLAN_COL_X_ID" to the cell text
+        :param version: plan version the cells are written in
+        :param cells: the plan's cells as returned by load_plan_grid, read when not given
+        '''
+        if cells is None:
+            cells = self.load_plan_grid(planID)[2]
+
+        updates = []
+        inserts = []
+        for d in data:
+            y, x = d.split("-")
+            key = (int(y), int(x))
+            if key not in cells:
+                raise ValueError("Plan cell {} does not belong to plan {}".format(d, planID))
+            if cells[key] is not None:
+                updates.append({"y_id": key[0], "x_id": key[1], "value": data[d]})
+            else:
+                inserts.append({"PLAN_COL_Y_ID": key[0], "PLAN_COL_X_ID": key[1], "PLAN_DATA": data[d],
+                                "VERSION": version})
+
+        if updates:
+            db.session.execute(update(PlanData)
+                               .where(PlanData.PLAN_COL_Y_ID == bindparam('y_id'),
+                                      PlanData.PLAN_COL_X_ID == bindparam('x_id'))
+                               .values(PLAN_DATA=bindparam('value'), VERSION=version),
+                               updates)
+        if inserts:
+            db.session.execute(insert(PlanData), inserts)
+
+    def apply_plan_delta(self, sid, baseVersion, rows, cols, data):
+        '''
+        Applies only the changed headers and cells of a plan, atomically, on top of the version the client read.
+        A header or cell written after baseVersion, or deleted since, is a conflict and nothing is applied.
+        :param baseVersion: "Version" of the plan the client edited
+        :param rows: changed row headers, PLAN_COL_Y_ID: text
+        :param cols: changed column headers, PLAN_COL_X_ID: text
+        :param data: changed cells, "PLAN_COL_Y_ID-PLAN_COL_X_ID": text
+        :return: "SUCCESS", new version / "CONFLICT", current version with the current value of each conflicting key
+                 / "ERROR", message
+        '''
+        rows = rows or {}
+        cols = cols or {}
+        data = data or {}
+        try:
+            plan = self.lock_plan(sid)
+            currentVersion = plan.VERSION - 1
+            gridRows, gridCols, gridCells = self.load_plan_grid(plan.PLAN_TBL_ID)
+
+            conflictRows = {}
+            conflictCols = {}
+            conflictData = {}
+            # deleted headers and cells come back as None
+            for row in rows:
+                current = gridRows.get(int(row))
+                if current is None or current[1] > baseVersion:
+                    conflictRows[row] = current[0] if current else None
+            for col in cols:
+                current = gridCols.get(int(col))
+                if current is None or current[1] > baseVersion:
+                    conflictCols[col] = current[0] if current else None
+            for d in data:
+                y, x = d.split("-")
+                key = (int(y), int(x))
+                if key not in gridCells:
+                    conflictData[d] = None
+                elif gridCells[key] is not None and gridCells[key][1] > baseVersion:
+                    conflictData[d] = gridCells[key][0]
+
+            if conflictRows or conflictCols or conflictData:
+                db.session.rollback()
+                return "CONFLICT", {"Version": currentVersion, "Rows": conflictRows, "Cols": conflictCols,
+                                    "Data": conflictData}
+
+            if not (rows or cols or data):
+                db.session.rollback()
+                return "SUCCESS", currentVersion
+
+            self.save_plan_headers(plan.PLAN_TBL_ID, rows, cols, plan.VERSION)
+            if data:
+                self.save_plan_cells(plan.PLAN_TBL_ID, data, plan.VERSION, gridCells)
+            newVersion = plan.VERSION
+            db.session.commit()
+            self.invalidate_survivor(sid)
+            return "SUCCESS", newVersion
+        except Exception as e:
+            db.session.rollback()
+            return "ERROR", str(e)
+
     def add_plan_row(self, sid, newRow, rowData):
         failed = False
         try:
-            result_plan = db.session.query(Plan).filter(Plan.SID == sid).all()
-            planID = result_plan[0].PLAN_TBL_ID
-            row = PlanColY(PLAN_TBL_ID = planID, COL_HEADER = newRow)
+            plan = self.lock_plan(sid)
+            row = PlanColY(PLAN_TBL_ID = plan.PLAN_TBL_ID, COL_HEADER = newRow, VERSION = plan.VERSION)
             db.session.add(row)
             db.session.flush()
-            db.session.refresh(row)
-            for data in rowData:
-                tempData = PlanData(PLAN_COL_X_ID=data, PLAN_COL_Y_ID=row.PLAN_COL_Y_ID, PLAN_DATA=rowData[data])
-                db.session.add(tempData)            
-            
+            if rowData:
+                db.session.execute(insert(PlanData),
+                                   [{"PLAN_COL_X_ID": int(data), "PLAN_COL_Y_ID": row.PLAN_COL_Y_ID,
+                                     "PLAN_DATA": rowData[data], "VERSION": plan.VERSION} for data in rowData])
+
             db.session.commit()
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
@@ -786,17 +1478,17 @@ class DBHelper(object):
     def add_plan_col(self, sid, newCol, colData):
         failed = False
         try:
-            result_plan = db.session.query(Plan).filter(Plan.SID == sid).all()
-            planID = result_plan[0].PLAN_TBL_ID
-            col = PlanColX(PLAN_TBL_ID = planID, COL_HEADER = newCol)
+            plan = self.lock_plan(sid)
+            col = PlanColX(PLAN_TBL_ID = plan.PLAN_TBL_ID, COL_HEADER = newCol, VERSION = plan.VERSION)
             db.session.add(col)
             db.session.flush()
-            db.session.refresh(col)
-            for data in colData:
-                tempData = PlanData(PLAN_COL_X_ID=col.PLAN_COL_X_ID, PLAN_COL_Y_ID=data, PLAN_DATA=colData[data])
-                db.session.add(tempData)            
-            
+            if colData:
+                db.session.execute(insert(PlanData),
+                                   [{"PLAN_COL_X_ID": col.PLAN_COL_X_ID, "PLAN_COL_Y_ID": int(data),
+                                     "PLAN_DATA": colData[data], "VERSION": plan.VERSION} for data in colData])
+
             db.session.commit()
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
@@ -806,9 +1498,11 @@ class DBHelper(object):
     def deletePlanRow(self, sid, id):
         failed = False
         try:
+            self.lock_plan(sid)
             PlanData.query.filter(PlanData.PLAN_COL_Y_ID==id).delete()
             PlanColY.query.filter(PlanColY.PLAN_COL_Y_ID==id).delete()
             db.session.commit()
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
@@ -818,39 +1512,45 @@ class DBHelper(object):
     def deletePlanCol(self, sid, id):
         failed = False
         try:
+            self.lock_plan(sid)
             PlanData.query.filter(PlanData.PLAN_COL_X_ID==id).delete()
             PlanColX.query.filter(PlanColX.PLAN_COL_X_ID==id).delete()
             db.session.commit()
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
             failed = True
         return failed
 
-    def  deleteBudgetTable(self, id):
+    def  deleteBudgetTable(self, id, sid=None):
         failed = False
         try:
             Budget.query.filter(Budget.BUDGET_TBL_ID == id).delete()
             db.session.commit()
+            self.invalidate_budget_rollups(sid)
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
             failed = True
         return failed
 
-    def  deleteBudgetRow(self, a_id,p_id):
+    def  deleteBudgetRow(self, a_id,p_id, sid=None):
         failed = False
         try:
             BudgetActualSpent.query.filter(BudgetActualSpent.ACTUAL_ID == a_id).delete()
             BudgetProjected.query.filter(BudgetProjected.PROJECTED_ID == p_id).delete()
             db.session.commit()
+            self.invalidate_budget_rollups(sid)
+            self.invalidate_survivor(sid)
         except Exception as e:
             db.session.rollback()
             db.session.flush()
             failed = True
         return failed
 
-    def addBudgetRow(self, name, id):
+    def addBudgetRow(self, name, id, sid=None):
         failed = False
         try:
             act = BudgetActualSpent(BUDGET_TBL_ID = id, ITEM = name, UNIT=0, PERIOD=0, UNIT_COST=0)
@@ -860,6 +1560,8 @@ class DBHelper(object):
             db.session.add(pro)
             
             db.session.commit()
+            self.invalidate_budget_rollups(sid)
+            self.invalidate_survivor(sid)
         except Exception as e:
             print(e)
             db.session.rollback()
@@ -883,6 +1585,7 @@ class DBHelper(object):
                 statusUpdate = StatusUpdate(SID=sid, STATUS_ID=result[0].STATUS_ID, REMARKS=updated_remarks)
                 db.session.add(statusUpdate)
             db.session.commit()
+            self.invalidate_survivor(sid)
             return "Successfully updated status"
         except Exception as e:
             db.session.rollback()
@@ -904,6 +1607,7 @@ class DBHelper(object):
                  FamilyDetails.MOTHER_INCOME_MONTHLY: motherIncome, FamilyDetails.SIBLING_DETAILS: siblingDetails,
                  FamilyDetails.REMARKS: remarks})
             db.session.commit()
+            self.invalidate_survivor(sid)
             return "Successfullly updated family details"
         except Exception as e:
             db.session.rollback()
@@ -926,6 +1630,8 @@ class DBHelper(object):
                     PersonalInformation.CENTRE: centre
                 })
             db.session.commit()
+            self.invalidate_survivor(sid)
+            self.search_index.update(sid, FIRST_NAME=firstName, LAST_NAME=lastName)
             return "Successfully updated personal information"
         except Exception as e:
             db.session.rollback()
@@ -939,6 +1645,8 @@ class DBHelper(object):
                  HospitalInfo.HOSPITAL_REGDATE: hospitalRegDate, HospitalInfo.DOCTOR_NAME: doctorName,
                  HospitalInfo.CANCER_STAGE: cancerStage, HospitalInfo.CANCER_TYPE: cancerType})
             db.session.commit()
+            self.invalidate_survivor(sid)
+            self.search_index.update(sid, HOSPITAL_REGNO=hospitalRegNo)
             return "Successfully updated hospital details"
         except Exception as e:
             db.session.rollback()
@@ -960,10 +1668,12 @@ class DBHelper(object):
             i = 0
             for result in results:
                 db.session.query(Contacts).filter(Contacts.CONTACT_ID == result.CONTACT_ID).update(
-                    {Contacts.PHONE_NUMBER: contact_list[i], Contacts.CONTACT_RELATION: relation_list[i],
-                     Contacts.LAST_UPDATED: datetime.now()})
+                    {Contacts.PHONE_NUMBER: contact_list[i], Contacts.PHONE_KEY: normalize_phone(contact_list[i]),
+                     Contacts.CONTACT_RELATION: relation_list[i], Contacts.LAST_UPDATED: datetime.now()})
                 i = i + 1
                 db.session.commit()
+            self.invalidate_survivor(sid)
+            self.search_index.update(sid, DISTRICT=district, PINCODE=pincode, PHONE_NUMBER=contact_list[:len(results)])
             return "Successfully updated communication details"
         except Exception as e:
             db.session.rollback()
@@ -971,54 +1681,119 @@ class DBHelper(object):
             return str(e)
 
     def get_survivors_search(self, searchText):
-        hasOnlyFirstName = True
-        try:
-            search = "%{}%".format(int(searchText))
-            searchIsID = True
-        except:
-            search = "%{}%".format(str(searchText))
-            searchIsID = False
-
-        if not searchIsID:
-            if " " in search and search.count(" ") == 1:
-                hasOnlyFirstName = False
-                fname = "%{}%".format(str(searchText).split(" ")[0])
-                lname = "%{}%".format(str(searchText).split(" ")[1])
-            else:
-                search = "%{}%".format(str(searchText))
-                hasOnlyFirstName = True
-
-        if searchIsID:
-            results = db.session.query(PersonalInformation) \
-                .filter(PersonalInformation.SID.like(search)).limit(5).all()
-        elif not hasOnlyFirstName:
-            results = db.session.query(PersonalInformation) \
-                .filter(
-                (PersonalInformation.FIRST_NAME.like(fname) & PersonalInformation.LAST_NAME.like(lname))).limit(5).all()
-        else:
-            results = db.session.query(PersonalInformation) \
-                .filter(
-                or_(PersonalInformation.FIRST_NAME.like(search), PersonalInformation.LAST_NAME.like(search))).limit(5).all()
+        status, error = self.refresh_search_index()
+        if status != "SUCCESS":
+            return status, error
+        results = self.search_index.search(searchText, limit=5)
 
         try:
             searchResult = []
-            for result in results:
+            for sid, firstName, lastName in results:
                 converted_result = SearchResult(
-                    SID=result.SID,
-                    FIRST_NAME=result.FIRST_NAME,
-                    LAST_NAME=result.LAST_NAME,
-                    LINK=constants.react_URL + "/survivor/" + str(result.SID) + "/basicprofile"
+                    SID=sid,
+                    FIRST_NAME=firstName,
+                    LAST_NAME=lastName,
+                    LINK=constants.react_URL + "/survivor/" + str(sid) + "/basicprofile"
                 )
                 searchResult.append(converted_result)
             return "SUCCESS", searchResult
         except Exception as e:
             return "ERROR", str(e)
 
+    def search_survivors(self, text, page=1, perPage=20):
+        '''
+        Ranked survivor search over names, SID, hospital registration number, phone numbers, district and pincode
+        :param text: free text and/or field-scoped terms such as "phone:98200 district:thane"
+        :param page: 1-based page number
+        :param perPage: results per page
+        :return: "SUCCESS", {"total", "page", "per_page", "results": [SurvivorSearchHit]} / "ERROR", message
+        '''
+        status, error = self.refresh_search_index()
+        if status != "SUCCESS":
+            return status, error
+        try:
+            total, hits = self.search_index.query(text, offset=(page - 1) * perPage, limit=perPage)
+            results = []
+            for sid, score, matched in hits:
+                results.append(SurvivorSearchHit(
+                    SID=sid,
+                    FIRST_NAME=self.search_index.get(sid, 'FIRST_NAME'),
+                    LAST_NAME=self.search_index.get(sid, 'LAST_NAME'),
+                    HOSPITAL_REGNO=self.search_index.get(sid, 'HOSPITAL_REGNO'),
+                    DISTRICT=self.search_index.get(sid, 'DISTRICT'),
+                    PINCODE=self.search_index.get(sid, 'PINCODE'),
+                    SCORE=score,
+                    MATCHED=matched,
+                    LINK=constants.react_URL + "/survivor/" + str(sid) + "/basicprofile"
+                ))
+            return "SUCCESS", {"total": total, "page": page, "per_page": perPage, "results": results}
+        except Exception as e:
+            return "ERROR", str(e)
+
+    def lookup_phone(self, number):
+        '''
+        Survivors having a contact with this phone number, whatever way either side was written
+        :return: "SUCCESS", [PhoneLookupResult] / "INVALID", message / "ERROR", message
+        '''
+        key = normalize_phone(number)
+        if key is None:
+            return "INVALID", "Not a phone number: {}".format(number)
+        try:
+            rows = db.session.query(Contacts.SID, PersonalInformation.FIRST_NAME, PersonalInformation.LAST_NAME,
+                                    Contacts.PHONE_NUMBER, Contacts.CONTACT_RELATION) \
+                .join(PersonalInformation, PersonalInformation.SID == Contacts.SID) \
+                .filter(Contacts.PHONE_KEY == key) \
+                .order_by(Contacts.SID) \
+                .all()
+            return "SUCCESS", [PhoneLookupResult(SID=row.SID, FIRST_NAME=row.FIRST_NAME, LAST_NAME=row.LAST_NAME,
+                                                 PHONE_NUMBER=row.PHONE_NUMBER, CONTACT_RELATION=row.CONTACT_RELATION,
+                                                 LINK=constants.react_URL + "/survivor/" + str(row.SID) + "/basicprofile")
+                               for row in rows]
+        except Exception as e:
+            return "ERROR", str(e)
+
+    def backfill_phone_keys(self, batchSize=1000):
+        '''
+        Computes PHONE_KEY for every contact, walking TBL_CONTACTS by CONTACT_ID and committing each batch
+        :return: dict with the number of contacts scanned, keys written and numbers that could not be normalized
+        '''
+        counts = {'scanned': 0, 'updated': 0, 'unparseable': 0}
+        lastID = 0
+        while True:
+            rows = db.session.query(Contacts.CONTACT_ID, Contacts.PHONE_NUMBER, Contacts.PHONE_KEY) \
+                .filter(Contacts.CONTACT_ID > lastID) \
+                .order_by(Contacts.CONTACT_ID) \
+                .limit(batchSize) \
+                .all()
+            if not rows:
+                return counts
+            changed = []
+            for row in rows:
+                key = normalize_phone(row.PHONE_NUMBER)
+                if key is None:
+                    counts['unparseable'] += 1
+                if key != row.PHONE_KEY:
+                    changed.append({"contact_id": row.CONTACT_ID, "phone_key": key})
+            try:
+                if changed:
+                    db.session.execute(update(Contacts)
+                                       .where(Contacts.CONTACT_ID == bindparam('contact_id'))
+                                       .values(PHONE_KEY=bindparam('phone_key')),
+                                       changed)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            counts['scanned'] += len(rows)
+            counts['updated'] += len(changed)
+            lastID = rows[-1].CONTACT_ID
+
     def update_dispatch_date(self, sid, date):
         try:
             db.session.query(PersonalInformation).filter(PersonalInformation.SID == sid).update(
                 {PersonalInformation.WELCOME_KIT_DISPATCH_DATE: date})
             db.session.commit()
+            self.invalidate_survivor(sid)
             return "Successfully updated dispatch date"
         except Exception as e:
             db.session.rollback()
@@ -1039,6 +1814,7 @@ class DBHelper(object):
                 db.session.query(PersonalInformation).filter(PersonalInformation.SID == sid).update(
                     {PersonalInformation.PHOTO_URL: filename})
                 db.session.commit()
+            self.invalidate_survivor(sid)
             return "Successfully updated profile photo"
         except Exception as e:
             db.session.rollback()
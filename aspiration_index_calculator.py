@@ -1,24 +1,491 @@
+import re
+
+import numpy as np
 import pandas as pd
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, cast, select, Float, Integer, String
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+import constants
 from models import *
 
+# answers counted in the index: an integer with an optional sign and surrounding spaces, what TRY_CAST(... AS INT)
+# of SQL Server accepts, anything else ('3.5', 'NA', blank) counts as 0 in every engine
+INTEGER_ANSWER = re.compile(r'^ *[-+]?[0-9]+ *$')
 
-def calculate_aspiration_index(sid):
+_weight_model = None
+
+
+class AspirationWeightModel(object):
+    '''
+    Compiled form of TBL_ASPIRATION_WEIGHTS for the active ASPIRATION questions.
+    Aspiration index questions are categorized as CATEGORY >> PARAMETER >> ATTRIBUTES/QUESTIONS and every level
+    is a weighted average whose denominator only depends on the weights. The three levels therefore collapse into
+    a single effective weight per question, and scoring an answer vector is a dot product.
     '''
-        Returns latest record of a particular followup type for a survivor
-        :param sid: survivors id
-        :param futype: followup type
-        :return:
+
+    def __init__(self, rows, version=None):
+        '''
+        :param rows: (QUESTIONID, CATEGORY, CATEGORY_W, PARAMETER, PARAMETER_W, ATTRIBUTE_W) of the active questions
+        :param version: version of the data shared by all survivors the rows were read at, see shared_data_version
+        '''
+        self.version = version
+        self.question_index = {}
+        categories = {}
+        parameters = {}
+        category_w = []
+        parameter_w = []
+        parameter_category = []
+        question_parameter = []
+        attribute_w = []
+
+        for qid, category, cat_w, parameter, param_w, attr_w in rows:
+            # questions with incomplete weights are left out of the index, as the groupby on them drops them
+            if category is None or cat_w is None or parameter is None or param_w is None:
+                continue
+            if (category, cat_w) not in categories:
+                categories[(category, cat_w)] = len(categories)
+                category_w.append(cat_w)
+            c = categories[(category, cat_w)]
+            if (category, cat_w, parameter, param_w) not in parameters:
+                parameters[(category, cat_w, parameter, param_w)] = len(parameters)
+                parameter_w.append(param_w)
+                parameter_category.append(c)
+            self.question_index[qid] = len(question_parameter)
+            question_parameter.append(parameters[(category, cat_w, parameter, param_w)])
+            attribute_w.append(attr_w or 0)
+
+        self.size = len(question_parameter)
+        self.weights = self._compile(np.array(attribute_w, dtype=float), np.array(question_parameter, dtype=int),
+                                     np.array(parameter_w, dtype=float), np.array(parameter_category, dtype=int),
+                                     np.array(category_w, dtype=float))
+
+    @staticmethod
+    def _compile(attribute_w, question_parameter, parameter_w, parameter_category, category_w):
+        if len(attribute_w) == 0 or category_w.sum() == 0:
+            return np.zeros(len(attribute_w))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # parameter level: weighted average of the attributes
+            attribute_w_sum = np.bincount(question_parameter, weights=attribute_w, minlength=len(parameter_w))
+            question_norm = attribute_w / attribute_w_sum[question_parameter]
+
+            # category level: divided by the category weight summed over its parameters, as the pandas version does
+            category_w_sum = np.bincount(parameter_category, weights=category_w[parameter_category],
+                                         minlength=len(category_w))
+            parameter_norm = parameter_w * category_w[parameter_category] / category_w_sum[parameter_category]
+
+            # index level: weighted average of the categories
+            weights = question_norm * parameter_norm[question_parameter] / category_w.sum()
+
+        # a group whose weights sum to 0 does not contribute, like the NaN skipped by pandas sums
+        return np.nan_to_num(weights, nan=0.0, posinf=0.0, neginf=0.0)
+
+    @classmethod
+    def load(cls, version=None):
+        return cls(cls.load_rows(), version)
+
+    @staticmethod
+    def load_rows():
+        '''
+        Returns the (QUESTIONID, CATEGORY, CATEGORY_W, PARAMETER, PARAMETER_W, ATTRIBUTE_W) of the active questions
+        '''
+        return db.session.query(FollowupQuestions.QUESTIONID,
+                                AspirationQuestionWeights.CATEGORY,
+                                AspirationQuestionWeights.CATEGORY_W,
+                                AspirationQuestionWeights.PARAMETER,
+                                AspirationQuestionWeights.PARAMETER_W,
+                                AspirationQuestionWeights.ATTRIBUTE_W) \
+            .select_from(FollowupQuestions) \
+            .join(FollowUpTypes, FollowUpTypes.FOLLOWUPTYPEID == FollowupQuestions.FOLLOWUPTYPEID) \
+            .join(AspirationQuestionWeights, AspirationQuestionWeights.QUESTIONID == FollowupQuestions.QUESTIONID) \
+            .filter(and_(FollowUpTypes.FOLLOWUPTYPE == 'ASPIRATION', FollowupQuestions.ACTIVE == 1)) \
+            .order_by(FollowupQuestions.QUESTIONID) \
+            .all()
+
+    def answer_matrix(self, rows, question_index=None):
+        '''
+        Builds the answer matrix of many followups
+        :param rows: (KEY, QUESTIONID, ANSWER) tuples, KEY identifies the scored followup e.g. SID or FOLLOWUPID
+        :param question_index: question id => column to build the matrix for, the model's own by default
+        :return: list of keys and the matching len(keys) x len(question_index) matrix, unanswered questions are 0
+        '''
+        question_index = self.question_index if question_index is None else question_index
+        keys = {}
+        row_idx = []
+        col_idx = []
+        values = []
+        for key, qid, answer in rows:
+            k = keys.setdefault(key, len(keys))
+            col = question_index.get(qid)
+            if col is None:
+                continue
+            row_idx.append(k)
+            col_idx.append(col)
+            values.append(to_int(answer))
+
+        matrix = np.zeros((len(keys), len(question_index)))
+        matrix[row_idx, col_idx] = values
+        return list(keys), matrix
+
+    def weights_for(self, question_index):
+        '''
+        Returns the effective weights aligned to another question id => column mapping, 0 for unknown questions
+        '''
+        weights = np.zeros(len(question_index))
+        for qid, col in question_index.items():
+            own = self.question_index.get(qid)
+            if own is not None:
+                weights[col] = self.weights[own]
+        return weights
+
+    def score(self, matrix):
+        '''
+        :param matrix: answers, one row per followup and one column per question of question_index
+        :return: array of aspiration indices rounded to 2 decimals
+        '''
+        return np.round(matrix @ self.weights, 2)
+
+    def score_rows(self, rows):
+        '''
+        :param rows: (KEY, QUESTIONID, ANSWER) tuples
+        :return: dict of key => aspiration index
         '''
-    # create a subquery to get max date for a sid-followuptype
-    subquery_sid_latest_followups = db.session.query(FollowupMaster.SID,
-                                                     FollowupMaster.FOLLOWUPTYPEID,
-                                                     func.max(FollowupMaster.FOLLOWUPDATE).label("MAXDATE")) \
-        .filter(FollowupMaster.SID == sid) \
-        .group_by(FollowupMaster.SID, FollowupMaster.FOLLOWUPTYPEID).subquery()
-
-    # join followup tables to get the latest followup data of a particular type
-    query = db.session.query(FollowUpAnswers.ANSWER,
+        keys, matrix = self.answer_matrix(rows)
+        return dict(zip(keys, self.score(matrix).tolist()))
+
+
+def to_int(answer):
+    # ANSWER has been stored as str but for aspiration index it will always be an int
+    if isinstance(answer, int):
+        return answer
+    if answer is None or not INTEGER_ANSWER.match(str(answer)):
+        return 0
+    return int(answer)
+
+
+class integer_answer(FunctionElement):
+    '''
+    ANSWER as an integer by the rule of to_int, 0 for anything that is not an integer
+    '''
+    type = Integer()
+    name = 'integer_answer'
+    inherit_cache = True
+
+
+@compiles(integer_answer)
+def _integer_answer(element, compiler, **kw):
+    # ANSWER is a text column, it goes through a string type as text cannot be cast to int directly
+    answer = cast(list(element.clauses)[0], String(50))
+    return compiler.process(func.coalesce(cast(answer, Integer), 0), **kw)
+
+
+@compiles(integer_answer, 'mssql')
+def _integer_answer_mssql(element, compiler, **kw):
+    # TRY_CAST gives NULL instead of failing the whole query on a non integer answer
+    answer = compiler.process(cast(list(element.clauses)[0], String(50)), **kw)
+    return 'COALESCE(TRY_CAST(%s AS INTEGER), 0)' % answer
+
+
+@compiles(integer_answer, 'sqlite')
+def _integer_answer_sqlite(element, compiler, **kw):
+    # CAST in sqlite keeps the leading digits of '3.5', only whole integers are cast here
+    answer = "TRIM(%s, ' ')" % compiler.process(list(element.clauses)[0], **kw)
+    return ("CASE WHEN {0} GLOB '[0-9]*' AND {0} NOT GLOB '*[^0-9]*' THEN CAST({0} AS INTEGER) "
+            "WHEN {0} GLOB '[-+][0-9]*' AND SUBSTR({0}, 2) NOT GLOB '*[^0-9]*' THEN CAST({0} AS INTEGER) "
+            "ELSE 0 END").format(answer)
+
+
+def shared_data_version():
+    '''
+    Returns the persisted version of the data shared by all survivors, bumped with every change to the aspiration
+    questions and weights whichever worker process makes it
+    '''
+    return db.session.query(SurvivorVersion.VERSION).filter(SurvivorVersion.SID == ALL_SURVIVORS).scalar() or 0
+
+
+def get_weight_model():
+    '''
+    Returns the compiled weight model, rebuilt when the version of the data shared by all survivors is no longer
+    the one it was built at, so weights edited through another worker process are used from their commit on
+    '''
+    global _weight_model
+    version = shared_data_version()
+    model = _weight_model
+    if model is None or model.version != version:
+        model = _weight_model = AspirationWeightModel.load(version)
+    return model
+
+
+def invalidate_weight_model():
+    '''
+    Drops the compiled weight model, to be called once changes to aspiration questions or weights are committed
+    '''
+    global _weight_model
+    _weight_model = None
+
+
+def latest_aspiration_followups(sids=None):
+    '''
+    Subquery of the latest ASPIRATION followup date (MAXDATE) of every sid
+    :param sids: list of survivor ids, None for all
+    '''
+    subquery = db.session.query(FollowupMaster.SID,
+                                func.max(FollowupMaster.FOLLOWUPDATE).label("MAXDATE")) \
+        .join(FollowUpTypes, FollowUpTypes.FOLLOWUPTYPEID == FollowupMaster.FOLLOWUPTYPEID) \
+        .filter(FollowUpTypes.FOLLOWUPTYPE == 'ASPIRATION')
+    if sids is not None:
+        subquery = subquery.filter(FollowupMaster.SID.in_(sids))
+    return subquery.group_by(FollowupMaster.SID).subquery()
+
+
+def latest_aspiration_followup_ids(sids=None):
+    '''
+    Subquery of the FOLLOWUPID of the latest ASPIRATION followup of every sid, followups on the same latest date
+    go to the highest FOLLOWUPID as in the ROW_NUMBER of the SQL engine
+    :param sids: list of survivor ids, None for all
+    '''
+    subquery_sid_latest_followups = latest_aspiration_followups(sids)
+    return db.session.query(FollowupMaster.SID,
+                            func.max(FollowupMaster.FOLLOWUPID).label("FOLLOWUPID")) \
+        .join(FollowUpTypes, FollowUpTypes.FOLLOWUPTYPEID == FollowupMaster.FOLLOWUPTYPEID) \
+        .join(subquery_sid_latest_followups,
+              and_(subquery_sid_latest_followups.c.SID == FollowupMaster.SID,
+                   subquery_sid_latest_followups.c.MAXDATE == FollowupMaster.FOLLOWUPDATE)) \
+        .filter(FollowUpTypes.FOLLOWUPTYPE == 'ASPIRATION') \
+        .group_by(FollowupMaster.SID).subquery()
+
+
+def latest_aspiration_answers(sids=None):
+    '''
+    Query of (SID, QUESTIONID, ANSWER) for the latest ASPIRATION followup of every sid
+    '''
+    subquery_sid_latest_followups = latest_aspiration_followup_ids(sids)
+    return db.session.query(subquery_sid_latest_followups.c.SID,
+                            FollowUpAnswers.QUESTIONID,
+                            FollowUpAnswers.ANSWER) \
+        .select_from(subquery_sid_latest_followups) \
+        .join(FollowUpAnswers, FollowUpAnswers.FOLLOWUPID == subquery_sid_latest_followups.c.FOLLOWUPID,
+              isouter=True)
+
+
+def calculate_aspiration_index(sid):
+    '''
+    Returns the aspiration index of the latest ASPIRATION followup of a survivor
+    :param sid: survivors id
+    :return: aspiration index, 0 when the survivor has no ASPIRATION followup
+    '''
+    return calculate_aspiration_indices([sid]).get(int(sid), 0)
+
+
+def calculate_aspiration_indices(sids=None):
+    '''
+    Returns the aspiration index of many survivors using a single query and one matrix product,
+    or entirely in the database when constants.aspiration_index_engine is 'sql'
+    :param sids: iterable of survivor ids, None for every survivor having an ASPIRATION followup
+    :return: dict of sid => aspiration index, requested sids without an ASPIRATION followup map to 0
+    '''
+    if getattr(constants, 'aspiration_index_engine', 'model') == 'sql':
+        return calculate_aspiration_indices_sql(sids)
+
+    sids = None if sids is None else [int(sid) for sid in sids]
+    model = get_weight_model()
+
+    indices = dict.fromkeys(sids, 0) if sids is not None else {}
+    indices.update(model.score_rows(latest_aspiration_answers(sids).all()))
+    return indices
+
+
+def calculate_followup_aspiration_index(followupid):
+    '''
+    Returns the aspiration index of a single ASPIRATION followup.
+    Runs on the current session so it also sees answers that are flushed but not committed yet.
+    :param followupid: id of the followup in TBL_FOLLOWUPMASTER
+    :return: aspiration index, 0 when the followup has no answers
+    '''
+    results = db.session.query(FollowUpAnswers.FOLLOWUPID,
+                               FollowUpAnswers.QUESTIONID,
+                               FollowUpAnswers.ANSWER) \
+        .filter(FollowUpAnswers.FOLLOWUPID == followupid) \
+        .all()
+    return get_weight_model().score_rows(results).get(followupid, 0)
+
+
+def simulate_aspiration_weights(weightages, top=20):
+    '''
+    Recomputes every survivor's aspiration index with candidate weights without persisting anything
+    :param weightages: list of dicts with QUESTIONID and any of ATTRIBUTE_W, CATEGORY, CATEGORY_W, PARAMETER,
+                       PARAMETER_W, same shape as accepted by update_aspiration_waightage
+    :param top: number of survivors with the largest change to return
+    :return: dict with the current and simulated distributions, the shift between them and the largest movers
+    '''
+    # apply the candidate weights over the current ones, the same fields update_aspiration_waightage would change
+    overrides = {int(w['QUESTIONID']): w for w in weightages if w.get('QUESTIONID') is not None}
+    fields = ['CATEGORY', 'CATEGORY_W', 'PARAMETER', 'PARAMETER_W', 'ATTRIBUTE_W']
+    current_rows = AspirationWeightModel.load_rows()
+    candidate_rows = []
+    for row in current_rows:
+        values = dict(zip(fields, row[1:]))
+        for field in fields:
+            if overrides.get(row[0], {}).get(field):
+                values[field] = overrides[row[0]][field]
+        candidate_rows.append((row[0], values['CATEGORY'], values['CATEGORY_W'], values['PARAMETER'],
+                               values['PARAMETER_W'], values['ATTRIBUTE_W']))
+
+    current = AspirationWeightModel(current_rows)
+    candidate = AspirationWeightModel(candidate_rows)
+
+    # score one snapshot of the latest answers with both weight vectors
+    question_index = {qid: col for col, qid in enumerate(sorted(set(current.question_index) |
+                                                                set(candidate.question_index)))}
+    sids, matrix = current.answer_matrix(latest_aspiration_answers().all(), question_index)
+    before = np.round(matrix @ current.weights_for(question_index), 2)
+    after = np.round(matrix @ candidate.weights_for(question_index), 2)
+    delta = after - before
+
+    movers = np.argsort(-np.abs(delta), kind='stable')[:top]
+    return {
+        'SURVIVORS': len(sids),
+        'CURRENT': distribution(before),
+        'SIMULATED': distribution(after),
+        'SHIFT': {
+            'MEAN': round(float(delta.mean()), 4) if len(delta) else 0,
+            'MEAN_ABS': round(float(np.abs(delta).mean()), 4) if len(delta) else 0,
+            'INCREASED': int((delta > 0).sum()),
+            'DECREASED': int((delta < 0).sum()),
+            'UNCHANGED': int((delta == 0).sum())
+        },
+        'TOP_MOVERS': [AspirationIndexShift(SID=sids[i],
+                                            CURRENT=float(before[i]),
+                                            SIMULATED=float(after[i]),
+                                            DELTA=round(float(delta[i]), 2)) for i in movers if delta[i] != 0]
+    }
+
+
+def distribution(values):
+    '''
+    Summary statistics of an array of aspiration indices
+    '''
+    if len(values) == 0:
+        return {}
+    p10, p25, p50, p75, p90 = np.percentile(values, [10, 25, 50, 75, 90])
+    return {'MEAN': round(float(values.mean()), 4), 'STD': round(float(values.std()), 4),
+            'MIN': float(values.min()), 'P10': float(p10), 'P25': float(p25), 'MEDIAN': float(p50),
+            'P75': float(p75), 'P90': float(p90), 'MAX': float(values.max())}
+
+
+def calculate_aspiration_history(sid):
+    '''
+    Returns the aspiration index of every ASPIRATION followup of a survivor, oldest first.
+    All followups are loaded in one query and scored together in one matrix product.
+    :param sid: survivors id
+    :return: list of AspirationIndexHistory
+    '''
+    results = db.session.query(FollowupMaster.FOLLOWUPID,
+                               FollowupMaster.FOLLOWUPDATE,
+                               FollowupMaster.FOLLOWEDUPBY,
+                               FollowUpAnswers.QUESTIONID,
+                               FollowUpAnswers.ANSWER) \
+        .select_from(FollowupMaster) \
+        .join(FollowUpTypes, FollowUpTypes.FOLLOWUPTYPEID == FollowupMaster.FOLLOWUPTYPEID) \
+        .join(FollowUpAnswers, FollowUpAnswers.FOLLOWUPID == FollowupMaster.FOLLOWUPID, isouter=True) \
+        .filter(and_(FollowUpTypes.FOLLOWUPTYPE == 'ASPIRATION', FollowupMaster.SID == sid)) \
+        .order_by(FollowupMaster.FOLLOWUPDATE, FollowupMaster.FOLLOWUPID) \
+        .all()
+
+    followups = {}
+    for row in results:
+        followups.setdefault(row.FOLLOWUPID, row)
+    indices = get_weight_model().score_rows((row.FOLLOWUPID, row.QUESTIONID, row.ANSWER) for row in results)
+
+    return [AspirationIndexHistory(FOLLOWUPID=fid,
+                                   FOLLOWUPDATE=row.FOLLOWUPDATE,
+                                   FOLLOWEDUPBY=row.FOLLOWEDUPBY,
+                                   ASPIRATION_INDEX=indices[fid]) for fid, row in followups.items()]
+
+
+def calculate_aspiration_indices_sql(sids=None):
+    '''
+    Computes the three levels of weighted averages in the database and only returns one number per sid.
+    The latest followup is picked with ROW_NUMBER over the sid's ASPIRATION followups, every level is a CTE.
+    :param sids: iterable of survivor ids, None for every survivor having an ASPIRATION followup
+    :return: dict of sid => aspiration index, requested sids without an ASPIRATION followup map to 0
+    '''
+    sids = None if sids is None else [int(sid) for sid in sids]
+
+    # rank the ASPIRATION followups of every sid, latest first
+    ranked = select(FollowupMaster.FOLLOWUPID,
+                    FollowupMaster.SID,
+                    FollowupMaster.FOLLOWUPTYPEID,
+                    func.row_number().over(partition_by=FollowupMaster.SID,
+                                           order_by=(FollowupMaster.FOLLOWUPDATE.desc(),
+                                                     FollowupMaster.FOLLOWUPID.desc())).label('RN')) \
+        .join(FollowUpTypes, FollowUpTypes.FOLLOWUPTYPEID == FollowupMaster.FOLLOWUPTYPEID) \
+        .where(FollowUpTypes.FOLLOWUPTYPE == 'ASPIRATION')
+    if sids is not None:
+        ranked = ranked.where(FollowupMaster.SID.in_(sids))
+    ranked = ranked.cte('RANKED_FOLLOWUPS')
+
+    # one row per active weighted question of the latest followup, unanswered questions count as 0
+    answers = select(ranked.c.SID,
+                     AspirationQuestionWeights.CATEGORY,
+                     AspirationQuestionWeights.CATEGORY_W,
+                     AspirationQuestionWeights.PARAMETER,
+                     AspirationQuestionWeights.PARAMETER_W,
+                     cast(func.coalesce(AspirationQuestionWeights.ATTRIBUTE_W, 0), Float).label('ATTRIBUTE_W'),
+                     cast(integer_answer(FollowUpAnswers.ANSWER), Float).label('ANSWER')) \
+        .select_from(ranked) \
+        .join(FollowupQuestions, FollowupQuestions.FOLLOWUPTYPEID == ranked.c.FOLLOWUPTYPEID) \
+        .join(AspirationQuestionWeights, AspirationQuestionWeights.QUESTIONID == FollowupQuestions.QUESTIONID) \
+        .join(FollowUpAnswers, and_(FollowUpAnswers.QUESTIONID == FollowupQuestions.QUESTIONID,
+                                    FollowUpAnswers.FOLLOWUPID == ranked.c.FOLLOWUPID), isouter=True) \
+        .where(and_(ranked.c.RN == 1,
+                    FollowupQuestions.ACTIVE == 1,
+                    AspirationQuestionWeights.CATEGORY_W.isnot(None),
+                    AspirationQuestionWeights.PARAMETER_W.isnot(None))) \
+        .cte('ASPIRATION_ANSWERS')
+
+    # parameter level weighted average of the attributes
+    level0 = select(answers.c.SID, answers.c.CATEGORY, answers.c.CATEGORY_W, answers.c.PARAMETER, answers.c.PARAMETER_W,
+                    (func.sum(answers.c.ATTRIBUTE_W * answers.c.ANSWER)
+                     / func.nullif(func.sum(answers.c.ATTRIBUTE_W), 0)).label('ATTRIBUTE_WA')) \
+        .group_by(answers.c.SID, answers.c.CATEGORY, answers.c.CATEGORY_W, answers.c.PARAMETER, answers.c.PARAMETER_W) \
+        .cte('LEVEL0')
+
+    # category level, divided by the category weight summed over its parameters like the other engines
+    level1 = select(level0.c.SID, level0.c.CATEGORY,
+                    cast(level0.c.CATEGORY_W, Float).label('CATEGORY_W'),
+                    (func.sum(cast(level0.c.PARAMETER_W, Float) * level0.c.ATTRIBUTE_WA)
+                     / func.nullif(func.sum(cast(level0.c.CATEGORY_W, Float)), 0)).label('PARAMETER_WA')) \
+        .group_by(level0.c.SID, level0.c.CATEGORY, level0.c.CATEGORY_W) \
+        .cte('LEVEL1')
+
+    query = select(level1.c.SID,
+                   func.round(func.sum(level1.c.CATEGORY_W * level1.c.PARAMETER_WA)
+                              / func.nullif(func.sum(level1.c.CATEGORY_W), 0), 2).label('ASPIRATION_INDEX')) \
+        .group_by(level1.c.SID)
+
+    # sids whose latest followup has no weighted question still get an entry
+    indices = dict.fromkeys(sids, 0) if sids is not None else \
+        {row.SID: 0 for row in db.session.execute(select(ranked.c.SID).where(ranked.c.RN == 1))}
+    for row in db.session.execute(query):
+        indices[row.SID] = float(row.ASPIRATION_INDEX) if row.ASPIRATION_INDEX is not None else 0
+    return indices
+
+
+def calculate_aspiration_indices_pandas(sids=None):
+    '''
+    Reference implementation of calculate_aspiration_indices joining the weights and grouping with pandas,
+    kept to check the compiled weight model against
+    :param sids: iterable of survivor ids, None for every survivor having an ASPIRATION followup
+    :return: dict of sid => aspiration index
+    '''
+    sids = None if sids is None else [int(sid) for sid in sids]
+    subquery_sid_latest_followups = latest_aspiration_followup_ids(sids)
+
+    # join followup tables to get the answers and weights of the latest followups
+    query = db.session.query(FollowupMaster.SID,
+                             FollowUpAnswers.ANSWER,
                              AspirationQuestionWeights.CATEGORY,
                              AspirationQuestionWeights.CATEGORY_W,
                              AspirationQuestionWeights.PARAMETER,
@@ -28,7 +495,7 @@ def calculate_aspiration_index(sid):
         .select_from(FollowupMaster) \
         .join(FollowUpTypes, FollowUpTypes.FOLLOWUPTYPEID == FollowupMaster.FOLLOWUPTYPEID) \
         .join(subquery_sid_latest_followups,
-              subquery_sid_latest_followups.c.MAXDATE == FollowupMaster.FOLLOWUPDATE) \
+              subquery_sid_latest_followups.c.FOLLOWUPID == FollowupMaster.FOLLOWUPID) \
         .join(FollowupQuestions, FollowupQuestions.FOLLOWUPTYPEID == FollowupMaster.FOLLOWUPTYPEID) \
         .join(FollowUpAnswers, and_(FollowUpAnswers.QUESTIONID == FollowupQuestions.QUESTIONID,
                                     FollowUpAnswers.FOLLOWUPID == FollowupMaster.FOLLOWUPID), isouter=True) \
@@ -36,32 +503,41 @@ def calculate_aspiration_index(sid):
               isouter=True) \
         .filter(and_(
         FollowUpTypes.FOLLOWUPTYPE == 'ASPIRATION',
-        FollowupMaster.SID == sid,
         FollowupQuestions.ACTIVE == 1)
     )
 
     # create dataframe from ORM query
     df = pd.read_sql(query.statement, query.session.bind)
+    indices = dict.fromkeys(sids, 0) if sids is not None else {}
     if df.empty:
-        return 0
+        return indices
 
-    # convert answer to int, as ANSWER has been stored as str but for aspiration index it will always be an int
-    df['ANSWER'] = df['ANSWER'].fillna(0).astype(int)
+    indices.update(aspiration_index_by(df, 'SID'))
+    return indices
 
-    # get an attribute's total contribution
+
+def aspiration_index_by(df, key):
+    '''
+    Computes the CATEGORY >> PARAMETER >> ATTRIBUTE weighted index for every value of key in one grouped pass
+    :param df: answer rows with ANSWER and the aspiration weight columns, one row per question per key
+    :param key: column identifying one scored followup, e.g. SID or FOLLOWUPID
+    :return: dict of key => aspiration index
+    '''
+    df = df.copy()
+    df['ANSWER'] = df['ANSWER'].map(to_int)
     df['ATTRIBUTE_WxANSWER'] = df['ATTRIBUTE_W'] * df['ANSWER']
 
-    # get parameter level weighted average
-    # FYI: aspiration index questions are categorized as CATEGORY >> PARAMETER >> ATTRIBUTES/QUESTIONS
-    level0 = df.groupby(['CATEGORY', 'CATEGORY_W', 'PARAMETER', 'PARAMETER_W'])
-    level0 = level0.ATTRIBUTE_WxANSWER.sum()/level0.ATTRIBUTE_W.sum()
-    level0 = level0.reset_index([0, 1, 2, 3], name='ATTRIBUTE_WA')
-    level0['PARAMETER_WxATTRIBUTE_WA'] = level0['PARAMETER_W'] * level0['ATTRIBUTE_WA']
+    # parameter level weighted average of the attributes
+    level0 = df.groupby([key, 'CATEGORY', 'CATEGORY_W', 'PARAMETER', 'PARAMETER_W'])[
+        ['ATTRIBUTE_WxANSWER', 'ATTRIBUTE_W']].sum().reset_index()
+    level0['PARAMETER_WxATTRIBUTE_WA'] = level0['PARAMETER_W'] * (level0['ATTRIBUTE_WxANSWER'] / level0['ATTRIBUTE_W'])
 
-    level1 = level0.groupby(['CATEGORY', 'CATEGORY_W'])
-    level1 = level1.PARAMETER_WxATTRIBUTE_WA.sum()/level1.CATEGORY_W.sum()
-    level1 = level1.reset_index([0, 1], name='PARAMETER_WA')
-    level1['CATEGORY_WxPARAMETER_WA'] = level1['CATEGORY_W'] * level1['PARAMETER_WA']
+    # category level, divided by the category weight summed over its parameters
+    level1 = level0.groupby([key, 'CATEGORY', 'CATEGORY_W'])[['PARAMETER_WxATTRIBUTE_WA', 'CATEGORY_W']] \
+        .agg({'PARAMETER_WxATTRIBUTE_WA': 'sum', 'CATEGORY_W': 'sum'}) \
+        .rename(columns={'CATEGORY_W': 'CATEGORY_W_SUM'}).reset_index()
+    level1['CATEGORY_WxPARAMETER_WA'] = level1['CATEGORY_W'] * (level1['PARAMETER_WxATTRIBUTE_WA'] / level1['CATEGORY_W_SUM'])
 
-    aspiration_index = level1.CATEGORY_WxPARAMETER_WA.sum()/level1.CATEGORY_W.sum()
-    return round(aspiration_index, 2)
+    level2 = level1.groupby(key)[['CATEGORY_WxPARAMETER_WA', 'CATEGORY_W']].sum()
+    aspiration_index = (level2['CATEGORY_WxPARAMETER_WA'] / level2['CATEGORY_W']).round(2)
+    return {k.item() if hasattr(k, 'item') else k: float(v) for k, v in aspiration_index.items()}
@@ -0,0 +1,148 @@
+# Compares the original per-SID aspiration index computation with the cohort-wide batch computation,
+# and checks the compiled weight model and the SQL engine against the pandas reference implementation,
+# also on answers that are not plain integers and on followups sharing the latest date.
+# Run from the repository root: python -m benchmarks.aspiration_benchmark
+import argparse
+import random
+from time import perf_counter
+
+import pandas as pd
+from sqlalchemy import func, and_
+
+from benchmarks.fixtures import create_app, seed_reference_data, seed_aspiration_questions, seed_survivors, \
+    seed_aspiration_followups, seed_edge_case_followups, QueryCounter
+from models import *
+
+
+def original_aspiration_index(sid):
+    '''
+    calculate_aspiration_index as it was before the batch computation, one query and one pandas groupby per SID,
+    kept as the baseline. It only handles integer answers and a single followup on the latest date.
+    '''
+    # create a subquery to get max date for a sid-followuptype
+    subquery_sid_latest_followups = db.session.query(FollowupMaster.SID,
+                                                     FollowupMaster.FOLLOWUPTYPEID,
+                                                     func.max(FollowupMaster.FOLLOWUPDATE).label("MAXDATE")) \
+        .filter(FollowupMaster.SID == sid) \
+        .group_by(FollowupMaster.SID, FollowupMaster.FOLLOWUPTYPEID).subquery()
+
+    # join followup tables to get the latest followup data of a particular type
+    query = db.session.query(FollowUpAnswers.ANSWER,
+                             AspirationQuestionWeights.CATEGORY,
+                             AspirationQuestionWeights.CATEGORY_W,
+                             AspirationQuestionWeights.PARAMETER,
+                             AspirationQuestionWeights.PARAMETER_W,
+                             AspirationQuestionWeights.ATTRIBUTE_W
+                             ) \
+        .select_from(FollowupMaster) \
+        .join(FollowUpTypes, FollowUpTypes.FOLLOWUPTYPEID == FollowupMaster.FOLLOWUPTYPEID) \
+        .join(subquery_sid_latest_followups,
+              subquery_sid_latest_followups.c.MAXDATE == FollowupMaster.FOLLOWUPDATE) \
+        .join(FollowupQuestions, FollowupQuestions.FOLLOWUPTYPEID == FollowupMaster.FOLLOWUPTYPEID) \
+        .join(FollowUpAnswers, and_(FollowUpAnswers.QUESTIONID == FollowupQuestions.QUESTIONID,
+                                    FollowUpAnswers.FOLLOWUPID == FollowupMaster.FOLLOWUPID), isouter=True) \
+        .join(AspirationQuestionWeights, AspirationQuestionWeights.QUESTIONID == FollowupQuestions.QUESTIONID,
+              isouter=True) \
+        .filter(and_(
+        FollowUpTypes.FOLLOWUPTYPE == 'ASPIRATION',
+        FollowupMaster.SID == sid,
+        FollowupQuestions.ACTIVE == 1)
+    )
+
+    # create dataframe from ORM query
+    df = pd.read_sql(query.statement, query.session.bind)
+    if df.empty:
+        return 0
+
+    # convert answer to int, as ANSWER has been stored as str but for aspiration index it will always be an int
+    df['ANSWER'] = df['ANSWER'].fillna(0).astype(int)
+
+    # get an attribute's total contribution
+    df['ATTRIBUTE_WxANSWER'] = df['ATTRIBUTE_W'] * df['ANSWER']
+
+    # get parameter level weighted average
+    level0 = df.groupby(['CATEGORY', 'CATEGORY_W', 'PARAMETER', 'PARAMETER_W'])
+    level0 = level0.ATTRIBUTE_WxANSWER.sum()/level0.ATTRIBUTE_W.sum()
+    level0 = level0.reset_index([0, 1, 2, 3], name='ATTRIBUTE_WA')
+    level0['PARAMETER_WxATTRIBUTE_WA'] = level0['PARAMETER_W'] * level0['ATTRIBUTE_WA']
+
+    level1 = level0.groupby(['CATEGORY', 'CATEGORY_W'])
+    level1 = level1.PARAMETER_WxATTRIBUTE_WA.sum()/level1.CATEGORY_W.sum()
+    level1 = level1.reset_index([0, 1], name='PARAMETER_WA')
+    level1['CATEGORY_WxPARAMETER_WA'] = level1['CATEGORY_W'] * level1['PARAMETER_WA']
+
+    aspiration_index = level1.CATEGORY_WxPARAMETER_WA.sum()/level1.CATEGORY_W.sum()
+    return round(aspiration_index, 2)
+
+
+def mismatches(sids, expected, *results):
+    return [(sid, expected.get(sid, 0)) + tuple(result.get(sid, 0) for result in results) for sid in sids
+            if any(abs(result.get(sid, 0) - expected.get(sid, 0)) > 0.01 for result in results)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--survivors', type=int, default=2000)
+    parser.add_argument('--followups', type=int, default=2)
+    parser.add_argument('--edge-cases', type=int, default=200, help='survivors given edge case followups')
+    args = parser.parse_args()
+
+    random.seed(1)
+    create_app()
+    from aspiration_index_calculator import calculate_aspiration_index, calculate_aspiration_indices, \
+        calculate_aspiration_indices_pandas, calculate_aspiration_indices_sql, get_weight_model
+
+    seed_reference_data()
+    qids = seed_aspiration_questions()
+    sids = list(range(1, args.survivors + 1))
+    seed_survivors(args.survivors)
+    seed_aspiration_followups(sids, qids, per_survivor=args.followups)
+
+    with QueryCounter() as loop_queries:
+        start = perf_counter()
+        looped = {sid: original_aspiration_index(sid) for sid in sids}
+        loop_time = perf_counter() - start
+
+    with QueryCounter() as batch_queries:
+        start = perf_counter()
+        batched = calculate_aspiration_indices()
+        batch_time = perf_counter() - start
+
+    with QueryCounter() as pandas_queries:
+        start = perf_counter()
+        reference = calculate_aspiration_indices_pandas()
+        pandas_time = perf_counter() - start
+
+    with QueryCounter() as sql_queries:
+        start = perf_counter()
+        in_database = calculate_aspiration_indices_sql()
+        sql_time = perf_counter() - start
+
+    model = get_weight_model()
+    start = perf_counter()
+    model.score_rows((sid, qid, 3) for sid in sids for qid in qids)
+    scoring_time = perf_counter() - start
+
+    different = mismatches(sids, reference, looped, batched, in_database)
+    print('survivors: {}, followups each: {}, questions: {}'.format(args.survivors, args.followups, len(qids)))
+    print('per-SID loop: {:.3f}s, {} queries'.format(loop_time, loop_queries.count))
+    print('batch:        {:.3f}s, {} queries'.format(batch_time, batch_queries.count))
+    print('pandas batch: {:.3f}s, {} queries'.format(pandas_time, pandas_queries.count))
+    print('sql engine:   {:.3f}s, {} queries'.format(sql_time, sql_queries.count))
+    print('scoring only (weight model, no database): {:.3f}s'.format(scoring_time))
+    print('mismatches:   {}'.format(len(different)))
+    assert not different, different[:10]
+
+    # the original loop cannot take these, the current engines must still agree with each other
+    edge_sids = sids[:args.edge_cases]
+    seed_edge_case_followups(edge_sids, qids)
+    reference = calculate_aspiration_indices_pandas(edge_sids)
+    single = {sid: calculate_aspiration_index(sid) for sid in edge_sids}
+    different = mismatches(edge_sids, reference, single, calculate_aspiration_indices(edge_sids),
+                           calculate_aspiration_indices_sql(edge_sids))
+    print('edge case mismatches: {} of {} survivors'.format(len(different), len(edge_sids)))
+    assert not different, different[:10]
+
+
+if __name__ == '__main__':
+    main()
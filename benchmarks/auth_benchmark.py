@@ -0,0 +1,79 @@
+# Measures requests/second through the token_validator decorator without any internet access.
+# Run from the repository root: python -m benchmarks.auth_benchmark
+import argparse
+import os
+import tempfile
+from time import perf_counter, time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import constants
+
+
+def write_local_key(directory):
+    '''
+    Generates an RSA key pair, writes the public key as PEM and returns the private key used to mint tokens
+    '''
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem_path = os.path.join(directory, 'benchmark_public_key.pem')
+    with open(pem_path, 'wb') as f:
+        f.write(private_key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                      format=serialization.PublicFormat.SubjectPublicKeyInfo))
+    return private_key, pem_path
+
+
+def mint_token(private_key, seq=0):
+    # no email claim, so the caller lookup in NgoUsers is skipped and no database is needed
+    claims = {'aud': constants.client_id, 'exp': time() + 3600, 'seq': seq}
+    return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': 'benchmark'})
+
+
+def run(client, tokens):
+    start = perf_counter()
+    for token in tokens:
+        response = client.get('/benchmark/auth', headers={'Authorization': 'Bearer ' + token})
+        assert response.status_code == 200, response.data
+    elapsed = perf_counter() - start
+    return len(tokens) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    private_key, pem_path = write_local_key(directory)
+
+    # point the app at the local key before it builds its key provider
+    constants.jwks_source = 'pem'
+    constants.jwks_uri = pem_path
+    import flask_app
+
+    @flask_app.app.route('/benchmark/auth', methods=['GET'])
+    @flask_app.token_validator
+    def benchmark_auth():
+        return 'OK', 200
+
+    client = flask_app.app.test_client()
+
+    # cold: every request carries a token that has not been seen before, so the signature is verified each time
+    cold_tokens = [mint_token(private_key, i) for i in range(args.requests)]
+    flask_app.token_cache.clear()
+    cold_rps = run(client, cold_tokens)
+
+    # warm: the same token is replayed, as a single page session does
+    warm_tokens = [mint_token(private_key)] * args.requests
+    flask_app.token_cache.clear()
+    warm_rps = run(client, warm_tokens)
+
+    print('requests per run: {}'.format(args.requests))
+    print('cold (signature verified every call): {:.0f} req/s'.format(cold_rps))
+    print('warm (verified token cache hits):     {:.0f} req/s'.format(warm_rps))
+    print('token cache: {}'.format(flask_app.token_cache.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Shows query count and latency of DBHelper.get_budget for survivors with many budget tables,
+# next to the former per-table loading.
+# Run from the repository root: python -m benchmarks.budget_benchmark
+import argparse
+import random
+from time import perf_counter
+
+from benchmarks.fixtures import create_app, seed_reference_data, seed_survivors, seed_budgets, QueryCounter
+from models import *
+
+
+def get_budget_per_table(sid):
+    # the former implementation: an actual and a projected query for every budget table, paired by position
+    items = {}
+    for budget in db.session.query(Budget).filter(Budget.SID == sid).all():
+        actual = db.session.query(BudgetActualSpent).filter(
+            BudgetActualSpent.BUDGET_TBL_ID == budget.BUDGET_TBL_ID).order_by(BudgetActualSpent.ITEM).all()
+        projected = db.session.query(BudgetProjected).filter(
+            BudgetProjected.BUDGET_TBL_ID == budget.BUDGET_TBL_ID).order_by(BudgetProjected.ITEM).all()
+        items[budget.BUDGET_TBL_ID] = {projected[i].ITEM: (actual[i].ACTUAL_ID, projected[i].PROJECTED_ID)
+                                       for i in range(len(actual))}
+    return items
+
+
+def measure(func, sid, repeat):
+    with QueryCounter() as queries:
+        start = perf_counter()
+        for _ in range(repeat):
+            result = func(sid)
+        elapsed = perf_counter() - start
+    return result, queries.count // repeat, 1000 * elapsed / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=15)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(1)
+    create_app()
+    from DBHelper import DBHelper
+    helper = DBHelper()
+    seed_reference_data()
+
+    tables = [1, 5, 10, 25, 50, 100]
+    seed_survivors(len(tables))
+    print('{:>7} {:>14} {:>14} {:>14} {:>14}'.format('tables', 'loop queries', 'loop ms', 'joined queries',
+                                                     'joined ms'))
+    for sid, count in enumerate(tables, start=1):
+        seed_budgets(sid, count, args.items)
+        looped, loop_queries, loop_ms = measure(get_budget_per_table, sid, args.repeat)
+        joined, joined_queries, joined_ms = measure(helper.get_budget, sid, args.repeat)
+        assert {b: {item: (line['actual'].ACTUAL_ID, line['projected'].PROJECTED_ID) for item, line in t.items()}
+                for b, t in joined['items'].items()} == looped
+        print('{:>7} {:>14} {:>14.2f} {:>14} {:>14.2f}'.format(count, loop_queries, loop_ms, joined_queries,
+                                                               joined_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+# Shared helpers for the benchmarks: an in-memory sqlite app seeded with synthetic survivors
+import random
+from datetime import date, datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import event
+
+from extensions import db
+from models import *
+
+ASPIRATION_TYPE_ID = 3
+
+
+def create_app(uri='sqlite://'):
+    '''
+    Returns a pushed app context bound to an empty database with every table created
+    '''
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    ctx = app.app_context()
+    ctx.push()
+    db.create_all()
+    return app
+
+
+class QueryCounter(object):
+    '''
+    Counts the statements sent to the database while in use as a context manager
+    '''
+
+    def __init__(self):
+        self.count = 0
+
+    def _count(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self._count)
+
+
+def seed_reference_data():
+    db.session.add_all([SJFLStatus(STATUS_ID=1, STATUS='To be Enrolled'), SJFLStatus(STATUS_ID=2, STATUS='Enrolled')])
+    db.session.add_all([FollowUpTypes(FOLLOWUPTYPEID=1, FOLLOWUPTYPE='BASELINE'),
+                        FollowUpTypes(FOLLOWUPTYPEID=2, FOLLOWUPTYPE='COUNSELING'),
+                        FollowUpTypes(FOLLOWUPTYPEID=ASPIRATION_TYPE_ID, FOLLOWUPTYPE='ASPIRATION')])
+    db.session.add(NgoUserRoles(ROLE_ID=4, RNAME='Volunteer', ACTIVE=1))
+    db.session.add(NgoUsers(UID=1, UNAME='benchmark', UEMAIL='benchmark@sjfl.org', ACTIVE=1, ROLE_ID=4))
+    db.session.commit()
+
+
+def seed_aspiration_questions(categories=3, parameters=3, attributes=4):
+    '''
+    Creates CATEGORY >> PARAMETER >> ATTRIBUTE questions with random weights, returns their ids
+    '''
+    qids = []
+    for c in range(categories):
+        category_w = random.randint(1, 5)
+        for p in range(parameters):
+            parameter_w = random.randint(1, 5)
+            for a in range(attributes):
+                question = FollowupQuestions(FOLLOWUPTYPEID=ASPIRATION_TYPE_ID, QUESTION_TEXT='C%d P%d A%d' % (c, p, a),
+                                             QUESTION_TYPE='RATING', ACTIVE=1, ORDERNUMBER=1001)
+                db.session.add(question)
+                db.session.flush()
+                db.session.add(AspirationQuestionWeights(QUESTIONID=question.QUESTIONID,
+                                                         ATTRIBUTE_W=random.randint(1, 5),
+                                                         CATEGORY='CATEGORY %d' % c, CATEGORY_W=category_w,
+                                                         PARAMETER='PARAMETER %d' % p, PARAMETER_W=parameter_w))
+                qids.append(question.QUESTIONID)
+    db.session.commit()
+    return qids
+
+
+def seed_survivors(count, start_sid=1):
+    '''
+    Creates count survivors with their hospital, family, communication, contact and status rows
+    '''
+    first_names = ['Lakshmi', 'Laxmi', 'Mohammed', 'Mohd', 'Priya', 'Arjun', 'Ananya', 'Rahul', 'Fatima', 'Suresh']
+    last_names = ['Sharma', 'Verma', 'Khan', 'Iyer', 'Reddy', 'Das', 'Patil', 'Singh', 'Nair', 'Gupta']
+    objects = []
+    for sid in range(start_sid, start_sid + count):
+        objects.append(PersonalInformation(SID=sid, FIRST_NAME=random.choice(first_names),
+                                           LAST_NAME=random.choice(last_names), GENDER='F', PHOTO_URL='',
+                                           STATUS_ID=1, DATE_OF_BIRTH=date(2012, 1, 1),
+                                           ADMISSION_DATE=date(2022, 1, 1) + timedelta(days=sid % 365),
+                                           LOCATION='Mumbai', CENTRE='Parel'))
+        objects.append(HospitalInfo(HOSPITAL_NAME='Tata Memorial', HOSPITAL_REGNO='REG%06d' % sid,
+                                    CANCER_TYPE='ALL', CANCER_STAGE='II', SID=sid))
+        objects.append(FamilyDetails(SIBLING_DETAILS='', SID=sid))
+        objects.append(CommunicationDetails(ADDRESS='Address %d' % sid, DISTRICT='Mumbai', PINCODE='400012', SID=sid))
+        objects.append(Contacts(SID=sid, PHONE_NUMBER='+91 98%08d' % sid, CONTACT_RELATION='Mother',
+                                LAST_UPDATED=datetime.now()))
+        objects.append(StatusUpdate(SID=sid, STATUS_ID=1, REMARKS='To be Onboarded'))
+    db.session.bulk_save_objects(objects)
+    db.session.commit()
+
+
+def seed_aspiration_followups(sids, qids, per_survivor=1):
+    '''
+    Creates per_survivor ASPIRATION followups with random answers for every sid
+    '''
+    base = datetime(2022, 1, 1)
+    for sid in sids:
+        for n in range(per_survivor):
+            master = FollowupMaster(FOLLOWUPTYPEID=ASPIRATION_TYPE_ID, SID=sid, FOLLOWEDUPBY=1,
+                                    FOLLOWUPDATE=base + timedelta(days=30 * n, seconds=sid))
+            db.session.add(master)
+            db.session.flush()
+            db.session.bulk_save_objects([FollowUpAnswers(ANSWER=str(random.randint(0, 5)),
+                                                          FOLLOWUPID=master.FOLLOWUPID, QUESTIONID=qid)
+                                          for qid in qids])
+    db.session.commit()
+
+
+# answers the aspiration index counts as 0 next to integers written with spaces or a sign
+EDGE_CASE_ANSWERS = ['3.5', ' ', '', 'NA', '1e3', '4,0', ' 4 ', '+2', '-1', '05', None]
+
+
+def seed_edge_case_followups(sids, qids):
+    '''
+    Gives every sid a later ASPIRATION followup, half of them with answers that are not plain integers and the others
+    with two followups on the same date
+    '''
+    followupdate = datetime(2030, 1, 1)
+    for i, sid in enumerate(sids):
+        for n in range(1 if i % 2 == 0 else 2):
+            master = FollowupMaster(FOLLOWUPTYPEID=ASPIRATION_TYPE_ID, SID=sid, FOLLOWEDUPBY=1, FOLLOWUPDATE=followupdate)
+            db.session.add(master)
+            db.session.flush()
+            answers = [random.choice(EDGE_CASE_ANSWERS) if i % 2 == 0 else str(random.randint(0, 5)) for qid in qids]
+            db.session.bulk_save_objects([FollowUpAnswers(ANSWER=answer, FOLLOWUPID=master.FOLLOWUPID, QUESTIONID=qid)
+                                          for answer, qid in zip(answers, qids)])
+    db.session.commit()
+
+
+def seed_plan(sid, rows, cols, skip_every=0):
+    '''
+    Creates a rows x cols plan for a survivor, leaving out every skip_every-th cell when set
+    '''
+    plan = Plan(SID=sid)
+    db.session.add(plan)
+    db.session.flush()
+    row_headers = [PlanColY(PLAN_TBL_ID=plan.PLAN_TBL_ID, COL_HEADER='Row %d' % r) for r in range(rows)]
+    col_headers = [PlanColX(PLAN_TBL_ID=plan.PLAN_TBL_ID, COL_HEADER='Col %d' % c) for c in range(cols)]
+    db.session.add_all(row_headers + col_headers)
+    db.session.flush()
+    cells = []
+    for r, row in enumerate(row_headers):
+        for c, col in enumerate(col_headers):
+            if skip_every and (r * cols + c) % skip_every == 0:
+                continue
+            cells.append(PlanData(PLAN_COL_X_ID=col.PLAN_COL_X_ID, PLAN_COL_Y_ID=row.PLAN_COL_Y_ID,
+                                  PLAN_DATA='%d-%d' % (r, c)))
+    db.session.bulk_save_objects(cells)
+    db.session.commit()
+    return plan.PLAN_TBL_ID
+
+
+def seed_budgets(sid, tables, items):
+    '''
+    Creates tables budget tables for a survivor, each with items actual and projected lines
+    '''
+    for t in range(tables):
+        budget = Budget(SID=sid, BUDGET_NAME='Budget %d' % t)
+        db.session.add(budget)
+        db.session.flush()
+        lines = []
+        for i in range(items):
+            lines.append(BudgetActualSpent(BUDGET_TBL_ID=budget.BUDGET_TBL_ID, ITEM='Item %03d' % i,
+                                           UNIT=random.randint(0, 5), PERIOD=random.randint(1, 12),
+                                           UNIT_COST=float(random.randint(10, 500))))
+            lines.append(BudgetProjected(BUDGET_TBL_ID=budget.BUDGET_TBL_ID, ITEM='Item %03d' % i,
+                                         UNIT=random.randint(0, 5), PERIOD=random.randint(1, 12),
+                                         UNIT_COST=float(random.randint(10, 500))))
+        db.session.bulk_save_objects(lines)
+    db.session.commit()
@@ -0,0 +1,120 @@
+# Measures recall and latency of the fuzzy name lookups of the survivor search index on a synthetic name corpus,
+# against a scan computing the edit distance to every distinct name.
+# Run from the repository root: python -m benchmarks.fuzzy_benchmark
+import argparse
+import random
+import string
+from time import perf_counter
+
+from search_index import SurvivorSearchIndex, edit_distance, max_distance, normalize, phonetic_key
+
+# spellings staff actually meet for the same name
+VARIANTS = [
+    ['Mohammed', 'Mohammad', 'Muhammad', 'Mohd', 'Mohamed'],
+    ['Lakshmi', 'Laxmi', 'Lakshmy', 'Lakhsmi'],
+    ['Priya', 'Preeya', 'Priyaa'],
+    ['Sunil', 'Suneel', 'Sunill'],
+    ['Fatima', 'Fathima', 'Fatma'],
+    ['Shailesh', 'Sailesh', 'Shailes'],
+    ['Deepak', 'Dipak', 'Deepack'],
+    ['Vijay', 'Vijai', 'Wijay'],
+    ['Zubair', 'Jubair', 'Zubayr'],
+    ['Chandra', 'Candra', 'Chandrah'],
+    ['Pooja', 'Puja', 'Poojaa'],
+    ['Kavitha', 'Kavita', 'Kavitaa'],
+    ['Srinivas', 'Shrinivas', 'Sreenivas'],
+    ['Yusuf', 'Yousuf', 'Yousaf'],
+    ['Aishwarya', 'Aishvarya', 'Eshwarya']
+]
+
+SYLLABLES = ['ra', 'ma', 'ni', 'sha', 'ka', 'vi', 'ja', 'ya', 'pri', 'la', 'su', 'de', 'an', 'ar', 'in', 'ta', 'na',
+             'ru', 'dha', 'go', 'pa', 'mi', 'sa', 'ha', 'bi', 'jo', 'ti', 'va', 'ke', 'shi']
+
+
+def synthetic_name():
+    return ''.join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4))).capitalize()
+
+
+def typo(name):
+    # one random substitution, deletion, insertion or transposition
+    name = list(name.lower())
+    i = random.randrange(len(name))
+    kind = random.randrange(4)
+    if kind == 0:
+        name[i] = random.choice(string.ascii_lowercase)
+    elif kind == 1 and len(name) > 3:
+        del name[i]
+    elif kind == 2:
+        name.insert(i, random.choice(string.ascii_lowercase))
+    elif i < len(name) - 1:
+        name[i], name[i + 1] = name[i + 1], name[i]
+    return ''.join(name)
+
+
+def scan(names, text):
+    # what a lookup without the candidate index costs: every distinct name is compared
+    limit = max_distance(text)
+    key = phonetic_key(text)
+    return {name for name in names if edit_distance(text, name, limit) <= limit or phonetic_key(name) == key}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--survivors', type=int, default=50000)
+    parser.add_argument('--distinct', type=int, default=8000)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    pool = set()
+    while len(pool) < args.distinct:
+        pool.add(synthetic_name())
+    pool = sorted(pool) + [group[0] for group in VARIANTS]
+    last_names = sorted({synthetic_name() for _ in range(args.distinct // 2)})
+
+    documents = [{'SID': sid, 'FIRST_NAME': random.choice(pool), 'LAST_NAME': random.choice(last_names)}
+                 for sid in range(1, args.survivors + 1)]
+    index = SurvivorSearchIndex()
+    start = perf_counter()
+    index.build(lambda: documents)
+    build_time = perf_counter() - start
+
+    # half transliteration variants of names in the corpus, half typos
+    queries = []
+    while len(queries) < args.queries:
+        if random.random() < 0.5:
+            group = random.choice(VARIANTS)
+            queries.append((normalize(random.choice(group[1:])), normalize(group[0])))
+        else:
+            name = random.choice(pool)
+            queries.append((typo(name), normalize(name)))
+
+    first_names = index._fields['FIRST_NAME']
+    start = perf_counter()
+    found = [target in first_names.similar(text) for text, target in queries]
+    index_time = perf_counter() - start
+
+    start = perf_counter()
+    hits = 0
+    for text, target in queries:
+        results = index.search(text, limit=10)
+        hits += any(normalize(first) == target for _, first, _ in results)
+    search_time = perf_counter() - start
+
+    distinct = list(first_names.sids)
+    start = perf_counter()
+    scanned = [target in scan(distinct, text) for text, target in queries[:200]]
+    scan_time = perf_counter() - start
+
+    print('survivors: {}, distinct first names: {}, queries: {}'.format(args.survivors, len(distinct), len(queries)))
+    print('index build:            {:.2f}s'.format(build_time))
+    print('candidate index recall: {:.3f}, {:.1f} us per lookup'.format(
+        sum(found) / len(found), 1e6 * index_time / len(queries)))
+    print('search box recall@10:   {:.3f}, {:.1f} us per search'.format(
+        hits / len(queries), 1e6 * search_time / len(queries)))
+    print('full scan recall:       {:.3f}, {:.1f} us per lookup'.format(
+        sum(scanned) / len(scanned), 1e6 * scan_time / len(scanned)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Imports generated onboarding sheets of growing size through the chunked streaming import and reports its peak memory,
+# which should stay the same whatever the number of rows, next to the size of the sheet.
+# Run from the repository root: python -m benchmarks.import_benchmark
+import argparse
+import csv
+import os
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from benchmarks.fixtures import create_app, seed_reference_data
+from models import *
+from survivor_import import read_rows
+
+HEADERS = ['Patient ID', 'Patient First Name', 'Patient Last Name', 'DOB (DD/MM/YYYY)', 'Patient Gender',
+           'Nationality', 'Blood Group', 'Admission Date', 'Latest Photo', 'Hospital Name', 'Location', 'Centre',
+           'Hospital Reg No', 'Hospital Reg Date (DD/MM/YYYY)', 'Type Of Cancer', 'Name of Treating Doctor',
+           "Father's Name", "Father's Age", "Father's Qualification", "Father's Occupation", 'Father Monthly Income',
+           "Mother's Name", "Mother's Age", "Mother's Qualification", "Mother's Occupation", 'Mother Monthly Income',
+           'Sibling Details', 'Remarks, if any', 'Address', 'District', 'State', 'Country', 'Pincode', 'Email Id',
+           'Contact No1', 'Relation to Patient-1', 'Contact No2', 'Relation to Patient-2']
+
+
+def sheet_row(sid):
+    return [sid, 'First %d' % sid, 'Last', '01/01/2012', 'F', 'Indian', 'O+', '01/01/2022', '', 'Tata Memorial',
+            'Mumbai', 'Parel', 'REG%06d' % sid, '01/01/2022', 'ALL', 'Dr Rao', 'Father', '01/01/1982', 'Graduate', 'Driver',
+            '15000', 'Mother', '01/01/1984', 'Graduate', 'Teacher', '12000', '1 brother', '', 'Address %d' % sid, 'Mumbai',
+            'Maharashtra', 'India', '400012', '', '98%08d' % sid, 'Mother', '97%08d' % sid, 'Father']
+
+
+def write_sheet(path, start, count):
+    with open(path, 'w', newline='') as sheet:
+        writer = csv.writer(sheet)
+        writer.writerow(HEADERS)
+        for sid in range(start, start + count):
+            writer.writerow(sheet_row(sid))
+
+
+def measured(func):
+    tracemalloc.start()
+    start = perf_counter()
+    result = func()
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    create_app()
+    from DBHelper import DBHelper
+    helper = DBHelper()
+    # the search index holds every survivor however they were added, left out to compare the imports themselves
+    helper.search_index.update = lambda sid, **fields: None
+    seed_reference_data()
+    directory = tempfile.mkdtemp()
+
+    print('{:>8} {:>10} {:>10} {:>10}'.format('rows', 'sheet MB', 'peak MB', 'rows/s'))
+    start = 1
+    for count in args.rows:
+        path = os.path.join(directory, 'sheet_%d.csv' % count)
+        write_sheet(path, start, count)
+        with open(path, 'rb') as sheet:
+            (status, report), elapsed, peak = measured(
+                lambda: helper.import_survivors(read_rows(sheet, path), args.chunk_size))
+        assert status == 'SUCCESS' and report.IMPORTED == count and not report.ERRORS, report
+        start += count
+        print('{:>8} {:>10.1f} {:>10.1f} {:>10.0f}'.format(count, os.path.getsize(path) / 2 ** 20, peak,
+                                                           count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Compares the keyset pages of GET /survivors with OFFSET pages at increasing depth into the survivor table.
+# Run from the repository root: python -m benchmarks.listing_benchmark
+import argparse
+import random
+from time import perf_counter
+
+from benchmarks.fixtures import create_app, seed_reference_data, seed_survivors
+from models import *
+
+
+def offset_page(offset, limit, centre=None):
+    query = db.session.query(PersonalInformation.SID, PersonalInformation.FIRST_NAME, PersonalInformation.LAST_NAME)
+    if centre:
+        query = query.filter(PersonalInformation.CENTRE == centre)
+    return query.order_by(PersonalInformation.SID).offset(offset).limit(limit).all()
+
+
+def timed(func, repeat=20):
+    start = perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, 1000 * (perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--survivors', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(1)
+    create_app()
+    from DBHelper import DBHelper
+    helper = DBHelper()
+    seed_reference_data()
+    seed_survivors(args.survivors)
+
+    columns = ['FIRST_NAME', 'LAST_NAME']
+    print('{:>8} {:>12} {:>12}'.format('depth', 'offset ms', 'keyset ms'))
+    for depth in [0, args.survivors // 100, args.survivors // 10, args.survivors // 2, args.survivors - args.limit]:
+        offset_rows, offset_ms = timed(lambda: offset_page(depth, args.limit))
+        # the keyset page starting at the same row: after the SID preceding it
+        after = offset_page(depth - 1, 1)[0].SID if depth else None
+        (status, page), keyset_ms = timed(lambda: helper.get_all_survivors(None, after, args.limit, columns))
+        assert [row.SID for row in offset_rows] == [row['SID'] for row in page['survivors']]
+        print('{:>8} {:>12.2f} {:>12.2f}'.format(depth, offset_ms, keyset_ms))
+
+    status, page = helper.get_all_survivors(None, None, args.limit, columns)
+    print('first page total: {} (approximate)'.format(page['total']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Shows query count and latency of DBHelper.get_plan as the plan grid grows,
+# next to the former one-query-per-cell loading.
+# Run from the repository root: python -m benchmarks.plan_benchmark
+import argparse
+from time import perf_counter
+
+from benchmarks.fixtures import create_app, seed_reference_data, seed_survivors, seed_plan, QueryCounter
+from models import *
+
+
+def get_plan_per_cell(sid):
+    # the former implementation: one PlanData query for every row x column pair
+    plan_id = db.session.query(Plan).filter(Plan.SID == sid).all()[0].PLAN_TBL_ID
+    rows = db.session.query(PlanColY).filter(PlanColY.PLAN_TBL_ID == plan_id).all()
+    cols = db.session.query(PlanColX).filter(PlanColX.PLAN_TBL_ID == plan_id).all()
+    data = {}
+    for row in rows:
+        for col in cols:
+            cell = db.session.query(PlanData).filter(PlanData.PLAN_COL_Y_ID == row.PLAN_COL_Y_ID,
+                                                     PlanData.PLAN_COL_X_ID == col.PLAN_COL_X_ID).all()
+            data[str(row.PLAN_COL_Y_ID) + "-" + str(col.PLAN_COL_X_ID)] = cell[0].PLAN_DATA
+    return data
+
+
+def measure(func, sid, repeat):
+    with QueryCounter() as queries:
+        start = perf_counter()
+        for _ in range(repeat):
+            result = func(sid)
+        elapsed = perf_counter() - start
+    return result, queries.count // repeat, 1000 * elapsed / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    create_app()
+    from DBHelper import DBHelper
+    helper = DBHelper()
+    seed_reference_data()
+
+    sizes = [(5, 5), (10, 10), (20, 10), (40, 20), (80, 40)]
+    seed_survivors(len(sizes))
+    print('{:>8} {:>14} {:>14} {:>14} {:>14}'.format('grid', 'loop queries', 'loop ms', 'joined queries',
+                                                      'joined ms'))
+    for sid, (rows, cols) in enumerate(sizes, start=1):
+        seed_plan(sid, rows, cols)
+        looped, loop_queries, loop_ms = measure(get_plan_per_cell, sid, args.repeat)
+        joined, joined_queries, joined_ms = measure(helper.get_plan, sid, args.repeat)
+        assert joined['Data'] == looped
+        print('{:>8} {:>14} {:>14.2f} {:>14} {:>14.2f}'.format('%dx%d' % (rows, cols), loop_queries, loop_ms,
+                                                                joined_queries, joined_ms))
+
+
+if __name__ == '__main__':
+    main()
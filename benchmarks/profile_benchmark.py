@@ -0,0 +1,59 @@
+# Measures the survivor profile load behind GET /survivors/<sid>/basicdetails and guards its query count.
+# Run from the repository root: python -m benchmarks.profile_benchmark
+import argparse
+import random
+from time import perf_counter
+
+from benchmarks.fixtures import create_app, seed_reference_data, seed_survivors, QueryCounter
+from cache import TTLCache
+
+# personal information with every single-row section and the versions joined, plus the contacts
+MAX_PROFILE_QUERIES = 2
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--survivors', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    create_app()
+    from DBHelper import DBHelper
+
+    seed_reference_data()
+    seed_survivors(args.survivors)
+    helper = DBHelper()
+
+    sids = [random.randint(1, args.survivors) for _ in range(args.requests)]
+    # read once by the ETag of GET /survivors/<sid>/basicdetails and passed on to the profile load
+    versions = {sid: helper.get_survivor_version(sid) for sid in set(sids)}
+
+    # uncached: every profile is assembled from the database
+    with QueryCounter() as queries:
+        start = perf_counter()
+        for sid in sids:
+            helper.profile_cache.clear()
+            status, data = helper.get_survivor_info(sid, versions[sid])
+            assert status == 'SUCCESS', data
+        elapsed = perf_counter() - start
+
+    # cached: repeated views of the same survivors are served from the profile cache without a query
+    helper.profile_cache = TTLCache(maxsize=args.survivors)
+    with QueryCounter() as cached_queries:
+        start = perf_counter()
+        for sid in sids:
+            helper.get_survivor_info(sid, versions[sid])
+        cached_elapsed = perf_counter() - start
+
+    per_request = queries.count / len(sids)
+    print('profiles loaded: {}'.format(len(sids)))
+    print('uncached: {:.3f}s, {:.2f} ms per profile, {:.2f} queries per profile'.format(
+        elapsed, 1000 * elapsed / len(sids), per_request))
+    print('cached:   {:.3f}s, {:.2f} ms per profile, {} queries, {}'.format(
+        cached_elapsed, 1000 * cached_elapsed / len(sids), cached_queries.count, helper.profile_cache.stats()))
+    assert per_request <= MAX_PROFILE_QUERIES, 'get_survivor_info regressed to {} queries'.format(per_request)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Compares the survivor search box lookups served by the in-process search index with the LIKE '%...%' queries
+# they replace, and checks that both find the same survivors.
+# Run from the repository root: python -m benchmarks.search_benchmark
+import argparse
+import random
+from time import perf_counter
+
+from sqlalchemy import or_
+
+from benchmarks.fixtures import create_app, seed_reference_data, seed_survivors
+from models import *
+
+
+def search_sql(searchText, limit=5):
+    # the former get_survivors_search queries
+    if searchText.isdigit():
+        query = db.session.query(PersonalInformation).filter(PersonalInformation.SID.like('%{}%'.format(searchText)))
+    elif searchText.count(' ') == 1:
+        first, last = searchText.split(' ')
+        query = db.session.query(PersonalInformation).filter(
+            PersonalInformation.FIRST_NAME.like('%{}%'.format(first)),
+            PersonalInformation.LAST_NAME.like('%{}%'.format(last)))
+    else:
+        query = db.session.query(PersonalInformation).filter(
+            or_(PersonalInformation.FIRST_NAME.like('%{}%'.format(searchText)),
+                PersonalInformation.LAST_NAME.like('%{}%'.format(searchText))))
+    if limit is not None:
+        query = query.limit(limit)
+    return [(row.SID, row.FIRST_NAME, row.LAST_NAME) for row in query.all()]
+
+
+def typeahead_queries(count, survivors):
+    # what the search box sends while a name or SID is typed
+    names = [row for row in db.session.query(PersonalInformation.FIRST_NAME, PersonalInformation.LAST_NAME).all()]
+    queries = []
+    while len(queries) < count:
+        first, last = random.choice(names)
+        kind = random.random()
+        if kind < 0.3:
+            sid = str(random.randint(1, survivors))
+            queries.append(sid[:random.randint(1, len(sid))])
+        elif kind < 0.7:
+            name = random.choice([first, last]).lower()
+            queries.append(name[:random.randint(1, len(name))])
+        elif kind < 0.85:
+            queries.append(first.lower()[1:4])
+        else:
+            queries.append('{} {}'.format(first.lower(), last.lower()[:random.randint(1, len(last))]))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--survivors', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    random.seed(1)
+    create_app()
+    from DBHelper import DBHelper
+    helper = DBHelper()
+    seed_reference_data()
+    seed_survivors(args.survivors)
+
+    start = perf_counter()
+    helper.build_search_index()
+    build_time = perf_counter() - start
+
+    queries = typeahead_queries(args.queries, args.survivors)
+
+    start = perf_counter()
+    for text in queries:
+        search_sql(text)
+    sql_time = perf_counter() - start
+
+    start = perf_counter()
+    for text in queries:
+        helper.search_index.search(text, fuzzy=False)
+    index_time = perf_counter() - start
+
+    mismatches = [text for text in queries
+                  if {row[0] for row in search_sql(text, None)}
+                  != {row[0] for row in helper.search_index.search(text, None, fuzzy=False)}]
+
+    print('survivors: {}, queries: {}'.format(args.survivors, len(queries)))
+    print('index build: {:.3f}s'.format(build_time))
+    print('sql LIKE:    {:.1f} us per query'.format(1e6 * sql_time / len(queries)))
+    print('index:       {:.1f} us per query'.format(1e6 * index_time / len(queries)))
+    print('mismatches:  {}'.format(len(mismatches)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Small in-process caches shared by the DB helpers
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class TTLCache(object):
+    '''
+    Bounded LRU cache whose entries also expire after ttl seconds.
+    Hits, misses, evictions (dropped for size) and invalidations are counted for monitoring.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=300):
+        '''
+        :param maxsize: maximum number of entries, least recently used are evicted first
+        :param ttl: seconds an entry is served for after being stored
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None):
+        '''
+        Returns the cached value or None when missing, expired or stored for another version
+        :param version: version of the underlying data the entry must have been stored with, when given
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and version is not None and entry[2] != version:
+                del self._entries[key]
+                self.invalidations += 1
+            elif entry is not None and time() < entry[0]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            elif entry is not None:
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value, version=None):
+        with self._lock:
+            self._entries[key] = (time() + self.ttl, value, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
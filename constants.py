@@ -6,6 +6,27 @@ db_name = 'sjfl'
 db_driver = 'ODBC Driver 17 for SQL Server'
 client_id = 'bb274705-abac-43f9-8fb3-4198c98a6a4a'
 react_URL = 'http://localhost:3000'
+# token signing keys source: 'remote' (JWKS url), 'file' (local JWKS json) or 'pem' (static public key)
+jwks_source = 'remote'
+jwks_uri = 'https://login.microsoftonline.com/common/discovery/v2.0/keys'
+jwks_cache_ttl = 3600  # seconds
+verified_token_cache_size = 1024
+unregistered_user_cache_ttl = 60  # seconds a caller without a registered user is not looked up again
+# aspiration index engine for cohort computations: 'model' (compiled weights in numpy) or 'sql' (computed in the database)
+aspiration_index_engine = 'model'
+profile_cache_size = 2048
+profile_cache_ttl = 300  # seconds
+etag_max_age = 300  # seconds, ETags of survivor read endpoints change at least this often
+budget_rollup_cache_size = 1024
+budget_rollup_cache_ttl = 600  # seconds
+search_index_refresh_interval = 600  # seconds, picks up survivors written by other worker processes
+default_phone_country_code = '91'  # for numbers written without one
+to_be_enrolled_status = 'To be Enrolled'  # TBL_SJFL_STATUS.STATUS of survivors added from an onboarding sheet
+survivor_list_max_limit = 200
+survivor_count_ttl = 60  # seconds a filtered survivor count is reused for
+import_chunk_size = 500  # survivors committed together by the spreadsheet import
+import_max_chunk_size = 5000
+import_error_report_limit = 1000  # failed rows listed in an import report, the rest are only counted
 
 
 
@@ -1,22 +1,23 @@
+from datetime import datetime
 from http import HTTPStatus
+from functools import wraps
 from time import time
 from flasgger import Swagger
 from flask_cors import CORS
 
 from flasgger import swag_from
-from flask import Flask, Response, request, jsonify
+from flask import Flask, Response, request, jsonify, g, make_response
 
 from DBHelper import DBHelper
+from survivor_import import read_rows, UnsupportedFile
 from models import *
 
 from extensions import db as db_main
 
-from base64 import b64decode
+import click
 import jwt
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
-import requests
+from jwks_provider import create_key_provider
+from token_cache import VerifiedTokenCache
 import constants
 import json
 # Initialize flask app
@@ -37,13 +38,81 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'mssql+pyodbc://' \
                                                 + constants.db_driver.replace(' ', '+')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-CORS(app)
+CORS(app, expose_headers=['ETag'])
 Swagger(app)
 
 db_main.init_app(app)
 
 db = DBHelper()
 
+# public keys used to verify the bearer tokens, cached across requests
+jwks_provider = create_key_provider(constants.jwks_source, constants.jwks_uri, ttl=constants.jwks_cache_ttl)
+
+# claims of tokens that were already verified, so repeated calls skip the signature check
+token_cache = VerifiedTokenCache(maxsize=constants.verified_token_cache_size)
+
+
+def resolve_user(token, token_claims):
+    '''
+    Returns the NgoUsersWithRole of the caller, looked up once per token lifetime.
+    A caller who is not registered is looked up again after constants.unregistered_user_cache_ttl seconds.
+    :param token: raw bearer token
+    :param token_claims: verified claims of the token
+    :return: NgoUsersWithRole or None if the caller is not registered yet
+    '''
+    resolved, user = token_cache.get_user(token)
+    if resolved:
+        return user
+
+    email = token_claims.get('preferred_username') or token_claims.get('email') or token_claims.get('upn')
+    if email is None:
+        return None
+
+    status, data = db.get_user_data(email)
+    if status != 'SUCCESS':
+        token_cache.set_user(token, None, ttl=constants.unregistered_user_cache_ttl)
+        return None
+    token_cache.set_user(token, data)
+    return data
+
+
+def survivor_etag(payload):
+    '''
+    Answers If-None-Match with 304 for a survivor read endpoint, without running the view.
+    The strong ETag is derived from the survivor's data version persisted in TBL_SURVIVOR_VERSION, bumped after
+    every write to the survivor or to the data shared by all survivors, so every worker process sees the same tag.
+    A time bucket of constants.etag_max_age seconds bounds staleness after changes made outside the API.
+    :param payload: name of the representation, keeps the ETags of different endpoints apart
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(sid, *args, **kwargs):
+            # the version is read before the view runs, so a concurrent write can only make the tag older,
+            # the view gets it through g.survivor_version instead of reading it again
+            g.survivor_version = db.get_survivor_version(sid)
+            etag = '{}-{}-{}-{}'.format(payload, sid, g.survivor_version, int(time() // constants.etag_max_age))
+            if request.if_none_match.contains(etag):
+                response = Response(status=HTTPStatus.NOT_MODIFIED.value)
+            else:
+                response = make_response(func(sid, *args, **kwargs))
+                if response.status_code != HTTPStatus.OK.value:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+@app.before_first_request
+def build_search_index():
+    # the index is only a speed-up, a database that cannot be reached must not fail the first request
+    try:
+        status, result = db.build_search_index()
+    except Exception as e:
+        status, result = 'ERROR', str(e)
+    if status != 'SUCCESS':
+        app.logger.warning('Survivor search index not built, it is retried on the first search: %s', result)
 
 
 def token_validator(func):
@@ -52,16 +121,13 @@ def token_validator(func):
             token_header = request.headers.get('Authorization')
             token = token_header.split(' ')[1]
             client_id = constants.client_id
-            jwks_uri = 'https://login.microsoftonline.com/common/discovery/v2.0/keys'
-
-            jwkeys = requests.get(jwks_uri).json()['keys']
-            token_key_id = jwt.get_unverified_header(token)['kid']
-            jwk = [key for key in jwkeys if key['kid'] == token_key_id][0]
-            der_cert = b64decode(jwk['x5c'][0])
-            cert = x509.load_der_x509_certificate(der_cert, default_backend())
-            public_key = cert.public_key()
-            pem_key = public_key.public_bytes(encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo)
-            token_claims = jwt.decode(token, pem_key, audience=client_id, algorithms=["RS256"])
+
+            token_claims = token_cache.get(token)
+            if token_claims is None:
+                token_key_id = jwt.get_unverified_header(token)['kid']
+                public_key = jwks_provider.get_key(token_key_id)
+                token_claims = jwt.decode(token, public_key, audience=client_id, algorithms=["RS256"])
+                token_cache.put(token, token_claims)
             now = time()
             if token_claims == None:
                 return "Invalid Token, Please retry", 404
@@ -72,6 +138,11 @@ def token_validator(func):
             if now > token_claims['exp']:
                 return "Session Expired, Please open page in new tab", 404
 
+            # resolve the caller once per token and share it with the handler through the request context
+            g.token_claims = token_claims
+            g.user = resolve_user(token, token_claims)
+            g.role = g.user.ROLE if g.user is not None else None
+
             return func(*args, **kwargs)
 
         except Exception as e:
@@ -100,6 +171,14 @@ def healthcheck():
     return Response(response_string)
 
 
+@app.route('/cachestats', methods=['GET'])
+@token_validator
+def get_cache_stats():
+    return jsonify({'verified_tokens': token_cache.stats(),
+                    'survivor_profiles': db.profile_cache.stats(),
+                    'budget_rollups': db.budget_rollup_cache.stats()}), 200
+
+
 @app.route('/', methods=['GET', 'POST'])
 @swag_from({
     'responses': {
@@ -123,6 +202,9 @@ def get_all_users():
 def updates_user(uid):
     data = request.get_json()
     status = db.update_user(uid, data)
+    if 'SUCCESS' in status.upper():
+        # role or active flag changed, resolve identities again on the next request
+        token_cache.forget_users()
     return (status, 200) if 'SUCCESS' in status.upper() else ("Failed with error: " + status, 500)
 
 
@@ -159,6 +241,9 @@ def store_user():
             ROLE_ID=4
         )
         status = db.add_user(ngo_user)
+        if 'SUCCESS' in status.upper():
+            # the new user may have been remembered as unregistered
+            token_cache.forget_users()
         return (status, 200) if 'SUCCESS' in status.upper() else ("Failed with error: " + status, 500)
 
 
@@ -176,6 +261,8 @@ def get_user(email):
     :param email: str
     :return: complete user details
     """
+    if g.user is not None and g.user.UEMAIL == email:
+        return jsonify(g.user), 200
     status, data = db.get_user_data(email)
     return (jsonify(data), 200) if status == 'SUCCESS' else ("Failed with error: " + data, 500)
 
@@ -241,6 +328,35 @@ def update_aspiration_weightages():
     return (status, 200) if 'SUCCESS' in status.upper() else ("Failed with error: " + status, 500)
 
 
+@app.route('/aspiration/indices', methods=['GET'])
+@token_validator
+def get_aspiration_indices():
+    """
+    Accepts an optional comma separated list of SIDs in the sids query parameter, all survivors otherwise
+    :return: map of SID to its latest aspiration index
+    """
+    sids = request.args.get('sids')
+    try:
+        sids = [int(sid) for sid in sids.split(',') if sid.strip()] if sids else None
+    except ValueError:
+        return "sids must be a comma separated list of numbers", 400
+    status, data = db.get_aspiration_indices(sids)
+    return (jsonify(data), 200) if status == 'SUCCESS' else ("Failed with error: " + data, 500)
+
+
+@app.route('/aspiration/weightages/simulate', methods=['POST'])
+@token_validator
+def simulate_aspiration_weightages():
+    """
+    Expects the same body as PATCH /aspiration/weightages, and an optional top query parameter
+    :return: effect of the candidate weights on every survivor's aspiration index, nothing is saved
+    """
+    data = request.get_json()
+    top = request.args.get('top', default=20, type=int)
+    status, result = db.simulate_aspiration_waightage(data, top)
+    return (jsonify(result), 200) if status == 'SUCCESS' else ("Failed with error: " + result, 500)
+
+
 @app.route('/followups', methods=['POST'])
 @token_validator
 def insert_empty_followup():
@@ -260,10 +376,63 @@ def search_survivor(searchtext):
     return (jsonify(data), 200) if status  == 'SUCCESS' else ("Failed with error: " + data, 500)
 
 
+@app.route('/search', methods=['GET'])
+@token_validator
+def search_survivors():
+    '''
+    Ranked survivor search, q takes free text and field-scoped terms (sid:, name:, first:, last:, regno:, phone:,
+    district:, pincode:), paged with page and per_page
+    '''
+    text = request.args.get('q', '')
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        perPage = min(max(int(request.args.get('per_page', 20)), 1), 100)
+    except ValueError:
+        return "page and per_page must be numbers", 400
+    status, data = db.search_survivors(text, page, perPage)
+    return (jsonify(data), 200) if status == 'SUCCESS' else ("Failed with error: " + data, 500)
+
+
+@app.route('/contacts/lookup', methods=['GET'])
+@token_validator
+def lookup_phone():
+    '''
+    Survivors having a contact with the phone number in the phone query parameter, in any common format
+    '''
+    status, data = db.lookup_phone(request.args.get('phone'))
+    if status == 'SUCCESS':
+        return jsonify(data), 200
+    return (data, 400) if status == 'INVALID' else ("Failed with error: " + data, 500)
+
+
 @app.route('/survivors', methods=['GET'])
 @token_validator
 def get_all_survivors():
-    pass
+    '''
+    Survivors ordered by SID, one page at a time: pass the "next" of a page as after to get the following one.
+    Optional: limit, fields (comma separated), status (comma separated STATUS_IDs), centre, location,
+    admitted_from and admitted_to (YYYY-MM-DD)
+    '''
+    args = request.args
+    try:
+        after = int(args['after']) if args.get('after') else None
+        limit = min(max(int(args.get('limit', 50)), 1), constants.survivor_list_max_limit)
+        filters = {
+            'STATUS_ID': [int(status) for status in args['status'].split(',')] if args.get('status') else None,
+            'CENTRE': args.get('centre'),
+            'LOCATION': args.get('location'),
+            'ADMITTED_FROM': datetime.strptime(args['admitted_from'], '%Y-%m-%d').date()
+            if args.get('admitted_from') else None,
+            'ADMITTED_TO': datetime.strptime(args['admitted_to'], '%Y-%m-%d').date()
+            if args.get('admitted_to') else None
+        }
+    except ValueError as e:
+        return "Invalid parameter: " + str(e), 400
+    columns = [field.strip() for field in args['fields'].split(',') if field.strip()] if args.get('fields') else None
+    status, data = db.get_all_survivors(filters, after, limit, columns)
+    if status == 'SUCCESS':
+        return jsonify(data), 200
+    return (data, 400) if status == 'INVALID' else ("Failed with error: " + data, 500)
 
 
 @app.route('/survivors', methods=['POST'])
@@ -274,6 +443,28 @@ def add_survivor():
     return (status, 200) if 'SUCCESS' in status.upper() else ("Failed with error: " + status, 500)
 
 
+@app.route('/survivors/import', methods=['POST'])
+@token_validator
+def import_survivors():
+    '''
+    Adds the survivors of an uploaded onboarding spreadsheet (File: .xlsx or .csv with the template headers),
+    read and committed chunk_size rows at a time. Rows that cannot be added are skipped and listed in the report.
+    '''
+    file = request.files.get('File')
+    if file is None or not file.filename:
+        return "No file uploaded", 400
+    try:
+        chunkSize = min(max(int(request.args.get('chunk_size', constants.import_chunk_size)), 1),
+                        constants.import_max_chunk_size)
+        rows = read_rows(file.stream, file.filename)
+    except UnsupportedFile as e:
+        return str(e), 415
+    except ValueError as e:
+        return "Invalid file or parameter: " + str(e), 400
+    status, data = db.import_survivors(rows, chunkSize)
+    return (jsonify(data), 200) if status == 'SUCCESS' else ("Failed with error: " + data, 500)
+
+
 @app.route('/survivors/<sid>/sjflsupport', methods=['GET'])
 @token_validator
 def get_support_data(sid):
@@ -310,6 +501,7 @@ def delete_support_data(sid):
 
 @app.route('/survivors/<sid>/followups', methods=['GET'])
 @token_validator
+@survivor_etag('followups')
 def get_all_followups(sid):
     status, data = db.get_followup_data_for_sid(sid, futype='COUNSELING') # TODO: change this to GENERAL
     return (jsonify(data), 200) if status == 'SUCCESS' else ("Failed with error: " + data, 500)
@@ -341,12 +533,14 @@ def delete_insurance_card(sid):
 
 @app.route('/survivors/<sid>/basicdetails', methods=['GET'])
 @token_validator
+@survivor_etag('basicdetails')
 def get_basic_details(sid):
-    status, data = db.get_survivor_info(sid)
+    status, data = db.get_survivor_info(sid, g.survivor_version)
     return (jsonify(data), 200) if status  == 'SUCCESS' else ("Failed with error: " + data, 500)
 
 @app.route('/survivors/<sid>/budget', methods=['GET'])
 @token_validator
+@survivor_etag('budget')
 def get_survivor_budget(sid):
     survivorBudget = db.get_budget(sid)
     return jsonify(survivorBudget)
@@ -367,13 +561,35 @@ def add_survivor_budget(sid):
 def update_survivor_budget(sid):
     req = request.get_json()
     items = req.get('items')
-    failed = db.update_budget(items)
-    if not failed:
+    status, result = db.update_budget(items, sid)
+    if status == "SUCCESS":
         return "Success", 200
     return "Failed", 400
 
+@app.route('/survivors/<sid>/budget/rollup', methods=['GET'])
+@token_validator
+def get_survivor_budget_rollup(sid):
+    '''
+    Actual and projected totals with their variance for each budget table of the survivor and overall
+    '''
+    status, data = db.get_budget_rollup(sid)
+    return (jsonify(data), 200) if status == 'SUCCESS' else ("Failed with error: " + data, 500)
+
+@app.route('/budget/rollups', methods=['GET'])
+@token_validator
+def get_budget_rollups():
+    '''
+    Budget totals across survivors, by centre or with group=survivor by survivor, optionally for one centre
+    '''
+    group = request.args.get('group', 'centre')
+    if group not in ('centre', 'survivor'):
+        return "group must be centre or survivor", 400
+    status, data = db.get_budget_rollups(group, request.args.get('centre'))
+    return (jsonify(data), 200) if status == 'SUCCESS' else ("Failed with error: " + data, 500)
+
 @app.route('/survivors/<sid>/plan', methods=['GET'])
 @token_validator
+@survivor_etag('plan')
 def get_survivor_plan(sid):
     survivorPlan = db.get_plan(sid)
     return jsonify(survivorPlan)
@@ -398,6 +614,34 @@ def update_survivor_plan(sid):
         return "Success", 200
     return "Failed", 400
 
+@app.route('/survivors/<sid>/planDelta', methods=['PATCH'])
+@token_validator
+def update_survivor_plan_delta(sid):
+    '''
+    Applies only the changed headers and cells of a plan against the version the client read
+    Body: {"version": n, "row": {...}, "col": {...}, "data": {...}} with the changed keys of /planUpdate
+    '''
+    req = request.get_json(silent=True)
+    if not isinstance(req, dict):
+        return "A JSON object body is required", 400
+    if req.get('version') is None:
+        return "version is required", 400
+    try:
+        version = int(req['version'])
+    except (TypeError, ValueError):
+        return "version must be a number", 400
+    rows = req.get('row') or {}
+    cols = req.get('col') or {}
+    data = req.get('data') or {}
+    if not all(isinstance(changes, dict) for changes in (rows, cols, data)):
+        return "row, col and data must be objects", 400
+    status, result = db.apply_plan_delta(sid, version, rows, cols, data)
+    if status == "SUCCESS":
+        return jsonify({"Version": result}), 200
+    if status == "CONFLICT":
+        return jsonify(result), 409
+    return result, 400
+
 @app.route('/survivors/<sid>/addPlanCol', methods=['PATCH'])
 @token_validator
 def add_survivor_plan_col(sid):
@@ -445,7 +689,7 @@ def delete_plan_col(sid):
 def delete_budget_table(sid):
     data = request.get_json()
     id = data.get("id")
-    result = db.deleteBudgetTable(id) 
+    result = db.deleteBudgetTable(id, sid)
     if not result:
         return "Success", 200
     return "Failed", 400
@@ -456,7 +700,7 @@ def delete_budget_row(sid):
     data = request.get_json()
     a_id = data.get("a_id")
     p_id = data.get("p_id")
-    result = db.deleteBudgetRow(a_id, p_id) 
+    result = db.deleteBudgetRow(a_id, p_id, sid)
     if not result:
         return "Success", 200
     return "Failed", 400
@@ -467,7 +711,7 @@ def add_budget_row(sid):
     data = request.get_json()
     name = data.get("name")
     id = data.get("id")
-    result = db.addBudgetRow(name, id) 
+    result = db.addBudgetRow(name, id, sid) 
     if not result:
         return "Success", 200
     return "Failed", 400
@@ -626,6 +870,13 @@ def get_survivor_aspiration_details(sid):
     return (jsonify(data), 200) if status  == 'SUCCESS' else ("Failed with error: " + data, 500)
 
 
+@app.route('/survivors/<sid>/aspiration/history', methods=['GET'])
+@token_validator
+def get_survivor_aspiration_history(sid):
+    status, data = db.get_aspiration_history(sid)
+    return (jsonify(data), 200) if status == 'SUCCESS' else ("Failed with error: " + data, 500)
+
+
 @app.route('/survivors/<sid>/aspiration', methods=['PATCH'])
 @token_validator
 def update_survivor_aspiration_details(sid):
@@ -645,6 +896,29 @@ def add_survivor_general_followup():
     pass
 
 
+@app.cli.command('check-aspiration-index')
+@click.option('--repair', is_flag=True, help='Overwrite drifted or missing stored values with the recomputed ones.')
+def check_aspiration_index(repair):
+    """
+    Recomputes the aspiration index of every survivor and reports drift from TBL_ASPIRATION_INDEX
+    """
+    drift = db.check_aspiration_index(repair=repair)
+    for item in sorted(drift, key=lambda x: x['SID']):
+        click.echo('SID {SID}: stored {STORED}, computed {COMPUTED}'.format(**item))
+    click.echo('{} survivor(s) drifted{}'.format(len(drift), ', repaired' if repair and drift else ''))
+
+
+@app.cli.command('backfill-phone-keys')
+@click.option('--batch-size', default=1000, show_default=True, help='Contacts updated per commit.')
+def backfill_phone_keys(batch_size):
+    """
+    Fills TBL_CONTACTS.PHONE_KEY for contacts written before it was maintained, safe to run again
+    """
+    counts = db.backfill_phone_keys(batch_size)
+    click.echo('{scanned} contact(s) scanned, {updated} key(s) written, {unparseable} not a phone number'.format(
+        **counts))
+
+
 # By default runs at localhost:5000
 if __name__ == '__main__':
     app.run(debug=True)
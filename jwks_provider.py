@@ -0,0 +1,162 @@
+# In-process cache of the public keys used to verify Azure AD issued tokens
+import json
+import threading
+from base64 import b64decode
+from time import time
+
+import requests
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from jwt.algorithms import RSAAlgorithm
+
+
+class JWKSKeyProvider(object):
+    '''
+    Caches parsed public keys by kid so token validation does not need an outbound call per request.
+    Keys are refreshed in the background once they get close to the TTL, an unknown kid (key rotation)
+    forces a refetch, and concurrent refetches are collapsed into a single call to the JWKS endpoint.
+    '''
+
+    def __init__(self, jwks_uri, ttl=3600, refresh_ahead=300, min_refetch_interval=30, timeout=5):
+        '''
+        :param jwks_uri: url serving the JSON web key set
+        :param ttl: seconds after which the cached keys are considered expired
+        :param refresh_ahead: seconds before expiry at which a background refresh is started
+        :param min_refetch_interval: minimum seconds between two refetches triggered by an unknown kid
+        :param timeout: timeout in seconds for the JWKS http call
+        '''
+        self.jwks_uri = jwks_uri
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+
+        self._keys = {}
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._inflight = None
+        self._inflight_error = None
+
+    def fetch_keys(self):
+        '''
+        Fetches the key set from the source and returns a dict of kid => public key
+        '''
+        jwkeys = requests.get(self.jwks_uri, timeout=self.timeout).json()['keys']
+        return {jwk['kid']: self.parse_jwk(jwk) for jwk in jwkeys if jwk.get('kty') == 'RSA'}
+
+    @staticmethod
+    def parse_jwk(jwk):
+        # prefer the certificate chain when present, otherwise build the key from the modulus/exponent
+        if jwk.get('x5c'):
+            der_cert = b64decode(jwk['x5c'][0])
+            cert = x509.load_der_x509_certificate(der_cert, default_backend())
+            return cert.public_key()
+        return RSAAlgorithm.from_jwk(jwk)
+
+    def get_key(self, kid):
+        '''
+        Returns the public key for a kid, fetching the key set only when needed
+        :param kid: key id from the unverified token header
+        :return: public key object usable by jwt.decode
+        '''
+        age = time() - self._fetched_at
+
+        if kid in self._keys and age < self.ttl:
+            # serve from cache and refresh in the background when close to expiry
+            if age > self.ttl - self.refresh_ahead:
+                self._refresh(wait=False)
+            return self._keys[kid]
+
+        # cold or expired cache, or an unknown kid after a key rotation
+        if age >= self.ttl or age >= self.min_refetch_interval:
+            self._refresh(wait=True)
+
+        key = self._keys.get(kid)
+        if key is None:
+            raise KeyError('Signing key not found for kid: ' + str(kid))
+        return key
+
+    def _refresh(self, wait):
+        '''
+        Single-flight refresh: only one fetch runs at a time, other callers wait for its result
+        :param wait: block until the refresh has completed
+        '''
+        with self._lock:
+            inflight = self._inflight
+            if inflight is None:
+                inflight = self._inflight = threading.Event()
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            if wait:
+                self._do_refresh(inflight)
+            else:
+                threading.Thread(target=self._do_refresh, args=(inflight,), daemon=True).start()
+                return
+        elif not wait:
+            return
+
+        inflight.wait(self.timeout + 1)
+        if self._inflight_error is not None and not self._keys:
+            raise self._inflight_error
+
+    def _do_refresh(self, inflight):
+        try:
+            keys = self.fetch_keys()
+            self._keys = keys
+            self._fetched_at = time()
+            self._inflight_error = None
+        except Exception as e:
+            # keep serving the previously cached keys, the error is raised only on a cold cache
+            self._inflight_error = e
+        finally:
+            with self._lock:
+                self._inflight = None
+            inflight.set()
+
+
+class FileJWKSKeyProvider(JWKSKeyProvider):
+    '''
+    Reads the key set from a local JWKS json file, for deployments without access to the identity provider
+    '''
+
+    def fetch_keys(self):
+        with open(self.jwks_uri) as f:
+            jwkeys = json.load(f)['keys']
+        return {jwk['kid']: self.parse_jwk(jwk) for jwk in jwkeys if jwk.get('kty') == 'RSA'}
+
+
+class StaticPEMKeyProvider(JWKSKeyProvider):
+    '''
+    Verifies every token against a single PEM encoded public key, whatever kid the token carries
+    '''
+
+    def __init__(self, pem_path, **kwargs):
+        super().__init__(pem_path, **kwargs)
+        with open(pem_path, 'rb') as f:
+            self._public_key = serialization.load_pem_public_key(f.read(), default_backend())
+
+    def get_key(self, kid):
+        return self._public_key
+
+
+KEY_PROVIDERS = {
+    'remote': JWKSKeyProvider,
+    'file': FileJWKSKeyProvider,
+    'pem': StaticPEMKeyProvider,
+}
+
+
+def create_key_provider(source, location, ttl=3600):
+    '''
+    Returns the key provider configured for the deployment
+    :param source: one of remote, file or pem
+    :param location: JWKS url for remote, path of the JWKS json or PEM file otherwise
+    :param ttl: seconds the fetched keys are cached for
+    '''
+    if source not in KEY_PROVIDERS:
+        raise ValueError('Unknown key source: ' + str(source))
+    return KEY_PROVIDERS[source](location, ttl=ttl)
@@ -77,11 +77,12 @@ class PersonalInformation(db.Model):
     BLOOD_GROUP = db.Column(db.String(20))
     PHOTO_URL = db.Column(db.String(200), unique=False, nullable=False)
     DATE_OF_BIRTH = db.Column(db.Date())
-    STATUS_ID = db.Column(db.Integer, db.ForeignKey(SJFLStatus.STATUS_ID), nullable=False)
+    # the filters of the survivor listing are indexed, with the clustered SID they keep its keyset pages seeks
+    STATUS_ID = db.Column(db.Integer, db.ForeignKey(SJFLStatus.STATUS_ID), nullable=False, index=True)
     WELCOME_KIT_DISPATCH_DATE = db.Column(db.Date())
-    ADMISSION_DATE = db.Column(db.Date())
-    CENTRE = db.Column(db.String(20))
-    LOCATION = db.Column(db.String(20))
+    ADMISSION_DATE = db.Column(db.Date(), index=True)
+    CENTRE = db.Column(db.String(20), index=True)
+    LOCATION = db.Column(db.String(20), index=True)
 
     def __repr__(self):
         return '<TBL_PERSONAL_INFORMATION (Type: %r)>' % (self.SID)
@@ -102,6 +103,8 @@ class Contacts(db.Model):
     PHONE_NUMBER = db.Column(db.String(20), nullable=False)
     LAST_UPDATED = db.Column(db.DateTime())
     CONTACT_RELATION = db.Column(db.String(20), nullable=False)
+    # PHONE_NUMBER normalized by DBHelper.normalize_phone for exact reverse lookups, NULL when not a phone number
+    PHONE_KEY = db.Column(db.String(16), index=True)
 
     def __repr__(self):
         return '<TBL_CONTACTS (Type: %r) %r>' % (self.SID, self.PHONE_NUMBER)
@@ -369,9 +372,12 @@ class Plan(db.Model):
 
     PLAN_TBL_ID: int
     SID: int
+    VERSION: int
 
     PLAN_TBL_ID = db.Column(db.Integer, primary_key=True, autoincrement=True)
     SID = db.Column(db.Integer, db.ForeignKey('TBL_PERSONAL_INFORMATION.SID'))
+    # bumped on every committed edit of the plan, headers and cells keep the version they were last written in
+    VERSION = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return '<TBL_PLAN (Type: %r) %r>' % (self.SID, self.PLAN_TBL_ID)
@@ -387,6 +393,7 @@ class PlanColX(db.Model):
     PLAN_COL_X_ID = db.Column(db.Integer, primary_key=True, autoincrement=True)
     PLAN_TBL_ID = db.Column(db.Integer, db.ForeignKey('TBL_PLAN.PLAN_TBL_ID'))
     COL_HEADER = db.Column(db.String(50))
+    VERSION = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return '<TBL_PLAN_COL_X (Type: %r) %r>' % (self.PLAN_TBL_ID, self.COL_HEADER)
@@ -402,6 +409,7 @@ class PlanColY(db.Model):
     PLAN_COL_Y_ID = db.Column(db.Integer, primary_key=True, autoincrement=True)
     PLAN_TBL_ID = db.Column(db.Integer, db.ForeignKey('TBL_PLAN.PLAN_TBL_ID'))
     COL_HEADER = db.Column(db.String(50))
+    VERSION = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return '<TBL_PLAN_COL_Y (Type: %r) %r>' % (self.PLAN_TBL_ID, self.COL_HEADER)
@@ -417,6 +425,7 @@ class PlanData(db.Model):
     PLAN_COL_X_ID = db.Column(db.Integer, db.ForeignKey('TBL_PLAN_COL_X.PLAN_COL_X_ID'))
     PLAN_COL_Y_ID = db.Column(db.Integer, db.ForeignKey('TBL_PLAN_COL_Y.PLAN_COL_Y_ID'))
     PLAN_DATA = db.Column(db.String(512))
+    VERSION = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return '<TBL_PLAN_COL_Y (Type: %r) %r>' % (self.PLAN_TBL_ID, self.COL_HEADER)
@@ -515,6 +524,44 @@ class SJFLSupport(db.Model):
         return '<TBL_SJFLSUPPORT (Type: %r) %r>' % (self.SJFLSUPPORT_ID, self.SID)
 
 
+@dataclass
+class AspirationIndex(db.Model):
+    __tablename__ = 'TBL_ASPIRATION_INDEX'
+
+    SID: int
+    ASPIRATION_INDEX: float
+    FOLLOWUPID: int
+    FOLLOWUPDATE: datetime
+
+    SID = db.Column(db.Integer, db.ForeignKey('TBL_PERSONAL_INFORMATION.SID'), primary_key=True, autoincrement=False)
+    ASPIRATION_INDEX = db.Column(db.Float, nullable=False)
+    FOLLOWUPID = db.Column(db.Integer, db.ForeignKey('TBL_FOLLOWUPMASTER.FOLLOWUPID'), nullable=False)
+    FOLLOWUPDATE = db.Column(db.DateTime(), nullable=False)
+
+    def __repr__(self):
+        return '<TBL_ASPIRATION_INDEX (Type: %r) %r>' % (self.SID, self.ASPIRATION_INDEX)
+
+
+# SurvivorVersion row of the data shared by every survivor
+ALL_SURVIVORS = 0
+
+
+@dataclass
+class SurvivorVersion(db.Model):
+    __tablename__ = 'TBL_SURVIVOR_VERSION'
+
+    SID: int
+    VERSION: int
+
+    # SID 0 holds the version of the data shared by every survivor (followup questions, aspiration weights),
+    # so there is no foreign key to TBL_PERSONAL_INFORMATION
+    SID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    VERSION = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return '<TBL_SURVIVOR_VERSION (Type: %r) %r>' % (self.SID, self.VERSION)
+
+
 """#####################################################################################################################
 ########################################### CUSTOM DATACLASSES #########################################################
 #####################################################################################################################"""
@@ -587,6 +634,29 @@ class SearchResult(object):
     LINK: str
 
 
+@dataclass
+class SurvivorSearchHit(object):
+    SID: int
+    FIRST_NAME: str
+    LAST_NAME: str
+    HOSPITAL_REGNO: str
+    DISTRICT: str
+    PINCODE: str
+    SCORE: int
+    MATCHED: list
+    LINK: str
+
+
+@dataclass
+class PhoneLookupResult(object):
+    SID: int
+    FIRST_NAME: str
+    LAST_NAME: str
+    PHONE_NUMBER: str
+    CONTACT_RELATION: str
+    LINK: str
+
+
 @dataclass
 class InsuranceResult(object):
     SID: int
@@ -604,3 +674,66 @@ class PastFollowUpData(object):
     FOLLOWUPTYPE: str
     FOLLOWEDUPBY: int
     FOLLOWUPDATE: str
+
+
+@dataclass
+class AspirationIndexHistory(object):
+    FOLLOWUPID: int
+    FOLLOWUPDATE: str
+    FOLLOWEDUPBY: int
+    ASPIRATION_INDEX: float
+
+
+@dataclass
+class AspirationIndexShift(object):
+    SID: int
+    CURRENT: float
+    SIMULATED: float
+    DELTA: float
+
+
+@dataclass
+class BudgetTableRollup(object):
+    BUDGET_TBL_ID: int
+    BUDGET_NAME: str
+    SID: int
+    ACTUAL: float
+    PROJECTED: float
+    VARIANCE: float
+
+
+@dataclass
+class SurvivorBudgetRollup(object):
+    SID: int
+    CENTRE: str
+    BUDGET_TABLES: int
+    ACTUAL: float
+    PROJECTED: float
+    VARIANCE: float
+
+
+@dataclass
+class CentreBudgetRollup(object):
+    CENTRE: str
+    SURVIVORS: int
+    BUDGET_TABLES: int
+    ACTUAL: float
+    PROJECTED: float
+    VARIANCE: float
+
+
+@dataclass
+class SurvivorImportError(object):
+    ROW: int
+    SID: int
+    ERRORS: list
+
+
+@dataclass
+class SurvivorImportReport(object):
+    ROWS: int
+    IMPORTED: int
+    FAILED: int
+    CHUNKS: int
+    ERRORS: list
+    ERRORS_TRUNCATED: bool
@@ -0,0 +1,522 @@
+# In-process survivor search index, answers the search box without scanning TBL_PERSONAL_INFORMATION
+import itertools
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from time import time
+
+# substrings up to this length are indexed, longer queries intersect the postings of their grams
+GRAM_SIZE = 3
+
+# indexed fields with the weight of a match in them for ranked queries
+FIELD_WEIGHTS = {
+    'SID': 3,
+    'HOSPITAL_REGNO': 3,
+    'PHONE_NUMBER': 3,
+    'FIRST_NAME': 2,
+    'LAST_NAME': 2,
+    'DISTRICT': 1,
+    'PINCODE': 1
+}
+
+# names accepted before ':' in field-scoped queries
+FIELD_ALIASES = {
+    'sid': ('SID',),
+    'name': ('FIRST_NAME', 'LAST_NAME'),
+    'first': ('FIRST_NAME',),
+    'last': ('LAST_NAME',),
+    'regno': ('HOSPITAL_REGNO',),
+    'reg': ('HOSPITAL_REGNO',),
+    'phone': ('PHONE_NUMBER',),
+    'district': ('DISTRICT',),
+    'pincode': ('PINCODE',),
+    'pin': ('PINCODE',)
+}
+
+PHONE_TERM = re.compile(r'^[+\d][\d\-() ]*$')
+
+# how a term matches a value: the whole value, its start, anywhere else, or a differently spelt name
+EXACT, PREFIX, INFIX, FUZZY = 6, 4, 2, 1
+
+# names get fuzzy lookups: same phonetic key or within this many edits, one edit for names up to 4 letters
+FUZZY_FIELDS = ('FIRST_NAME', 'LAST_NAME')
+MAX_EDIT_DISTANCE = 2
+
+# spellings folded together by the phonetic key, applied in order
+PHONETIC_RULES = [
+    (re.compile(r'[^a-z]'), ''),
+    (re.compile(r'x'), 'ks'),
+    (re.compile(r'ph'), 'f'),
+    (re.compile(r'(?<=[kgcjtdsb])h'), ''),
+    (re.compile(r'ck|q|c(?=[aour]|$)'), 'k'),
+    (re.compile(r'c'), 's'),
+    (re.compile(r'z'), 'j'),
+    (re.compile(r'w'), 'v'),
+    (re.compile(r'ee|ii|y$'), 'i'),
+    (re.compile(r'oo'), 'u')
+]
+
+
+def normalize(value):
+    return str(value).strip().lower() if value is not None else ''
+
+
+def normalize_field(field, value):
+    # phone numbers are matched on their digits whatever the spacing or punctuation
+    if field == 'PHONE_NUMBER':
+        return re.sub(r'\D', '', str(value)) if value is not None else ''
+    return normalize(value)
+
+
+def phonetic_key(name):
+    '''
+    Consonant skeleton of a name after folding common transliteration variants, so that
+    Lakshmi/Laxmi, Mohammed/Mohd and Sunil/Suneel share a key. The first letter is always kept.
+    '''
+    name = normalize(name)
+    for pattern, replacement in PHONETIC_RULES:
+        name = pattern.sub(replacement, name)
+    if not name:
+        return ''
+    skeleton = name[0]
+    for char in name[1:]:
+        if char in 'aeiouhy' or char == skeleton[-1]:
+            continue
+        skeleton += char
+    return skeleton
+
+
+def max_distance(text):
+    return 1 if len(text) <= 4 else MAX_EDIT_DISTANCE
+
+
+def deletes(text, distance):
+    '''
+    Returns text and every string made from it by dropping up to distance characters
+    '''
+    result = {text}
+    frontier = {text}
+    for _ in range(distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        result |= frontier
+    return result
+
+
+def edit_distance(a, b, limit):
+    '''
+    Optimal string alignment distance between a and b, any value above limit is reported as limit + 1.
+    Only the band of cells within limit of the diagonal is computed.
+    '''
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    beyond = limit + 1
+    previous = None
+    row = [j if j <= limit else beyond for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [beyond] * (len(b) + 1)
+        current[0] = i if i <= limit else beyond
+        best = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            value = row[j - 1] if a[i - 1] == b[j - 1] else row[j - 1] + 1
+            if row[j] + 1 < value:
+                value = row[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if previous is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1] \
+                    and previous[j - 2] + 1 < value:
+                value = previous[j - 2] + 1
+            current[j] = value if value < beyond else beyond
+            if current[j] < best:
+                best = current[j]
+        if best > limit:
+            return beyond
+        previous, row = row, current
+    return row[-1]
+
+
+def grams(text, size=GRAM_SIZE):
+    '''
+    Returns every substring of text that is at most size characters long
+    '''
+    result = set()
+    for n in range(1, size + 1):
+        for i in range(len(text) - n + 1):
+            result.add(text[i:i + n])
+    return result
+
+
+class FieldIndex(object):
+    '''
+    Index over the distinct normalized values of one field: a sorted list for prefix lookups
+    and n-gram postings for substring lookups, each value pointing to the sorted SIDs having it
+    '''
+
+    def __init__(self, fuzzy=False):
+        '''
+        :param fuzzy: also index phonetic keys and edit-distance deletes of the values
+        '''
+        self.sids = {}
+        self.sorted_values = []
+        self.postings = defaultdict(set)
+        self.fuzzy = fuzzy
+        self.phonetic = defaultdict(set)
+        self.deletes = defaultdict(set)
+
+    def add(self, value, sid):
+        sids = self.sids.get(value)
+        if sids is None:
+            sids = self.sids[value] = []
+            insort(self.sorted_values, value)
+            for gram in grams(value):
+                self.postings[gram].add(value)
+            if self.fuzzy and value:
+                self.phonetic[phonetic_key(value)].add(value)
+                for variant in deletes(value, max_distance(value)):
+                    self.deletes[variant].add(value)
+        i = bisect_left(sids, sid)
+        if i == len(sids) or sids[i] != sid:
+            sids.insert(i, sid)
+
+    def remove(self, value, sid):
+        sids = self.sids.get(value)
+        if sids is None:
+            return
+        i = bisect_left(sids, sid)
+        if i < len(sids) and sids[i] == sid:
+            del sids[i]
+        if sids:
+            return
+        del self.sids[value]
+        del self.sorted_values[bisect_left(self.sorted_values, value)]
+        for gram in grams(value):
+            self.postings[gram].discard(value)
+            if not self.postings[gram]:
+                del self.postings[gram]
+        if self.fuzzy and value:
+            for index, keys in ((self.phonetic, [phonetic_key(value)]),
+                                (self.deletes, deletes(value, max_distance(value)))):
+                for key in keys:
+                    index[key].discard(value)
+                    if not index[key]:
+                        del index[key]
+
+    def prefixed(self, text):
+        '''
+        Yields the values starting with text, in order
+        '''
+        for i in range(bisect_left(self.sorted_values, text), len(self.sorted_values)):
+            value = self.sorted_values[i]
+            if not value.startswith(text):
+                return
+            yield value
+
+    def containing(self, text):
+        '''
+        Returns the values containing text anywhere but at the start, in order
+        '''
+        if len(text) <= GRAM_SIZE:
+            values = self.postings.get(text, set())
+        else:
+            candidates = sorted((self.postings.get(text[i:i + GRAM_SIZE], set())
+                                 for i in range(len(text) - GRAM_SIZE + 1)), key=len)
+            values = set(candidates[0])
+            for posting in candidates[1:]:
+                if not values:
+                    break
+                values &= posting
+        return sorted(value for value in values if text in value and not value.startswith(text))
+
+    def matches(self, text):
+        '''
+        Yields the SIDs whose value contains text, prefix matches first, each group ordered by value then SID.
+        An empty text matches everything, as LIKE '%%' does.
+        '''
+        for value in self.prefixed(text):
+            yield from self.sids[value]
+        if not text:
+            return
+        for value in self.containing(text):
+            yield from self.sids[value]
+
+    def similar(self, text):
+        '''
+        Returns value: edit distance for the values spelt like text, by phonetic key or within max_distance edits.
+        Values sharing only the phonetic key are reported one edit beyond the limit.
+        Candidates come from the phonetic and delete postings, never from a scan of all values.
+        '''
+        if not self.fuzzy or not text:
+            return {}
+        limit = max_distance(text)
+        sounds_like = self.phonetic.get(phonetic_key(text), set())
+        candidates = set(sounds_like)
+        for variant in deletes(text, limit):
+            candidates |= self.deletes.get(variant, set())
+        results = {}
+        for value in candidates:
+            distance = edit_distance(text, value, limit)
+            if distance <= limit or value in sounds_like:
+                results[value] = distance
+        return results
+
+    def scored(self, text):
+        '''
+        Returns SID: EXACT, PREFIX or INFIX for every SID having a value that contains text,
+        FUZZY for those only having a value spelt like it
+        '''
+        scores = {}
+        for value in self.similar(text):
+            for sid in self.sids[value]:
+                scores[sid] = FUZZY
+        for value in self.containing(text):
+            for sid in self.sids[value]:
+                scores[sid] = INFIX
+        for value in self.prefixed(text):
+            match = EXACT if value == text else PREFIX
+            for sid in self.sids[value]:
+                if scores.get(sid, 0) < match:
+                    scores[sid] = match
+        return scores
+
+
+class SurvivorSearchIndex(object):
+    '''
+    Substring index over the survivors' SID, names, hospital registration number, phone numbers,
+    district and pincode.
+    search() matches what the former LIKE '%text%' name and SID lookups matched, prefix matches first.
+    query() ranks survivors for free text and field-scoped terms such as "phone:98200 name:lak".
+    '''
+    FIELDS = tuple(FIELD_WEIGHTS)
+
+    def __init__(self, refresh_interval=None):
+        '''
+        :param refresh_interval: seconds after which the index is reported stale and should be rebuilt,
+                                 picking up survivors written by other processes. Never stale when None.
+        '''
+        self.refresh_interval = refresh_interval
+        self.built_at = None
+        self._documents = {}
+        self._fields = {field: FieldIndex(fuzzy=field in FUZZY_FIELDS) for field in self.FIELDS}
+        self._lock = threading.RLock()
+        # held while a build runs, so that concurrent rebuild requests do not load the survivors again
+        self._building = threading.Lock()
+        # updates made while a build loads its documents, replayed over the new content before it is swapped in
+        self._pending = None
+
+    def __len__(self):
+        return len(self._documents)
+
+    def is_stale(self):
+        if self.built_at is None:
+            return True
+        return self.refresh_interval is not None and time() - self.built_at > self.refresh_interval
+
+    def is_building(self):
+        return self._building.locked()
+
+    def build(self, load, wait=True):
+        '''
+        Replaces the index content. Searches keep being answered from the current content meanwhile,
+        updates made while the documents are loaded are applied to it and replayed over the new content.
+        :param load: callable returning an iterable of dicts with the SID and any of the indexed fields,
+                     PHONE_NUMBER may hold a list of numbers
+        :param wait: when another build is running, wait for it to finish instead of returning at once
+        :return: False when skipped because another build was running
+        '''
+        if not self._building.acquire(blocking=False):
+            if wait:
+                # the running build is used rather than loading the survivors again right after it
+                with self._building:
+                    pass
+            return False
+        try:
+            # recording starts before load() reads the survivors, so no update can fall between the two
+            with self._lock:
+                self._pending = []
+            fresh = SurvivorSearchIndex()
+            for document in load():
+                document = dict(document)
+                fresh._update(document.pop('SID'), document)
+            with self._lock:
+                for sid, fields in self._pending:
+                    if fields is None:
+                        fresh._remove(sid)
+                    else:
+                        fresh._update(sid, fields)
+                self._documents = fresh._documents
+                self._fields = fresh._fields
+                self.built_at = time()
+            return True
+        finally:
+            with self._lock:
+                self._pending = None
+            self._building.release()
+
+    def update(self, sid, **fields):
+        '''
+        Indexes a new survivor or re-indexes the given fields of a known one, other fields are kept
+        '''
+        with self._lock:
+            self._update(sid, fields)
+            if self._pending is not None:
+                self._pending.append((sid, fields))
+
+    def remove(self, sid):
+        with self._lock:
+            self._remove(sid)
+            if self._pending is not None:
+                self._pending.append((sid, None))
+
+    def _remove(self, sid):
+        document = self._documents.pop(int(sid), None)
+        if document is None:
+            return
+        for field in self.FIELDS:
+            for value in document['values'].get(field, ()):
+                self._fields[field].remove(value, int(sid))
+
+    def get(self, sid, field):
+        '''
+        Returns the value of a field as it was given to the index
+        '''
+        document = self._documents.get(int(sid))
+        return document['display'].get(field) if document else None
+
+    def search(self, text, limit=5, fuzzy=True):
+        '''
+        Digits look up SIDs, "first last" needs both names to match, anything else either name
+        :param limit: maximum number of results, all matches when None
+        :param fuzzy: after the substring matches, add names spelt like the text (see FieldIndex.similar)
+        :return: list of (SID, FIRST_NAME, LAST_NAME)
+        '''
+        text = normalize(text)
+        if not text:
+            return []
+        with self._lock:
+            if text.isdigit():
+                candidates = self._fields['SID'].matches(text)
+            elif text.count(' ') == 1:
+                first, last = text.split(' ')
+                candidates = (sid for sid in self._fields['FIRST_NAME'].matches(first)
+                              if last in self._value(sid, 'LAST_NAME'))
+            else:
+                candidates = self._either(text)
+            if fuzzy and not text.isdigit():
+                candidates = itertools.chain(candidates, self._similar(text))
+
+            results = []
+            seen = set()
+            for sid in candidates:
+                if sid in seen:
+                    continue
+                seen.add(sid)
+                results.append((sid, self.get(sid, 'FIRST_NAME'), self.get(sid, 'LAST_NAME')))
+                if limit is not None and len(results) >= limit:
+                    break
+            return results
+
+    def query(self, text, offset=0, limit=20):
+        '''
+        Ranked search, every term has to match. A term is either free text, looked up in every field,
+        or scoped to fields as alias:text (see FIELD_ALIASES). Each term scores its best match in a survivor,
+        an exact value over a prefix over a substring, times the weight of the field.
+        :return: total number of matches, list of (SID, score, matched fields) for the requested page
+        '''
+        terms = self.parse(text)
+        if not terms:
+            return 0, []
+        with self._lock:
+            totals = None
+            matched = defaultdict(set)
+            for fields, term in terms:
+                scores = {}
+                for field in fields:
+                    # only number-like terms are looked up as phone numbers, not the digits of any term
+                    if field == 'PHONE_NUMBER' and not PHONE_TERM.match(term):
+                        continue
+                    value = normalize_field(field, term)
+                    if not value:
+                        continue
+                    for sid, match in self._fields[field].scored(value).items():
+                        score = match * FIELD_WEIGHTS[field]
+                        if score > scores.get(sid, 0):
+                            scores[sid] = score
+                        matched[sid].add(field)
+                if totals is None:
+                    totals = scores
+                else:
+                    totals = {sid: score + scores[sid] for sid, score in totals.items() if sid in scores}
+                if not totals:
+                    return 0, []
+
+            ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+            page = ranked[offset:offset + limit]
+            return len(ranked), [(sid, score, sorted(matched[sid])) for sid, score in page]
+
+    @staticmethod
+    def parse(text):
+        '''
+        Splits a query into (fields, term) pairs, unknown aliases are searched as free text
+        '''
+        terms = []
+        for token in (text or '').split():
+            alias, _, term = token.partition(':')
+            if term and alias.lower() in FIELD_ALIASES:
+                terms.append((FIELD_ALIASES[alias.lower()], term))
+            else:
+                terms.append((SurvivorSearchIndex.FIELDS, token))
+        return terms
+
+    def _either(self, text):
+        # survivors whose first or last name starts with text, then those containing it elsewhere
+        first = self._fields['FIRST_NAME']
+        last = self._fields['LAST_NAME']
+        for field in (first, last):
+            for value in field.prefixed(text):
+                yield from field.sids[value]
+        for field in (first, last):
+            for value in field.containing(text):
+                yield from field.sids[value]
+
+    def _similar(self, text):
+        # survivors with names spelt like text, closest spellings first
+        if text.count(' ') == 1:
+            first, last = text.split(' ')
+            lasts = self._fields['LAST_NAME'].similar(last) if last else None
+            for value, _ in sorted(self._fields['FIRST_NAME'].similar(first).items(), key=lambda item: (item[1], item[0])):
+                for sid in self._fields['FIRST_NAME'].sids[value]:
+                    if lasts is None or self._value(sid, 'LAST_NAME') in lasts \
+                            or last in self._value(sid, 'LAST_NAME'):
+                        yield sid
+            return
+        similar = []
+        for field in ('FIRST_NAME', 'LAST_NAME'):
+            for value, distance in self._fields[field].similar(text).items():
+                similar.append((distance, value, field))
+        for distance, value, field in sorted(similar):
+            yield from self._fields[field].sids[value]
+
+    def _value(self, sid, field):
+        values = self._documents[sid]['values'].get(field)
+        return values[0] if values else ''
+
+    def _update(self, sid, fields):
+        sid = int(sid)
+        document = self._documents.get(sid)
+        if document is None:
+            document = self._documents[sid] = {'values': {}, 'display': {}}
+            fields = dict(fields, SID=sid)
+        for field, value in fields.items():
+            if field not in self._fields:
+                continue
+            for old in document['values'].get(field, ()):
+                self._fields[field].remove(old, sid)
+            raw = value if isinstance(value, (list, tuple)) else [value]
+            values = tuple(v for v in (normalize_field(field, item) for item in raw) if v)
+            # names and SIDs are always indexed, an empty name still matches what LIKE '%%' matched
+            if not values and field in ('SID', 'FIRST_NAME', 'LAST_NAME'):
+                values = ('',)
+            for v in values:
+                self._fields[field].add(v, sid)
+            document['values'][field] = values
+            document['display'][field] = value
@@ -0,0 +1,154 @@
+# Reads survivor onboarding spreadsheets one row at a time and maps every row onto the survivor columns
+import codecs
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+
+from configurations import EXCEL_TO_COLUMN_MAP
+
+# columns a survivor cannot be added without, the other NOT NULL columns get an empty value
+REQUIRED_COLUMNS = ['SID', 'FIRST_NAME', 'GENDER', 'HOSPITAL_NAME', 'HOSPITAL_REGNO', 'CANCER_TYPE', 'ADDRESS']
+DATE_COLUMNS = {'DATE_OF_BIRTH', 'ADMISSION_DATE', 'HOSPITAL_REGDATE', 'FATHER_DOB', 'MOTHER_DOB'}
+INTEGER_COLUMNS = {'SID', 'FATHER_INCOME_MONTHLY', 'MOTHER_INCOME_MONTHLY'}
+DATE_FORMATS = ['%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d', '%d/%m/%y']
+
+CONTACT_HEADER = re.compile(r'^Contact No(\d+)$')
+RELATION_HEADER = 'Relation to Patient-'
+
+# header of every column for the error messages, the first one for the columns of several headers
+COLUMN_HEADERS = {}
+for _header, _column in EXCEL_TO_COLUMN_MAP.items():
+    COLUMN_HEADERS.setdefault(_column, _header)
+
+
+class UnsupportedFile(Exception):
+    pass
+
+
+def read_rows(file, filename):
+    '''
+    Opens an onboarding spreadsheet and checks its header row, the data rows are read while they are iterated
+    so that the file is never held in memory as a whole
+    :param file: binary file object, the stream of the uploaded file
+    :param filename: name of the uploaded file, its extension tells the format (.xlsx or .csv)
+    :return: iterator of (row number in the sheet, {header: value}), blank rows left out
+    '''
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'csv':
+        reader = csv.reader(codecs.getreader('utf-8-sig')(file))
+    elif extension in ('xlsx', 'xlsm'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise UnsupportedFile('Excel files cannot be read without openpyxl installed, upload a .csv instead')
+        # read-only workbooks parse the sheet lazily instead of loading every cell
+        try:
+            workbook = load_workbook(file, read_only=True, data_only=True)
+        except zipfile.BadZipFile:
+            raise ValueError('%s is not an Excel workbook' % filename)
+        reader = workbook.active.iter_rows(values_only=True)
+    else:
+        raise UnsupportedFile('Only .xlsx and .csv files can be imported')
+    headers = [str(header).strip() if header is not None else '' for header in next(reader, [])]
+    missing = [COLUMN_HEADERS[column] for column in REQUIRED_COLUMNS if COLUMN_HEADERS[column] not in headers]
+    if missing:
+        raise ValueError('Missing columns: ' + ', '.join(missing))
+    return _data_rows(reader, headers)
+
+
+def _data_rows(reader, headers):
+    for number, values in enumerate(reader, 2):
+        row = {header: value for header, value in zip(headers, values) if header and not _blank(value)}
+        if row:
+            yield number, row
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _text(value):
+    # numeric cells come as 400012.0 from Excel
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.strftime('%d/%m/%Y')
+    return str(value).strip()
+
+
+def _integer(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, int):
+        return value
+    return int(str(value).strip().replace(',', ''))
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _text(value)
+    for dateFormat in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, dateFormat).date()
+        except ValueError:
+            continue
+    raise ValueError
+
+
+def map_row(row):
+    '''
+    Converts a spreadsheet row into survivor column values
+    :param row: {header: value} as yielded by read_rows
+    :return: ({column: value}, [(phone number, relation)], [error messages])
+    '''
+    record = {}
+    contacts = []
+    errors = []
+    for header, value in row.items():
+        match = CONTACT_HEADER.match(header)
+        if match:
+            relation = row.get(RELATION_HEADER + match.group(1))
+            if relation is None:
+                errors.append('%s has no %s' % (header, RELATION_HEADER + match.group(1)))
+            else:
+                contacts.append((_text(value), _text(relation)))
+            continue
+        column = EXCEL_TO_COLUMN_MAP.get(header)
+        if column is None or column == 'CONTACT_RELATION':
+            continue
+        try:
+            if column in DATE_COLUMNS:
+                record[column] = _date(value)
+            elif column in INTEGER_COLUMNS:
+                record[column] = _integer(value)
+            else:
+                record[column] = _text(value)
+        except ValueError:
+            errors.append('%s: %r is not a valid %s' % (header, value, 'date' if column in DATE_COLUMNS else 'number'))
+    for column in REQUIRED_COLUMNS:
+        if column not in record and not any(COLUMN_HEADERS[column] in error for error in errors):
+            errors.append('%s is required' % COLUMN_HEADERS[column])
+    return record, contacts, errors
+
+
+def length_errors(records):
+    '''
+    Values longer than their column allows, which the database would reject for the whole chunk
+    :param records: model objects of one survivor
+    '''
+    errors = []
+    for record in records:
+        for column in record.__table__.columns:
+            value = getattr(record, column.key)
+            length = getattr(column.type, 'length', None)
+            if isinstance(value, str) and length and len(value) > length:
+                errors.append('%s: longer than %d characters' % (COLUMN_HEADERS.get(column.key, column.key), length))
+    return errors
@@ -0,0 +1,109 @@
+# Bounded cache of already verified bearer tokens
+import hashlib
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class VerifiedTokenCache(object):
+    '''
+    LRU cache of verified token claims keyed by a hash of the raw token.
+    Entries are kept only until the token's exp, so a cache hit is always a token that would still verify.
+    The caller's resolved NgoUsers identity can be kept alongside the claims for the same lifetime, or a shorter one.
+    The cache lives in the worker process, other workers keep their own entries.
+    '''
+
+    def __init__(self, maxsize=1024):
+        '''
+        :param maxsize: maximum number of tokens held, least recently used are evicted first
+        '''
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        '''
+        Returns the cached claims for a token or None if it was not verified before or has expired
+        '''
+        entry = self._entry(token, count=True)
+        return entry[0] if entry is not None else None
+
+    def put(self, token, claims):
+        '''
+        Stores the claims of a token that has just been verified
+        '''
+        if claims.get('exp') is None:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = [claims, None, None]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_user(self, token):
+        '''
+        Returns the identity resolved earlier for this token
+        :return: (True, identity) once resolved, the identity being None for a caller found unregistered,
+                 (False, None) if not resolved yet
+        '''
+        entry = self._entry(token)
+        if entry is None or entry[2] is None or time() >= entry[2]:
+            return False, None
+        return True, entry[1]
+
+    def set_user(self, token, user, ttl=None):
+        '''
+        Attaches the resolved identity to a cached token, it is dropped together with the token
+        :param user: identity of the caller, None when the caller is not registered
+        :param ttl: seconds the identity is kept for when shorter than the token's lifetime
+        '''
+        entry = self._entry(token)
+        if entry is not None:
+            entry[1] = user
+            entry[2] = entry[0]['exp'] if ttl is None else min(entry[0]['exp'], time() + ttl)
+
+    def forget_users(self):
+        '''
+        Drops every resolved identity, e.g. after a user was added or a user's role or active flag changed
+        '''
+        with self._lock:
+            for entry in self._entries.values():
+                entry[1] = None
+                entry[2] = None
+
+    def _entry(self, token, count=False):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time() < entry[0]['exp']:
+                self._entries.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry
+            if entry is not None:
+                del self._entries[key]
+            if count:
+                self.misses += 1
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0
+            }